@@ -0,0 +1,108 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import logging
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from ogion import config
+
+log = logging.getLogger(__name__)
+
+
+class BackupIndex:
+    """Local index of backups uploaded to provider, one file per target.
+
+    Updated after every upload and cleanup, so cleanup does not list all
+    backups in provider on every run. Index is reconciled with real listing
+    every BACKUP_INDEX_RECONCILE_HOURS or when provider location changes.
+    """
+
+    def __init__(self, provider_name: str, location: str) -> None:
+        self.provider_name = provider_name
+        self.location = location
+
+    def path(self, env_name: str) -> Path:
+        return (
+            config.CONST_CONFIG_FOLDER_PATH
+            / f"{env_name}.{self.provider_name}.index.json"
+        )
+
+    def _load(self, env_name: str) -> dict[str, Any] | None:
+        path = self.path(env_name)
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        except ValueError as err:
+            log.warning("ignoring invalid backup index %s: %s", path, err)
+            return None
+        if (
+            not isinstance(data, dict)
+            or data.get("location") != self.location
+            or not isinstance(data.get("backups"), dict)
+        ):
+            log.info("backup index %s is outdated, it will be reconciled", path)
+            return None
+        return data
+
+    def _save(self, env_name: str, data: dict[str, Any]) -> None:
+        path = self.path(env_name)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(path)
+
+    def add(self, env_name: str, key: str, size: int, md5: str | None) -> None:
+        data = self._load(env_name)
+        if data is None:
+            # backup is included when index is created from listing
+            return
+        data["backups"][key] = {"size": size, "uploaded_at": time.time(), "md5": md5}
+        self._save(env_name, data)
+
+    def remove(self, env_name: str, keys: list[str]) -> None:
+        data = self._load(env_name)
+        if data is None:
+            return
+        for key in keys:
+            data["backups"].pop(key, None)
+        self._save(env_name, data)
+
+    def backup_keys(
+        self, env_name: str, list_backups: Callable[[], list[str]]
+    ) -> list[str]:
+        """Keys of all backups of target, `list_backups` is called only to reconcile."""
+        data = self._load(env_name)
+        max_age_secs = config.options.BACKUP_INDEX_RECONCILE_HOURS * 3600
+        if data is None or time.time() - data.get("reconciled_at", 0) >= max_age_secs:
+            data = self._reconcile(env_name, data, list_backups())
+        else:
+            log.debug("using backup index %s", self.path(env_name))
+        return list(data["backups"])
+
+    def _reconcile(
+        self, env_name: str, data: dict[str, Any] | None, keys: list[str]
+    ) -> dict[str, Any]:
+        indexed: dict[str, Any] = data["backups"] if data is not None else {}
+        backups = {
+            key: indexed.get(key, {"size": None, "uploaded_at": None, "md5": None})
+            for key in keys
+        }
+        log.info(
+            "reconciled backup index of %s with %s listed backups: "
+            "%s were missing in index, %s no longer exist",
+            env_name,
+            len(keys),
+            len(backups.keys() - indexed.keys()),
+            len(indexed.keys() - backups.keys()),
+        )
+        data = {
+            "location": self.location,
+            "reconciled_at": time.time(),
+            "backups": backups,
+        }
+        self._save(env_name, data)
+        return data
@@ -43,6 +43,10 @@ class BaseBackupTarget(ABC):
     def min_retention_days(self) -> int:
         return self.target_model.min_retention_days
 
+    @property
+    def zip_archive_threads(self) -> int:
+        return self.target_model.zip_archive_threads
+
     @final
     def make_backup(self) -> Path:
         try:
@@ -62,14 +66,16 @@ class BaseBackupTarget(ABC):
         return next_backup
 
     @final
-    def next_backup(self) -> bool:
-        backup_time = self._get_next_backup_time()
-        if backup_time > self.next_backup_time:
-            self.last_backup_time = self.next_backup_time
-            self.next_backup_time = backup_time
-            return True
+    def schedule_next_backup(self) -> None:
+        self.last_backup_time = self.next_backup_time
+        self.next_backup_time = self._get_next_backup_time()
+
+    def is_unchanged_since_last_backup(self, provider_location: str) -> bool:
         return False
 
+    def mark_backup_uploaded(self) -> None:
+        pass
+
     @abstractmethod
     def _backup(self) -> Path:  # pragma: no cover
         pass
@@ -2,9 +2,10 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
+from functools import partial
 from pathlib import Path
 
-from ogion import core
+from ogion import core, fingerprint, incremental, tar_stream
 from ogion.backup_targets.base_target import BaseBackupTarget
 from ogion.models.backup_target_models import DirectoryTargetModel
 
@@ -15,14 +16,53 @@ class Folder(BaseBackupTarget):
     def __init__(self, target_model: DirectoryTargetModel) -> None:
         super().__init__(target_model)
         self.target_model: DirectoryTargetModel = target_model
+        self.fingerprint_cache = fingerprint.FingerprintCache(
+            self.env_name, self.target_model.abs_path
+        )
+        self.incremental_backup = incremental.IncrementalBackup(
+            self.env_name,
+            self.target_model.abs_path,
+            self.target_model.full_backup_every,
+        )
+
+    def is_unchanged_since_last_backup(self, provider_location: str) -> bool:
+        if not self.target_model.skip_unchanged:
+            return False
+        return self.fingerprint_cache.is_unchanged(provider_location)
+
+    def mark_backup_uploaded(self) -> None:
+        if self.target_model.skip_unchanged:
+            self.fingerprint_cache.commit()
+        if self.target_model.incremental:
+            self.incremental_backup.commit()
 
     def _backup(self) -> Path:
         escaped_foldername = core.safe_text_version(self.target_model.abs_path.name)
 
+        if self.target_model.incremental:
+            if not self.incremental_backup.next_backup_is_full():
+                out_file = core.get_new_backup_path(
+                    self.env_name, f"{escaped_foldername}_diff"
+                )
+                log.debug("start differential backup in: %s", out_file)
+                self.incremental_backup.create_differential_backup(out_file)
+                log.debug("finished differential backup, output: %s", out_file)
+                return out_file
+            escaped_foldername = f"{escaped_foldername}_full"
+
         out_file = core.get_new_backup_path(self.env_name, escaped_foldername)
 
-        shell_create_dir_symlink = f"ln -s {self.target_model.abs_path} {out_file}"
-        log.debug("start ln in subprocess: %s", shell_create_dir_symlink)
-        core.run_subprocess(shell_create_dir_symlink)
-        log.debug("finished ln, output: %s", out_file)
+        if self.target_model.streaming:
+            log.debug("start tar streaming to zip archive: %s", out_file)
+            out_zip_file = core.run_create_zip_archive_from_writer(
+                partial(tar_stream.write_tar_stream, self.target_model.abs_path),
+                out_file.with_suffix(".tar"),
+            )
+            log.debug("finished tar streaming, output: %s", out_zip_file)
+            return out_zip_file
+
+        out_file.symlink_to(self.target_model.abs_path)
+        log.debug("created symlink %s to %s", out_file, self.target_model.abs_path)
+        if self.target_model.incremental:
+            self.incremental_backup.start_full_backup(out_file)
         return out_file
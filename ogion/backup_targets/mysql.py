@@ -2,18 +2,22 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import hashlib
+import json
 import logging
 import re
 import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from ogion import config, core
+from ogion import config, core, db_probes
 from ogion.backup_targets.base_target import BaseBackupTarget
 from ogion.models.backup_target_models import MySQLTargetModel
 
 log = logging.getLogger(__name__)
 
 VERSION_REGEX = re.compile(r"\d*\.\d*\.\d*")
+MANIFEST_NAME = "manifest.json"
 
 
 class MySQL(BaseBackupTarget):
@@ -26,6 +30,7 @@ class MySQL(BaseBackupTarget):
         self.target_model: MySQLTargetModel = target_model
         self.db_name = shlex.quote(self.target_model.db)
         self.option_file: Path = self._init_option_file()
+        self.probe = db_probes.mysql_probe(target_model)
         self.db_version: str = self._mysql_connection()
 
     def _init_option_file(self) -> Path:
@@ -54,7 +59,7 @@ class MySQL(BaseBackupTarget):
     def _mysql_connection(self) -> str:
         try:
             log.debug("check mysql installation")
-            mysql_version = core.run_subprocess("mysql -V")
+            mysql_version = core.client_version("mysql -V")
             log.debug("output: %s", mysql_version)
         except core.CoreSubprocessError as version_err:  # pragma: no cover
             log.critical(
@@ -66,13 +71,16 @@ class MySQL(BaseBackupTarget):
             raise
         log.debug("start mysql connection")
         try:
-            result = core.run_subprocess(
-                f"mariadb --defaults-file={self.option_file} {self.db_name} "
-                "--execute='SELECT version();'",
-            )
-        except core.CoreSubprocessError as err:
+            if self.probe is not None:
+                result = self.probe.version()
+            else:
+                result = core.run_subprocess(
+                    f"mariadb --defaults-file={self.option_file} {self.db_name} "
+                    "--execute='SELECT version();'",
+                )
+        except Exception as err:
             log.error(err, exc_info=True)
-            log.error("unable to connect to database, exiting")
+            log.error("unable to connect to database of target `%s`", self.env_name)
             raise
 
         version = None
@@ -91,7 +99,78 @@ class MySQL(BaseBackupTarget):
         log.info("mysql_connection calculated version: %s", version)
         return version
 
+    def _list_tables(self) -> list[str]:
+        result = core.run_subprocess(
+            f"mariadb --defaults-file={self.option_file} {self.db_name} "
+            "--batch --skip-column-names "
+            "--execute=\"SHOW FULL TABLES WHERE Table_type = 'BASE TABLE';\"",
+        )
+        return [line.split("\t")[0] for line in result.splitlines() if line]
+
+    def _backup_parallel(self, out_path: Path, shell_mysqldump_db: str) -> Path:
+        """Dump data of every table in separate mysqldump process, `jobs` at once.
+
+        Every table is dumped in its own transaction, so tables are consistent
+        on their own, but not with each other. Schema and triggers are dumped
+        to separate files, so triggers do not fire when data is restored.
+        """
+        jobs = self.target_model.jobs
+        out_path.mkdir(mode=0o700)
+        try:
+            (out_path / "tables").mkdir(mode=0o700)
+            tables = {
+                table: f"tables/{number:05d}_{core.safe_text_version(table)}.sql"
+                for number, table in enumerate(self._list_tables(), start=1)
+            }
+
+            core.run_subprocess(
+                f"{shell_mysqldump_db} --no-data --skip-triggers --routines --events "
+                f"--result-file={out_path / 'schema.sql'} {self.db_name}"
+            )
+            log.info("start mysqldump of %s tables with %s jobs", len(tables), jobs)
+            with ThreadPoolExecutor(
+                max_workers=jobs, thread_name_prefix=threading.current_thread().name
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        core.run_subprocess,
+                        f"{shell_mysqldump_db} --single-transaction --no-create-info "
+                        f"--skip-triggers --result-file={out_path / table_file} "
+                        f"{self.db_name} {shlex.quote(table)}",
+                    )
+                    for table, table_file in tables.items()
+                ]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    executor.shutdown(cancel_futures=True)
+                    raise
+            core.run_subprocess(
+                f"{shell_mysqldump_db} --no-data --no-create-info --triggers "
+                f"--result-file={out_path / 'triggers.sql'} {self.db_name}"
+            )
+
+            manifest = {
+                "db": self.target_model.db,
+                "version": self.db_version,
+                "schema": "schema.sql",
+                "tables": tables,
+                "triggers": "triggers.sql",
+            }
+            (out_path / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+        except BaseException:
+            # partial dump of timed out or failed table must not be left behind
+            core.remove_path(out_path)
+            raise
+        log.debug("finished mysqldump, output: %s", out_path)
+        return out_path
+
     def _backup(self) -> Path:
+        if self.probe is not None:
+            # in process check is cheap, unavailable database fails backup early
+            self.db_version = self._mysql_connection()
+
         escaped_dbname = core.safe_text_version(self.target_model.db)
         escaped_version = core.safe_text_version(self.db_version)
         name = f"{escaped_dbname}_{escaped_version}"
@@ -99,8 +178,26 @@ class MySQL(BaseBackupTarget):
         out_file = core.get_new_backup_path(self.env_name, name).with_suffix(".sql")
 
         shell_mysqldump_db = (
-            f"mariadb-dump --defaults-file={self.option_file} "
-            f"--result-file={out_file} --verbose {self.db_name}"
+            f"mariadb-dump --defaults-file={self.option_file} --verbose"
+        )
+        if self.target_model.jobs > 1:
+            return self._backup_parallel(
+                out_file.with_suffix(".dir"), shell_mysqldump_db
+            )
+
+        if self.target_model.streaming:
+            shell_mysqldump_db = f"{shell_mysqldump_db} {self.db_name}"
+            log.debug(
+                "start mysqldump streaming to zip archive: %s", shell_mysqldump_db
+            )
+            out_zip_file = core.run_create_zip_archive_from_stdout(
+                shell_mysqldump_db, out_file
+            )
+            log.debug("finished mysqldump, output: %s", out_zip_file)
+            return out_zip_file
+
+        shell_mysqldump_db = (
+            f"{shell_mysqldump_db} --result-file={out_file} {self.db_name}"
         )
         log.debug("start mysqldump in subprocess: %s", shell_mysqldump_db)
         core.run_subprocess(shell_mysqldump_db)
@@ -8,13 +8,16 @@ import shlex
 import urllib.parse
 from pathlib import Path
 
-from ogion import config, core
+from ogion import config, core, db_probes
 from ogion.backup_targets.base_target import BaseBackupTarget
 from ogion.models.backup_target_models import PostgreSQLTargetModel
 
 log = logging.getLogger(__name__)
 
 VERSION_REGEX = re.compile(r"PostgreSQL \d*\.\d* ")
+# pg_dump directory format writes a folder of per-table files, it is
+# archived as a whole like directory targets
+DUMP_FORMAT_SUFFIX = {"plain": ".sql", "custom": ".dump", "directory": ".dir"}
 
 
 class PostgreSQL(BaseBackupTarget):
@@ -25,6 +28,7 @@ class PostgreSQL(BaseBackupTarget):
         super().__init__(target_model)
         self.target_model: PostgreSQLTargetModel = target_model
         self.escaped_conn_uri: str = self._get_escaped_conn_uri()
+        self.probe = db_probes.postgres_probe(target_model)
         self.db_version: str = self._postgres_connection()
 
     def _init_pgpass_file(self) -> Path:
@@ -71,7 +75,7 @@ class PostgreSQL(BaseBackupTarget):
     def _postgres_connection(self) -> str:
         try:
             log.debug("check psql installation")
-            psql_version = core.run_subprocess("psql -V")
+            psql_version = core.client_version("psql -V")
             log.debug("output: %s", psql_version)
         except core.CoreSubprocessError as version_err:  # pragma: no cover
             log.critical(
@@ -83,12 +87,15 @@ class PostgreSQL(BaseBackupTarget):
             raise
         log.debug("start postgres connection")
         try:
-            result = core.run_subprocess(
-                f"psql -d {self.escaped_conn_uri} -w --command 'SELECT version();'",
-            )
-        except core.CoreSubprocessError as err:
+            if self.probe is not None:
+                result = self.probe.version()
+            else:
+                result = core.run_subprocess(
+                    f"psql -d {self.escaped_conn_uri} -w --command 'SELECT version();'",
+                )
+        except Exception as err:
             log.error(err, exc_info=True)
-            log.error("unable to connect to database, exiting")
+            log.error("unable to connect to database of target `%s`", self.env_name)
             raise
 
         version = None
@@ -108,16 +115,35 @@ class PostgreSQL(BaseBackupTarget):
         return version
 
     def _backup(self) -> Path:
+        if self.probe is not None:
+            # in process check is cheap, unavailable database fails backup early
+            self.db_version = self._postgres_connection()
+
         escaped_dbname = core.safe_text_version(self.target_model.db)
         escaped_version = core.safe_text_version(self.db_version)
         name = f"{escaped_dbname}_{escaped_version}"
 
-        out_file = core.get_new_backup_path(self.env_name, name).with_suffix(".sql")
+        dump_format = self.target_model.dump_format
+        out_file = core.get_new_backup_path(self.env_name, name).with_suffix(
+            DUMP_FORMAT_SUFFIX[dump_format]
+        )
 
         shell_pg_dump_db = (
-            f"pg_dump --clean --if-exists -v -O -d "
-            f"{self.escaped_conn_uri} -f {out_file}"
+            f"pg_dump --clean --if-exists -v -O -d {self.escaped_conn_uri} "
+            f"--format={dump_format}"
         )
+        if dump_format == "directory":
+            shell_pg_dump_db = f"{shell_pg_dump_db} --jobs={self.target_model.jobs}"
+
+        if self.target_model.streaming:
+            log.debug("start pg_dump streaming to zip archive: %s", shell_pg_dump_db)
+            out_zip_file = core.run_create_zip_archive_from_stdout(
+                shell_pg_dump_db, out_file
+            )
+            log.debug("finished pg_dump, output: %s", out_zip_file)
+            return out_zip_file
+
+        shell_pg_dump_db = f"{shell_pg_dump_db} -f {out_file}"
         log.debug("start pg_dump in subprocess: %s", shell_pg_dump_db)
         core.run_subprocess(shell_pg_dump_db)
         log.debug("finished pg_dump, output: %s", out_file)
@@ -3,6 +3,7 @@
 
 import logging
 import logging.config
+import os
 import socket
 from enum import StrEnum
 from functools import cached_property
@@ -50,14 +51,30 @@ class Settings(BaseSettings):
     ZIP_ARCHIVE_PASSWORD: SecretStr
     INSTANCE_NAME: str = socket.gethostname()
     ZIP_SKIP_INTEGRITY_CHECK: bool = False
+    ZIP_INTEGRITY_CHECK: Literal["test", "checksum"] = "test"
     CPU_ARCH: Literal["amd64", "arm64"] = Field(
         default="amd64", alias_priority=2, alias="OGION_CPU_ARCHITECTURE"
     )
     SUBPROCESS_TIMEOUT_SECS: float = Field(ge=5, le=3600 * 24, default=3600)
+    SUBPROCESS_OUTPUT_TAIL_KB: int = Field(ge=1, le=1024 * 1024, default=64)
     SIGTERM_TIMEOUT_SECS: float = Field(ge=0, le=3600 * 24, default=30)
     ZIP_ARCHIVE_LEVEL: int = Field(ge=1, le=9, default=3)
+    ZIP_ARCHIVE_FORMAT: Literal["zip", "7z"] = "zip"
+    BACKUP_WORKERS: int = Field(ge=1, le=256, default=4)
+    SETUP_TARGETS_WORKERS: int = Field(ge=1, le=256, default=8)
+    ZIP_ARCHIVE_WORKERS: int = Field(ge=1, le=256, default=2)
+    ZIP_ARCHIVE_THREADS: int = Field(ge=1, le=1024, default=1)
+    ZIP_ARCHIVE_MAX_THREADS: int = Field(ge=1, le=1024, default=os.cpu_count() or 1)
+    UPLOAD_WORKERS: int = Field(ge=1, le=256, default=4)
+    IO_WORKERS: int = Field(ge=1, le=1024, default=32)
+    UPLOAD_MAX_BANDWIDTH: int | None = Field(ge=1, default=None)
+    UPLOAD_MEMORY_BUDGET_MB: int | None = Field(ge=1, default=None)
     BACKUP_MAX_NUMBER: int = Field(ge=1, le=998, default=7)
     BACKUP_MIN_RETENTION_DAYS: int = Field(ge=0, le=36600, default=3)
+    BACKUP_INDEX_RECONCILE_HOURS: float = Field(ge=0, le=24 * 365, default=24)
+    METRICS_PORT: int | None = Field(ge=1, le=65535, default=None)
+    METRICS_FILE: Path | None = None
+    NOTIFICATIONS_DIGEST_SECS: float = Field(ge=0, le=3600, default=3)
     DISCORD_WEBHOOK_URL: HttpUrl | None = None
     DISCORD_MAX_MSG_LEN: int = Field(ge=150, le=10000, default=1500)
     SLACK_WEBHOOK_URL: HttpUrl | None = None
@@ -78,6 +95,15 @@ class Settings(BaseSettings):
     def smtp_addresses(self) -> list[str]:
         return self.SMTP_TO_ADDRS.split(",")
 
+    @model_validator(mode="after")
+    def check_zip_integrity_check(self) -> Self:
+        if self.ZIP_INTEGRITY_CHECK == "checksum" and self.ZIP_ARCHIVE_FORMAT == "7z":
+            raise ValueError(
+                "ZIP_INTEGRITY_CHECK=checksum cannot be used with "
+                "ZIP_ARCHIVE_FORMAT=7z, 7-zip can write only zip archives to stdout"
+            )
+        return self
+
     @model_validator(mode="after")
     def check_smtp_setup(self) -> Self:
         smtp_settings = [self.SMTP_HOST, self.SMTP_FROM_ADDR, self.SMTP_TO_ADDRS]
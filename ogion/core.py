@@ -1,6 +1,9 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import collections
+import hashlib
+import io
 import logging
 import logging.config
 import os
@@ -9,13 +12,27 @@ import secrets
 import shlex
 import shutil
 import subprocess
+import time
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
 from datetime import UTC, datetime, timedelta
 from pathlib import Path
-from typing import Any, TypeVar
+from threading import (
+    BoundedSemaphore,
+    Condition,
+    Lock,
+    Thread,
+    Timer,
+    current_thread,
+)
+from typing import IO, Any, TypeVar
+from weakref import WeakSet
 
 from pydantic import BaseModel
 
-from ogion import config
+from ogion import config, metrics
 from ogion.models import backup_target_models, models_mapping, upload_provider_models
 
 log = logging.getLogger(__name__)
@@ -24,33 +41,243 @@ SAFE_LETTER_PATTERN = re.compile(r"[^A-Za-z0-9_]*")
 DATETIME_BACKUP_FILE_PATTERN = re.compile(r"_[0-9]{8}_[0-9]{4}_")
 
 _BM = TypeVar("_BM", bound=BaseModel)
+_T = TypeVar("_T")
+_R = TypeVar("_R")
 
 
 class CoreSubprocessError(Exception):
     pass
 
 
+class ZipArchiveIntegrityError(Exception):
+    pass
+
+
+class ResourceBudget:
+    """Semaphore where each holder takes its own amount, like threads or bytes.
+
+    Waiters are served in order, so big requests are not starved by
+    smaller ones. Requests bigger than total get the whole budget.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self._free = total
+        self._waiters: collections.deque[object] = collections.deque()
+        self._condition = Condition()
+
+    @contextmanager
+    def acquire(self, amount: int) -> Generator[int, None, None]:
+        amount = min(amount, self.total)
+        ticket = object()
+        with self._condition:
+            self._waiters.append(ticket)
+            self._condition.wait_for(
+                lambda: self._waiters[0] is ticket and self._free >= amount
+            )
+            self._waiters.popleft()
+            self._free -= amount
+            self._condition.notify_all()
+        try:
+            yield amount
+        finally:
+            with self._condition:
+                self._free += amount
+                self._condition.notify_all()
+
+
+class BandwidthLimiter:
+    """Limit of bytes per second read by all upload streams sharing it.
+
+    Every read reserves the next free time slot for its bytes, so concurrent
+    uploads split the bandwidth instead of each using the whole limit.
+    """
+
+    def __init__(self, max_bandwidth: int | None) -> None:
+        self.max_bandwidth = max_bandwidth
+        self._next_free = 0.0
+        self._lock = Lock()
+
+    def consume(self, size: int) -> None:
+        if self.max_bandwidth is None or size <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_free)
+            self._next_free = start + size / self.max_bandwidth
+        if start > now:
+            time.sleep(start - now)
+
+
+# shared by all running backups, upload always acquired before zip archive
+zip_archive_slots = BoundedSemaphore(config.options.ZIP_ARCHIVE_WORKERS)
+zip_archive_thread_budget = ResourceBudget(config.options.ZIP_ARCHIVE_MAX_THREADS)
+upload_slots = BoundedSemaphore(config.options.UPLOAD_WORKERS)
+upload_bandwidth = BandwidthLimiter(config.options.UPLOAD_MAX_BANDWIDTH)
+upload_memory_budget = (
+    ResourceBudget(config.options.UPLOAD_MEMORY_BUDGET_MB * 1024 * 1024)
+    if config.options.UPLOAD_MEMORY_BUDGET_MB is not None
+    else None
+)
+_zip_archive_md5: dict[Path, str] = {}
+_zip_archive_md5_lock = Lock()
+# set by backup target for archives created during its backup
+zip_archive_threads: ContextVar[int | None] = ContextVar(
+    "zip_archive_threads", default=None
+)
+# network requests of all backups and notifications, see IO_WORKERS
+io_threads: WeakSet[Thread] = WeakSet()
+io_executor = ThreadPoolExecutor(
+    max_workers=config.options.IO_WORKERS,
+    thread_name_prefix="io",
+    initializer=lambda: io_threads.add(current_thread()),
+)
+
+
+def _run_in_io_thread(thread_name: str, func: Callable[[_T], _R], item: _T) -> _R:
+    # logs of io thread show target it works for
+    thread = current_thread()
+    io_thread_name = thread.name
+    thread.name = thread_name
+    try:
+        return func(item)
+    finally:
+        thread.name = io_thread_name
+
+
+def map_io(func: Callable[[_T], _R], items: Iterable[_T], max_workers: int) -> list[_R]:
+    """Run `func` for items on shared io threads, at most `max_workers` at once.
+
+    Results are returned in order of items. After first failure no more items
+    are started, running ones are awaited and the error is raised.
+    """
+    thread_name = current_thread().name
+    pending = list(enumerate(items))
+    pending.reverse()
+    results: dict[int, _R] = {}
+    running: dict[Future[_R], int] = {}
+    errors: list[Exception] = []
+    while running or (pending and not errors):
+        while pending and not errors and len(running) < max_workers:
+            index, item = pending.pop()
+            future = io_executor.submit(_run_in_io_thread, thread_name, func, item)
+            running[future] = index
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = running.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as err:
+                errors.append(err)
+    if errors:
+        raise errors[0]
+    return [results[index] for index in sorted(results)]
+
+
+_client_versions: dict[str, Future[str]] = {}
+_client_versions_lock = Lock()
+
+
+def client_version(command: str) -> str:
+    """Output of database client version command like `psql -V`, run once.
+
+    Different commands run at the same time, callers of command that is
+    already running wait for its result.
+    """
+    with _client_versions_lock:
+        future = _client_versions.get(command)
+        run = future is None
+        if future is None:
+            future = _client_versions[command] = Future()
+    if run:
+        try:
+            future.set_result(run_subprocess(command))
+        except Exception as err:
+            # failed command is run again by next caller
+            with _client_versions_lock:
+                del _client_versions[command]
+            future.set_exception(err)
+    return future.result()
+
+
+class OutputTail:
+    """Last bytes of subprocess output, see SUBPROCESS_OUTPUT_TAIL_KB.
+
+    Whole output is streamed to debug log line by line, only its tail is
+    kept in memory for error messages.
+    """
+
+    def __init__(self) -> None:
+        self.max_bytes = config.options.SUBPROCESS_OUTPUT_TAIL_KB * 1024
+        self.truncated = False
+        self._lines: collections.deque[bytes] = collections.deque()
+        self._size = 0
+
+    def append(self, line: bytes) -> None:
+        if len(line) > self.max_bytes:
+            line = line[-self.max_bytes :]
+            self.truncated = True
+        self._lines.append(line)
+        self._size += len(line)
+        while self._size > self.max_bytes:
+            self._size -= len(self._lines.popleft())
+            self.truncated = True
+
+    def text(self) -> str:
+        text = b"".join(self._lines).decode(errors="replace")
+        if self.truncated:
+            return f"(output truncated to last {self.max_bytes} bytes)\n{text}"
+        return text
+
+
+def _stream_output(stream: IO[bytes], tail: OutputTail, log_prefix: str) -> None:
+    log_lines = log.isEnabledFor(logging.DEBUG)
+    for line in iter(lambda: stream.readline(io.DEFAULT_BUFFER_SIZE), b""):
+        tail.append(line)
+        if log_lines:
+            log.debug("%s: %s", log_prefix, line.decode(errors="replace").rstrip())
+
+
 def run_subprocess(shell_args: str) -> str:
     log.debug("run_subprocess running: '%s'", shell_args)
+    process = subprocess.Popen(
+        shell_args, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert process.stdout and process.stderr
+    stdout: list[bytes] = []
+    stderr = OutputTail()
+    readers = [
+        Thread(target=_read_stream, args=(process.stdout, stdout), daemon=True),
+        Thread(
+            target=_stream_output,
+            args=(process.stderr, stderr, "run_subprocess stderr"),
+            daemon=True,
+        ),
+    ]
+    for reader in readers:
+        reader.start()
     try:
-        p = subprocess.run(
-            shell_args,
-            capture_output=True,
-            text=True,
-            shell=True,
-            timeout=config.options.SUBPROCESS_TIMEOUT_SECS,
-            check=True,
-        )
-    except subprocess.CalledProcessError as process_error:
-        log.error("run_subprocess failed with status %s", process_error.returncode)
-        log.error("run_subprocess stdout: %s", process_error.stdout)
-        log.error("run_subprocess stderr: %s", process_error.stderr)
-        raise CoreSubprocessError(process_error.stderr)
+        process.wait(timeout=config.options.SUBPROCESS_TIMEOUT_SECS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    stdout_text = b"".join(stdout).decode(errors="replace")
+    if process.returncode != 0:
+        log.error("run_subprocess failed with status %s", process.returncode)
+        log.error("run_subprocess stdout: %s", stdout_text)
+        log.error("run_subprocess stderr: %s", stderr.text())
+        raise CoreSubprocessError(stderr.text())
 
-    log.debug("run_subprocess finished with status %s", p.returncode)
-    log.debug("run_subprocess stdout: %s", p.stdout)
-    log.debug("run_subprocess stderr: %s", p.stderr)
-    return p.stdout
+    log.debug("run_subprocess finished with status %s", process.returncode)
+    log.debug("run_subprocess stdout: %s", stdout_text)
+    return stdout_text
 
 
 def remove_path(path: Path) -> None:
@@ -73,21 +300,62 @@ def get_new_backup_path(env_name: str, name: str) -> Path:
     return base_dir_path / new_file
 
 
-def run_create_zip_archive(backup_file: Path) -> Path:
-    out_file = Path(f"{backup_file}.zip")
-    log.info("start creating zip archive in subprocess: %s", backup_file)
+@contextmanager
+def use_zip_archive_threads(threads: int) -> Generator[None, None, None]:
+    token = zip_archive_threads.set(threads)
+    try:
+        yield
+    finally:
+        zip_archive_threads.reset(token)
+
+
+@contextmanager
+def reserve_upload_memory(size: int) -> Generator[None, None, None]:
+    """Wait for `size` bytes of UPLOAD_MEMORY_BUDGET_MB for upload buffers."""
+    if upload_memory_budget is None:
+        yield
+        return
+    with upload_memory_budget.acquire(size):
+        yield
+
+
+@contextmanager
+def _zip_archive_resources() -> Generator[int, None, None]:
+    threads = zip_archive_threads.get() or config.options.ZIP_ARCHIVE_THREADS
+    with (
+        zip_archive_slots,
+        zip_archive_thread_budget.acquire(threads) as granted_threads,
+    ):
+        yield granted_threads
+
+
+def _shell_create_7zip_archive(out_file: Path, args: str, threads: int) -> str:
     zip_escaped_password = shlex.quote(
         config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value()
     )
-    shell_create_7zip_archive = (
-        f"{config.options.seven_zip_bin_path} a -p{zip_escaped_password} "
-        f"-mx={config.options.ZIP_ARCHIVE_LEVEL} {out_file} {backup_file}"
+    archive_format = config.options.ZIP_ARCHIVE_FORMAT
+    # 7z format encrypts also file names in archive headers
+    encrypt_headers = " -mhe=on" if archive_format == "7z" else ""
+    return (
+        f"{config.options.seven_zip_bin_path} a -t{archive_format} "
+        f"-p{zip_escaped_password}{encrypt_headers} "
+        f"-mx={config.options.ZIP_ARCHIVE_LEVEL} -mmt={threads} {out_file} {args}"
     )
-    run_subprocess(shell_create_7zip_archive)
-    log.info("finished zip archive creating")
 
-    if config.options.ZIP_SKIP_INTEGRITY_CHECK:
-        return out_file
+
+def get_zip_archive_path(backup_file: Path) -> Path:
+    suffix = f".{config.options.ZIP_ARCHIVE_FORMAT}"
+    if backup_file.suffix == suffix:
+        return backup_file
+    return Path(f"{backup_file}{suffix}")
+
+
+def run_zip_archive_integrity_check(out_file: Path) -> None:
+    if (
+        config.options.ZIP_SKIP_INTEGRITY_CHECK
+        or config.options.ZIP_INTEGRITY_CHECK == "checksum"
+    ):
+        return
 
     log.info(
         (
@@ -96,6 +364,9 @@ def run_create_zip_archive(backup_file: Path) -> Path:
         ),
         out_file,
     )
+    zip_escaped_password = shlex.quote(
+        config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value()
+    )
     shell_7zip_archive_integriy_check = (
         f"{config.options.seven_zip_bin_path} t -p{zip_escaped_password} {out_file}"
     )
@@ -105,9 +376,459 @@ def run_create_zip_archive(backup_file: Path) -> Path:
             "zip arichive integrity test on %s: %s", out_file, integrity_check_result
         )
     log.info("finished zip archive integriy test")
+
+
+def use_checksum_integrity_check() -> bool:
+    return (
+        not config.options.ZIP_SKIP_INTEGRITY_CHECK
+        and config.options.ZIP_INTEGRITY_CHECK == "checksum"
+    )
+
+
+def _save_zip_archive_md5(out_file: Path, md5: str) -> None:
+    log.info("zip archive %s md5 computed while writing: %s", out_file, md5)
+    with _zip_archive_md5_lock:
+        _zip_archive_md5[out_file] = md5
+
+
+def pop_zip_archive_md5(zip_file: Path) -> str | None:
+    """Md5 of zip archive computed while it was written, see ZIP_INTEGRITY_CHECK."""
+    with _zip_archive_md5_lock:
+        return _zip_archive_md5.pop(zip_file, None)
+
+
+def verify_zip_archive_md5(
+    zip_file: Path, expected_md5: str, uploaded_md5: str | None
+) -> None:
+    """Compare md5 computed while writing archive with provider checksum."""
+    if uploaded_md5 is None:
+        raise ZipArchiveIntegrityError(
+            f"provider returned no md5 of uploaded {zip_file}, it cannot be verified"
+        )
+    if expected_md5 != uploaded_md5:
+        raise ZipArchiveIntegrityError(
+            f"zip archive {zip_file} md5 {expected_md5} does not match "
+            f"md5 {uploaded_md5} of uploaded file"
+        )
+    log.info("zip archive %s md5 matches uploaded file", zip_file)
+
+
+def run_create_zip_archive(backup_file: Path) -> Path:
+    out_file = get_zip_archive_path(backup_file)
+    if out_file == backup_file:
+        log.info("backup file %s is already zip archive, skip creating", backup_file)
+        return backup_file
+
+    with metrics.track_stage("archive"), _zip_archive_resources() as threads:
+        log.info("start creating zip archive in subprocess: %s", backup_file)
+        if use_checksum_integrity_check():
+            # archive is written to stdout, so it is hashed in the same pass
+            shell_create_7zip_archive = _shell_create_7zip_archive(
+                out_file, f"-so {backup_file}", threads
+            )
+            archiver = subprocess.Popen(
+                shell_create_7zip_archive,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            md5 = _wait_for_archiver(archiver, out_file, "run_create_zip_archive")
+            assert md5 is not None
+            _save_zip_archive_md5(out_file, md5)
+        else:
+            run_subprocess(
+                _shell_create_7zip_archive(out_file, str(backup_file), threads)
+            )
+        log.info("finished zip archive creating")
+
+        run_zip_archive_integrity_check(out_file)
+    return out_file
+
+
+def _read_stream(stream: IO[bytes], chunks: list[bytes]) -> None:
+    for chunk in iter(lambda: stream.read(io.DEFAULT_BUFFER_SIZE), b""):
+        chunks.append(chunk)
+
+
+def _write_stream(stream: IO[bytes], out_file: Path, md5: "hashlib._Hash") -> None:
+    with open(out_file, "wb") as archive_file:
+        for chunk in iter(lambda: stream.read(io.DEFAULT_BUFFER_SIZE), b""):
+            md5.update(chunk)
+            archive_file.write(chunk)
+
+
+def _wait_for_archiver(
+    archiver: subprocess.Popen[bytes],
+    out_file: Path,
+    caller: str,
+    producer: subprocess.Popen[bytes] | None = None,
+) -> str | None:
+    """Wait for 7-zip (and process piped to it) to finish, raise on failure.
+
+    When archive is written to 7-zip stdout, it is saved to `out_file` and
+    its md5 is returned.
+    """
+    assert archiver.stdout
+    md5 = None
+    archiver_stdout = OutputTail()
+    # 7-zip refuses to write to stdout when archive of given name already exists
+    partial_file = out_file.with_name(f"{out_file.name}.partial")
+    if use_checksum_integrity_check():
+        md5 = hashlib.md5(usedforsecurity=False)
+        stdout_reader = Thread(
+            target=_write_stream,
+            args=(archiver.stdout, partial_file, md5),
+            daemon=True,
+        )
+    else:
+        stdout_reader = Thread(
+            target=_stream_output,
+            args=(archiver.stdout, archiver_stdout, f"{caller} 7-zip stdout"),
+            daemon=True,
+        )
+    stdout_reader.start()
+
+    processes: list[tuple[str, subprocess.Popen[bytes], OutputTail]] = [
+        (process_name, process, OutputTail())
+        for process_name, process in [("producer", producer), ("7-zip", archiver)]
+        if process is not None
+    ]
+    stderr_readers: list[Thread] = []
+    for process_name, process, process_stderr in processes:
+        stderr_reader = Thread(
+            target=_stream_output,
+            args=(process.stderr, process_stderr, f"{caller} {process_name} stderr"),
+            daemon=True,
+        )
+        stderr_reader.start()
+        stderr_readers.append(stderr_reader)
+
+    # producer and 7-zip run at once, so they share one timeout
+    deadline = time.monotonic() + config.options.SUBPROCESS_TIMEOUT_SECS
+    try:
+        for _, process, _ in processes:
+            process.wait(timeout=max(0, deadline - time.monotonic()))
+    except subprocess.TimeoutExpired:
+        for _, process, _ in processes:
+            process.kill()
+            process.wait()
+        remove_path(partial_file)
+        remove_path(out_file)
+        raise
+    finally:
+        stdout_reader.join()
+        archiver.stdout.close()
+        for stderr_reader, (_, process, _) in zip(
+            stderr_readers, processes, strict=True
+        ):
+            stderr_reader.join()
+            assert process.stderr
+            process.stderr.close()
+
+    for process_name, process, process_stderr in processes:
+        if process.returncode != 0:
+            process_stderr_text = process_stderr.text()
+            log.error(
+                "%s %s failed with status %s", caller, process_name, process.returncode
+            )
+            log.error("%s stderr: %s", caller, process_stderr_text)
+            remove_path(partial_file)
+            remove_path(out_file)
+            raise CoreSubprocessError(process_stderr_text)
+
+    if md5 is not None:
+        partial_file.replace(out_file)
+    return md5.hexdigest() if md5 is not None else None
+
+
+def run_create_zip_archive_from_stdout(shell_args: str, backup_file: Path) -> Path:
+    """Archive stdout of `shell_args` as `backup_file` entry of a new zip archive.
+
+    Output is piped directly to 7-zip, so `backup_file` never lands on disk.
+    """
+    out_file = get_zip_archive_path(backup_file)
+    log.info("start creating zip archive from subprocess stdout: %s", out_file)
+    log.debug("run_create_zip_archive_from_stdout running: '%s'", shell_args)
+
+    with _zip_archive_resources() as threads:
+        archive_input = shlex.quote(f"-si{backup_file.name}")
+        if use_checksum_integrity_check():
+            archive_input = f"{archive_input} -so"
+        shell_create_7zip_archive = _shell_create_7zip_archive(
+            out_file, archive_input, threads
+        )
+        producer = subprocess.Popen(
+            shell_args, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        assert producer.stdout
+        archiver = subprocess.Popen(
+            shell_create_7zip_archive,
+            shell=True,
+            stdin=producer.stdout,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # only archiver should hold the pipe, so producer gets SIGPIPE if it exits
+        producer.stdout.close()
+
+        md5 = _wait_for_archiver(
+            archiver, out_file, "run_create_zip_archive_from_stdout", producer
+        )
+        if md5 is not None:
+            _save_zip_archive_md5(out_file, md5)
+        log.info("finished zip archive creating")
+
+        run_zip_archive_integrity_check(out_file)
     return out_file
 
 
+def run_create_zip_archive_from_writer(
+    writer: Callable[[IO[bytes]], None], backup_file: Path
+) -> Path:
+    """Archive data written by `writer` as `backup_file` entry of a new zip archive.
+
+    Like `run_create_zip_archive_from_stdout`, but data is produced in-process
+    and written directly to 7-zip stdin.
+    """
+    out_file = get_zip_archive_path(backup_file)
+    log.info("start creating zip archive from stream: %s", out_file)
+
+    with _zip_archive_resources() as threads:
+        archive_input = shlex.quote(f"-si{backup_file.name}")
+        if use_checksum_integrity_check():
+            archive_input = f"{archive_input} -so"
+        shell_create_7zip_archive = _shell_create_7zip_archive(
+            out_file, archive_input, threads
+        )
+        archiver = subprocess.Popen(
+            shell_create_7zip_archive,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        archiver_stdin = archiver.stdin
+        assert archiver_stdin
+        writer_errors: list[Exception] = []
+
+        def write() -> None:
+            try:
+                writer(archiver_stdin)
+            except Exception as err:
+                writer_errors.append(err)
+            finally:
+                # 7-zip that already exited fails flush of buffered data
+                with suppress(BrokenPipeError):
+                    archiver_stdin.close()
+
+        writer_thread = Thread(target=write, daemon=True)
+        writer_thread.start()
+        try:
+            md5 = _wait_for_archiver(
+                archiver, out_file, "run_create_zip_archive_from_writer"
+            )
+        finally:
+            writer_thread.join()
+        if writer_errors:
+            log.error("run_create_zip_archive_from_writer writer failed")
+            remove_path(out_file)
+            raise writer_errors[0]
+
+        if md5 is not None:
+            _save_zip_archive_md5(out_file, md5)
+        log.info("finished zip archive creating")
+
+        run_zip_archive_integrity_check(out_file)
+    return out_file
+
+
+class ZipArchiveStream:
+    """Forward only binary stream of zip archive, used for streaming uploads.
+
+    Data returned by last read is kept in memory, so upload clients can seek
+    back and retry sending it. With `md5_part_size`, md5 of every part of that
+    size is computed too, like multipart uploads split the stream.
+    """
+
+    def __init__(self, stream: IO[bytes], md5_part_size: int | None = None) -> None:
+        self._stream = stream
+        self._position = 0
+        self._last_chunk_start = 0
+        self._last_chunk = b""
+        self._replay = b""
+        self._md5 = hashlib.md5(usedforsecurity=False)
+        self._md5_part_size = md5_part_size
+        self._part_md5s: list[hashlib._Hash] = []
+        self._md5_size = 0
+
+    def md5(self) -> str:
+        """Md5 of the stream read so far, computed in the same pass."""
+        return self._md5.hexdigest()
+
+    def part_md5s(self) -> list[bytes]:
+        """Md5 digests of parts of the stream read so far, see `md5_part_size`."""
+        return [part_md5.digest() for part_md5 in self._part_md5s]
+
+    def _update_md5(self, data: bytes) -> None:
+        self._md5.update(data)
+        if self._md5_part_size is None:
+            return
+        view = memoryview(data)
+        offset = 0
+        while offset < len(view):
+            part_offset = self._md5_size % self._md5_part_size
+            if part_offset == 0:
+                self._part_md5s.append(hashlib.md5(usedforsecurity=False))
+            end = min(len(view), offset + self._md5_part_size - part_offset)
+            self._part_md5s[-1].update(view[offset:end])
+            self._md5_size += end - offset
+            offset = end
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int | None = -1) -> bytes:
+        if size is None or size < 0:
+            new_data = self._stream.read()
+            data = self._replay + new_data
+            self._replay = b""
+        else:
+            data = self._replay[:size]
+            self._replay = self._replay[size:]
+            new_data = b""
+            if len(data) < size:
+                new_data = self._stream.read(size - len(data))
+                data += new_data
+        self._update_md5(new_data)
+
+        self._last_chunk_start = self._position
+        self._last_chunk = data
+        self._position += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("zip archive stream size is unknown")
+        if not self._last_chunk_start <= offset <= self._position:
+            raise io.UnsupportedOperation(
+                f"cannot seek to {offset}, only last read chunk can be read again"
+            )
+
+        start = offset - self._last_chunk_start
+        end = self._position - self._last_chunk_start
+        self._replay = self._last_chunk[start:end] + self._replay
+        self._position = offset
+        return offset
+
+
+class ThrottledReader:
+    """Binary stream reading from `stream` no faster than all limiters allow."""
+
+    def __init__(self, stream: Any, limiters: list[BandwidthLimiter]) -> None:
+        self._stream = stream
+        self._limiters = limiters
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return bool(self._stream.seekable())
+
+    def tell(self) -> int:
+        return int(self._stream.tell())
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return int(self._stream.seek(offset, whence))
+
+    def read(self, size: int | None = -1) -> bytes:
+        data: bytes = self._stream.read(size)
+        for limiter in self._limiters:
+            limiter.consume(len(data))
+        return data
+
+
+def get_upload_bandwidth_limiters(
+    max_bandwidth: int | None = None,
+) -> list[BandwidthLimiter]:
+    """Limiters of upload, global UPLOAD_MAX_BANDWIDTH and provider `max_bandwidth`."""
+    limiters: list[BandwidthLimiter] = []
+    if upload_bandwidth.max_bandwidth is not None:
+        limiters.append(upload_bandwidth)
+    if max_bandwidth is not None:
+        limiters.append(BandwidthLimiter(max_bandwidth))
+    return limiters
+
+
+@contextmanager
+def open_zip_archive_stream(
+    backup_file: Path, md5_part_size: int | None = None
+) -> Generator[ZipArchiveStream, None, None]:
+    """Zip archive of `backup_file` streamed from 7-zip stdout while it is created.
+
+    Upload can start before compression finishes and archive never lands on disk.
+    """
+    if get_zip_archive_path(backup_file) == backup_file:
+        log.info("backup file %s is already zip archive, streaming it", backup_file)
+        run_zip_archive_integrity_check(backup_file)
+        # md5 of streamed file is computed again while it is read
+        pop_zip_archive_md5(backup_file)
+        with open(backup_file, "rb") as archive_file:
+            yield ZipArchiveStream(archive_file, md5_part_size)
+        return
+
+    log.info("start streaming zip archive from subprocess: %s", backup_file)
+    with _zip_archive_resources() as threads:
+        shell_create_7zip_archive = _shell_create_7zip_archive(
+            get_zip_archive_path(backup_file), f"-so {backup_file}", threads
+        )
+        archiver = subprocess.Popen(
+            shell_create_7zip_archive,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        assert archiver.stdout and archiver.stderr
+        archiver_stderr = OutputTail()
+        archiver_stderr_reader = Thread(
+            target=_stream_output,
+            args=(archiver.stderr, archiver_stderr, "open_zip_archive_stream stderr"),
+            daemon=True,
+        )
+        archiver_stderr_reader.start()
+        timeout_watchdog = Timer(config.options.SUBPROCESS_TIMEOUT_SECS, archiver.kill)
+        timeout_watchdog.start()
+
+        try:
+            yield ZipArchiveStream(archiver.stdout, md5_part_size)
+        except BaseException:
+            archiver.kill()
+            raise
+        finally:
+            # archive not read to the end fails 7-zip with broken pipe
+            archiver.stdout.close()
+            archiver.wait()
+            timeout_watchdog.cancel()
+            archiver_stderr_reader.join()
+            archiver.stderr.close()
+
+        if archiver.returncode != 0:
+            archiver_stderr_text = archiver_stderr.text()
+            log.error(
+                "open_zip_archive_stream failed with status %s", archiver.returncode
+            )
+            log.error("open_zip_archive_stream stderr: %s", archiver_stderr_text)
+            raise CoreSubprocessError(archiver_stderr_text)
+    log.info("finished zip archive streaming")
+
+
 def safe_text_version(text: str) -> str:
     return re.sub(SAFE_LETTER_PATTERN, "", text)
 
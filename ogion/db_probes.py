@@ -0,0 +1,101 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import logging
+import threading
+from collections.abc import Callable
+from typing import Any
+
+from ogion.models.backup_target_models import (
+    MariaDBTargetModel,
+    MySQLTargetModel,
+    PostgreSQLTargetModel,
+)
+
+try:
+    import psycopg
+except ImportError:  # pragma: no cover
+    psycopg = None
+
+try:
+    import pymysql
+except ImportError:  # pragma: no cover
+    pymysql = None
+
+log = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT_SECS = 10
+
+
+class ConnectionProbe:
+    """Connection of database target kept open to check version in process.
+
+    Used instead of spawning `psql` or `mysql` client when pure python driver
+    is installed, so connection can be checked before every backup without
+    load. Connection closed by server is opened again once.
+    """
+
+    def __init__(self, connect: Callable[[], Any]) -> None:
+        self._connect = connect
+        self._conn: Any = None
+        self._lock = threading.Lock()
+
+    def version(self) -> str:
+        """Result of `SELECT version();` query."""
+        with self._lock:
+            reconnected = self._conn is None
+            while True:
+                if self._conn is None:
+                    self._conn = self._connect()
+                try:
+                    with self._conn.cursor() as cursor:
+                        cursor.execute("SELECT version();")
+                        row = cursor.fetchone()
+                    return str(row[0])
+                except Exception as err:
+                    self._close()
+                    if reconnected:
+                        raise
+                    log.debug("probe connection is broken, reconnecting: %s", err)
+                    reconnected = True
+
+    def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        try:
+            conn.close()
+        except Exception as err:
+            log.debug("error when closing probe connection: %s", err)
+
+
+def postgres_probe(target_model: PostgreSQLTargetModel) -> ConnectionProbe | None:
+    if psycopg is None:
+        return None
+    return ConnectionProbe(
+        lambda: psycopg.connect(
+            host=target_model.host,
+            port=target_model.port,
+            user=target_model.user,
+            password=target_model.password.get_secret_value(),
+            dbname=target_model.db,
+            connect_timeout=CONNECT_TIMEOUT_SECS,
+            autocommit=True,
+        )
+    )
+
+
+def mysql_probe(
+    target_model: MySQLTargetModel | MariaDBTargetModel,
+) -> ConnectionProbe | None:
+    if pymysql is None:
+        return None
+    return ConnectionProbe(
+        lambda: pymysql.connect(
+            host=target_model.host,
+            port=target_model.port,
+            user=target_model.user,
+            password=target_model.password.get_secret_value(),
+            database=target_model.db,
+            connect_timeout=CONNECT_TIMEOUT_SECS,
+            autocommit=True,
+        )
+    )
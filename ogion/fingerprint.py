@@ -0,0 +1,131 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from ogion import config
+
+log = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# relative path -> [mtime_ns, size, inode, sha256]
+_Entries = dict[str, list[int | str]]
+
+
+def _file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def walk_paths(abs_path: Path) -> list[tuple[str, Path]]:
+    if abs_path.is_file():
+        return [(abs_path.name, abs_path)]
+
+    paths: list[tuple[str, Path]] = []
+    for root, dirs, files in os.walk(abs_path):
+        dirs.sort()
+        root_path = Path(root)
+        for name in dirs + sorted(files):
+            path = root_path / name
+            paths.append((str(path.relative_to(abs_path)), path))
+    return paths
+
+
+def compute_fingerprint(
+    abs_path: Path, previous_entries: _Entries
+) -> tuple[str, _Entries]:
+    """Fingerprint of file or directory content.
+
+    Files with unchanged mtime, size and inode reuse hash from previous
+    entries, only new or modified files are read again.
+    """
+    entries: _Entries = {}
+    digest = hashlib.sha256()
+    hashed_files = 0
+    for relative_path, path in walk_paths(abs_path):
+        stat = path.lstat()
+        if path.is_symlink():
+            content_hash = f"symlink:{os.readlink(path)}"
+        elif path.is_dir():
+            content_hash = "directory"
+        else:
+            previous = previous_entries.get(relative_path)
+            if previous is not None and previous[:3] == [
+                stat.st_mtime_ns,
+                stat.st_size,
+                stat.st_ino,
+            ]:
+                content_hash = str(previous[3])
+            else:
+                content_hash = _file_sha256(path)
+                hashed_files += 1
+        entries[relative_path] = [
+            stat.st_mtime_ns,
+            stat.st_size,
+            stat.st_ino,
+            content_hash,
+        ]
+        digest.update(f"{relative_path}\0{stat.st_mode}\0{content_hash}\n".encode())
+
+    log.debug(
+        "fingerprint of %s computed, %s of %s entries hashed",
+        abs_path,
+        hashed_files,
+        len(entries),
+    )
+    return digest.hexdigest(), entries
+
+
+class FingerprintCache:
+    """Fingerprint of last uploaded backup of file or directory target.
+
+    Stored in config folder and updated only after backup is uploaded,
+    so failed backups are always retried. Backup uploaded to other provider
+    location does not count, its digest is ignored.
+    """
+
+    def __init__(self, env_name: str, abs_path: Path) -> None:
+        self.abs_path = abs_path
+        self.path = config.CONST_CONFIG_FOLDER_PATH / f"{env_name}.fingerprint.json"
+        self._pending: tuple[str, str, _Entries] | None = None
+
+    def _load(self, location: str) -> tuple[str, _Entries]:
+        try:
+            data = json.loads(self.path.read_text())
+            digest, entries = data["digest"], data["entries"]
+        except FileNotFoundError:
+            return "", {}
+        except (ValueError, KeyError, TypeError) as err:
+            log.warning("ignoring invalid fingerprint file %s: %s", self.path, err)
+            return "", {}
+        if data.get("location") != location:
+            log.info("fingerprint %s is of other provider location", self.path)
+            # hashes of unchanged files are still valid
+            return "", entries
+        return digest, entries
+
+    def is_unchanged(self, location: str) -> bool:
+        last_digest, last_entries = self._load(location)
+        digest, entries = compute_fingerprint(self.abs_path, last_entries)
+        self._pending = (location, digest, entries)
+        return digest == last_digest
+
+    def commit(self) -> None:
+        if self._pending is None:
+            return
+        location, digest, entries = self._pending
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps({"location": location, "digest": digest, "entries": entries})
+        )
+        tmp_path.replace(self.path)
+        self._pending = None
+        log.debug("saved fingerprint %s to %s", digest, self.path)
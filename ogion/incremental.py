@@ -0,0 +1,116 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from ogion import config
+from ogion.fingerprint import walk_paths
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".ogion_incremental.json"
+
+# relative path -> [mtime_ns, size, inode, is_dir]
+_Entries = dict[str, list[int]]
+
+
+def stat_entries(abs_path: Path) -> _Entries:
+    entries: _Entries = {}
+    for relative_path, path in walk_paths(abs_path):
+        stat = path.lstat()
+        is_dir = int(path.is_dir() and not path.is_symlink())
+        entries[relative_path] = [stat.st_mtime_ns, stat.st_size, stat.st_ino, is_dir]
+    return entries
+
+
+@dataclass
+class IncrementalState:
+    full_backup_name: str = ""
+    backups_since_full: int = 0
+    entries: _Entries = field(default_factory=dict)
+
+
+class IncrementalBackup:
+    """Differential backups of directory.
+
+    Every `full_backup_every` backup is full, others contain only files
+    added or modified since the last full backup plus manifest with
+    deleted paths, so restore needs the full backup and one differential.
+    """
+
+    def __init__(self, env_name: str, abs_path: Path, full_backup_every: int) -> None:
+        self.abs_path = abs_path
+        self.full_backup_every = full_backup_every
+        self.path = config.CONST_CONFIG_FOLDER_PATH / f"{env_name}.incremental.json"
+        self._pending: IncrementalState | None = None
+
+    def _load(self) -> IncrementalState:
+        try:
+            return IncrementalState(**json.loads(self.path.read_text()))
+        except FileNotFoundError:
+            return IncrementalState()
+        except (ValueError, TypeError) as err:
+            log.warning("ignoring invalid incremental state %s: %s", self.path, err)
+            return IncrementalState()
+
+    def next_backup_is_full(self) -> bool:
+        state = self._load()
+        return (
+            not state.full_backup_name
+            or state.backups_since_full + 1 >= self.full_backup_every
+        )
+
+    def start_full_backup(self, out_path: Path) -> None:
+        self._pending = IncrementalState(
+            full_backup_name=out_path.name, entries=stat_entries(self.abs_path)
+        )
+
+    def create_differential_backup(self, out_path: Path) -> None:
+        """Create `out_path` folder with symlinks to files changed since full backup."""
+        state = self._load()
+        entries = stat_entries(self.abs_path)
+
+        out_path.mkdir(mode=0o700)
+        changed = 0
+        for relative_path, entry in entries.items():
+            is_dir = entry[3]
+            previous = state.entries.get(relative_path)
+            if previous == entry or (is_dir and previous is not None):
+                continue
+            staged_path = out_path / relative_path
+            if is_dir:
+                staged_path.mkdir(mode=0o700, parents=True, exist_ok=True)
+            else:
+                staged_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+                staged_path.symlink_to(self.abs_path / relative_path)
+                changed += 1
+
+        deleted = sorted(set(state.entries) - set(entries))
+        manifest = {
+            "full_backup_name": state.full_backup_name,
+            "deleted": deleted,
+        }
+        (out_path / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+        log.info(
+            "differential backup of %s since %s: %s changed files, %s deleted paths",
+            self.abs_path,
+            state.full_backup_name,
+            changed,
+            len(deleted),
+        )
+        self._pending = IncrementalState(
+            full_backup_name=state.full_backup_name,
+            backups_since_full=state.backups_since_full + 1,
+            entries=state.entries,
+        )
+
+    def commit(self) -> None:
+        if self._pending is None:
+            return
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(asdict(self._pending)))
+        tmp_path.replace(self.path)
+        self._pending = None
@@ -7,16 +7,19 @@ import signal
 import sys
 import threading
 import time
+from contextlib import suppress
 from dataclasses import dataclass
-from threading import Thread
+from functools import partial
 from types import FrameType
 from typing import NoReturn
 
-from ogion import config, core
+from ogion import config, core, metrics, scheduler
 from ogion.backup_targets import (
     base_target,
     targets_mapping,
 )
+from ogion.models import backup_target_models
+from ogion.notifications import notifications_context
 from ogion.notifications.notifications_context import (
     PROGRAM_STEP,
     NotificationsContext,
@@ -37,15 +40,13 @@ def quit(sig: int, frame: FrameType | None) -> None:
 
 @NotificationsContext(step_name=PROGRAM_STEP.SETUP_PROVIDER)
 def backup_provider() -> base_provider.BaseUploadProvider:
-    provider_cls_map = providers_mapping.get_provider_cls_map()
-
     provider_model = core.create_provider_model()
     log.info(
         "initializing provider: `%s`",
         provider_model.name,
     )
 
-    provider_target_cls = provider_cls_map[provider_model.name]
+    provider_target_cls = providers_mapping.get_provider_cls(provider_model.name)
     log.debug("initializing %s with %s", provider_target_cls, provider_model)
     res_backup_provider = provider_target_cls(target_provider=provider_model)
     log.info(
@@ -59,29 +60,42 @@ def backup_provider() -> base_provider.BaseUploadProvider:
 def backup_targets() -> list[base_target.BaseBackupTarget]:
     backup_target_cls_map = targets_mapping.get_target_cls_map()
 
-    backup_targets: list[base_target.BaseBackupTarget] = []
     target_models = core.create_target_models()
     if not target_models:
         raise RuntimeError("Found 0 backup targets, at least 1 is required.")
 
     log.info("initializating %s backup targets", len(target_models))
 
-    for target_model in target_models:
+    def init_target(
+        target_model: backup_target_models.TargetModel,
+    ) -> base_target.BaseBackupTarget:
         log.info(
             "initializing target: `%s`",
             target_model.env_name,
         )
         backup_target_cls = backup_target_cls_map[target_model.name]
         log.debug("initializing %s with %s", backup_target_cls, target_model)
-        backup_targets.append(backup_target_cls(target_model=target_model))
+        backup_target = backup_target_cls(target_model=target_model)
         log.info(
             "success initializing target: `%s`",
             target_model.env_name,
         )
+        return backup_target
+
+    # database targets connect to check version, slow hosts are checked at once
+    backup_targets = core.map_io(
+        init_target, target_models, config.options.SETUP_TARGETS_WORKERS
+    )
 
     return backup_targets
 
 
+def wait_for_notifications(timeout_secs: float) -> None:
+    """Wait for fail messages sent in background, so exit does not drop them."""
+    if not notifications_context.queue.join(timeout=timeout_secs):
+        log.warning("notifications were not sent in %ss", round(timeout_secs, 2))
+
+
 def shutdown() -> NoReturn:  # pragma: no cover
     timeout_secs = config.options.SIGTERM_TIMEOUT_SECS
     start = time.time()
@@ -92,7 +106,7 @@ def shutdown() -> NoReturn:  # pragma: no cover
         timeout_secs,
     )
     for thread in threading.enumerate():
-        if thread.name == "MainThread":
+        if thread.name == "MainThread" or thread in core.io_threads:
             continue
         timeout_left = deadline - time.time()
         if timeout_left < 0:
@@ -113,6 +127,12 @@ def shutdown() -> NoReturn:  # pragma: no cover
                 "thread `%s` exited gracefully",
                 thread.name,
             )
+    # backups failed while waiting started sending fail messages only now
+    wait_for_notifications(max(0, deadline - time.time()))
+    # idle io threads wait for new tasks until executor is shut down
+    core.io_executor.shutdown(wait=False, cancel_futures=True)
+    for thread in list(core.io_threads):
+        thread.join(timeout=max(0, deadline - time.time()))
     if threading.active_count() == 1:
         log.info("gracefully exiting ogion")
         sys.exit(0)
@@ -129,31 +149,63 @@ def shutdown() -> NoReturn:  # pragma: no cover
 def run_backup(
     target: base_target.BaseBackupTarget, provider: base_provider.BaseUploadProvider
 ) -> None:
-    log.info("start making backup of target: `%s`", target.env_name)
-    with NotificationsContext(
-        step_name=PROGRAM_STEP.BACKUP_CREATE, env_name=target.env_name
-    ):
-        backup_file = target.make_backup()
-    log.info(
-        "backup file created: %s, starting post save upload to provider %s",
-        backup_file,
-        provider.__class__.__name__,
-    )
-    with NotificationsContext(
-        step_name=PROGRAM_STEP.UPLOAD,
-        env_name=target.env_name,
-    ):
-        provider.post_save(backup_file=backup_file)
-
-    with NotificationsContext(
-        step_name=PROGRAM_STEP.CLEANUP,
-        env_name=target.env_name,
+    # failed resume is notified, but must not block new backups of target
+    with (
+        suppress(Exception),
+        NotificationsContext(step_name=PROGRAM_STEP.UPLOAD, env_name=target.env_name),
     ):
-        provider.clean(
-            backup_file=backup_file,
-            max_backups=target.max_backups,
-            min_retention_days=target.min_retention_days,
+        provider.resume_upload(env_name=target.env_name)
+
+    with metrics.track_backup(target.env_name) as backup_metrics:
+        with (
+            NotificationsContext(
+                step_name=PROGRAM_STEP.BACKUP_CREATE, env_name=target.env_name
+            ),
+            core.use_zip_archive_threads(target.zip_archive_threads),
+        ):
+            if target.is_unchanged_since_last_backup(provider.location):
+                log.info(
+                    "target `%s` is unchanged since last backup, skipping. "
+                    "next backup of target is: %s",
+                    target.env_name,
+                    target.next_backup_time,
+                )
+                backup_metrics.status = "skipped"
+                return
+            log.info("start making backup of target: `%s`", target.env_name)
+            with metrics.track_stage("dump"):
+                backup_file = target.make_backup()
+        # raw size of directory target would need another walk of its whole tree
+        if target.target_model.name != config.BackupTargetEnum.FOLDER:
+            backup_metrics.raw_bytes = metrics.path_size(backup_file)
+        log.info(
+            "backup file created: %s, starting post save upload to provider %s",
+            backup_file,
+            provider.__class__.__name__,
         )
+        with (
+            NotificationsContext(
+                step_name=PROGRAM_STEP.UPLOAD,
+                env_name=target.env_name,
+            ),
+            core.use_zip_archive_threads(target.zip_archive_threads),
+            metrics.track_stage("upload"),
+        ):
+            provider.post_save(backup_file=backup_file)
+        target.mark_backup_uploaded()
+
+        with (
+            NotificationsContext(
+                step_name=PROGRAM_STEP.CLEANUP,
+                env_name=target.env_name,
+            ),
+            metrics.track_stage("cleanup"),
+        ):
+            provider.clean(
+                backup_file=backup_file,
+                max_backups=target.max_backups,
+                min_retention_days=target.min_retention_days,
+            )
 
     log.info(
         "backup and upload finished, next backup of target `%s` is: %s",
@@ -192,29 +244,42 @@ def main() -> NoReturn:
             with NotificationsContext(step_name=PROGRAM_STEP.DEBUG_NOTIFICATIONS):
                 raise ValueError("hi! this is notifications debug exception")
         except Exception:
+            wait_for_notifications(config.options.SIGTERM_TIMEOUT_SECS)
             sys.exit(0)
 
-    provider = backup_provider()
-    targets = backup_targets()
+    try:
+        provider = backup_provider()
+        targets = backup_targets()
+    except Exception:
+        wait_for_notifications(config.options.SIGTERM_TIMEOUT_SECS)
+        raise
 
     log.info("ogion configuration finished")
 
-    while not exit_event.is_set():
+    metrics_server = None
+    if config.options.METRICS_PORT is not None:
+        metrics_server = metrics.start_metrics_server(config.options.METRICS_PORT)
+
+    backup_scheduler = scheduler.BackupScheduler(
+        run=partial(run_backup, provider=provider),
+        workers=config.options.BACKUP_WORKERS,
+        exit_event=exit_event,
+    )
+    backup_scheduler.start()
+
+    if runtime_args.single:
         for target in targets:
-            if target.next_backup() or runtime_args.single:
-                pretty_env_name = target.env_name.replace("_", "-")
-                backup_thread = Thread(
-                    target=run_backup,
-                    args=(target, provider),
-                    daemon=True,
-                    name=f"Thread-{pretty_env_name}",
-                )
-                backup_thread.start()
-                exit_event.wait(0.5)
-        if runtime_args.single:
-            exit_event.set()
-        exit_event.wait(5)
+            backup_scheduler.submit(target, scheduled_at=target.last_backup_time)
+        backup_scheduler.wait_until_idle()
+        exit_event.set()
+
+    cron_timer = scheduler.CronTimer(targets)
+    while not exit_event.is_set():
+        for target in cron_timer.wait_for_due_targets(exit_event):
+            backup_scheduler.submit(target, scheduled_at=target.last_backup_time)
 
+    if metrics_server is not None:
+        metrics_server.shutdown()
     shutdown()
 
 
@@ -0,0 +1,281 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import collections
+import json
+import logging
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from ogion import config
+from ogion.fingerprint import walk_paths
+
+log = logging.getLogger(__name__)
+
+STAGES = ("dump", "archive", "upload", "cleanup")
+
+
+@dataclass
+class BackupMetrics:
+    """Timings and sizes of single backup of target.
+
+    Seconds of stage do not include stages nested in it, for example upload
+    does not include creating zip archive done by provider before upload.
+    """
+
+    env_name: str
+    started_at: float = field(default_factory=time.time)
+    status: str = "running"
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    raw_bytes: int | None = None
+    compressed_bytes: int | None = None
+    cleanup_listed: int | None = None
+    cleanup_deleted: int | None = None
+    _stages: list[str] = field(default_factory=list, repr=False)
+
+    @property
+    def compression_ratio(self) -> float | None:
+        if not self.raw_bytes or not self.compressed_bytes:
+            return None
+        return self.raw_bytes / self.compressed_bytes
+
+    @property
+    def upload_bytes_per_second(self) -> float | None:
+        upload_seconds = self.stage_seconds.get("upload")
+        if not upload_seconds or self.compressed_bytes is None:
+            return None
+        return self.compressed_bytes / upload_seconds
+
+    def as_dict(self) -> dict[str, Any]:
+        upload_bytes_per_second = self.upload_bytes_per_second
+        return {
+            "env_name": self.env_name,
+            "started_at": self.started_at,
+            "status": self.status,
+            "stage_seconds": self.stage_seconds,
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "compression_ratio": self.compression_ratio,
+            "upload_mb_per_sec": (
+                None
+                if upload_bytes_per_second is None
+                else upload_bytes_per_second / 1024 / 1024
+            ),
+            "cleanup_listed": self.cleanup_listed,
+            "cleanup_deleted": self.cleanup_deleted,
+        }
+
+
+class MetricsRegistry:
+    """Metrics of the last backup of every target and backups counters."""
+
+    def __init__(self) -> None:
+        self._last: dict[str, BackupMetrics] = {}
+        self._totals: collections.Counter[tuple[str, str]] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, backup_metrics: BackupMetrics) -> None:
+        with self._lock:
+            self._last[backup_metrics.env_name] = backup_metrics
+            self._totals[(backup_metrics.env_name, backup_metrics.status)] += 1
+            if config.options.METRICS_FILE is not None:
+                with open(config.options.METRICS_FILE, "a") as metrics_file:
+                    metrics_file.write(json.dumps(backup_metrics.as_dict()) + "\n")
+
+    def last(self, env_name: str) -> BackupMetrics | None:
+        with self._lock:
+            return self._last.get(env_name)
+
+    def render(self) -> str:
+        """Metrics in prometheus text exposition format."""
+        with self._lock:
+            last = sorted(self._last.values(), key=lambda metrics: metrics.env_name)
+            totals = sorted(self._totals.items())
+
+        lines: list[str] = []
+
+        def add(
+            name: str, help_text: str, metric_type: str, samples: list[tuple[str, Any]]
+        ) -> None:
+            lines.append(f"# HELP ogion_{name} {help_text}")
+            lines.append(f"# TYPE ogion_{name} {metric_type}")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"ogion_{name}{{{labels}}} {value}")
+
+        add(
+            "backups_total",
+            "Number of finished backups of target by status.",
+            "counter",
+            [
+                (f'target="{env}",status="{status}"', count)
+                for (env, status), count in totals
+            ],
+        )
+        add(
+            "backup_last_started_timestamp_seconds",
+            "Start time of the last backup of target.",
+            "gauge",
+            [
+                (f'target="{m.env_name}",status="{m.status}"', m.started_at)
+                for m in last
+            ],
+        )
+        add(
+            "backup_stage_seconds",
+            "Duration of stage of the last backup of target.",
+            "gauge",
+            [
+                (f'target="{m.env_name}",stage="{stage}"', m.stage_seconds.get(stage))
+                for m in last
+                for stage in STAGES
+            ],
+        )
+        add(
+            "backup_raw_bytes",
+            "Size of the last backup of target before compression.",
+            "gauge",
+            [(f'target="{m.env_name}"', m.raw_bytes) for m in last],
+        )
+        add(
+            "backup_compressed_bytes",
+            "Size of the last uploaded zip archive of target.",
+            "gauge",
+            [(f'target="{m.env_name}"', m.compressed_bytes) for m in last],
+        )
+        add(
+            "backup_compression_ratio",
+            "Raw to compressed size ratio of the last backup of target.",
+            "gauge",
+            [(f'target="{m.env_name}"', m.compression_ratio) for m in last],
+        )
+        add(
+            "backup_upload_bytes_per_second",
+            "Upload throughput of the last backup of target.",
+            "gauge",
+            [(f'target="{m.env_name}"', m.upload_bytes_per_second) for m in last],
+        )
+        add(
+            "backup_cleanup_objects",
+            "Backups listed and deleted in provider by the last cleanup of target.",
+            "gauge",
+            [
+                (f'target="{m.env_name}",action="{action}"', value)
+                for m in last
+                for action, value in (
+                    ("listed", m.cleanup_listed),
+                    ("deleted", m.cleanup_deleted),
+                )
+            ],
+        )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+_current: ContextVar[BackupMetrics | None] = ContextVar("backup_metrics", default=None)
+
+
+@contextmanager
+def track_backup(env_name: str) -> Generator[BackupMetrics, None, None]:
+    backup_metrics = BackupMetrics(env_name=env_name)
+    token = _current.set(backup_metrics)
+    try:
+        yield backup_metrics
+    except BaseException:
+        backup_metrics.status = "failed"
+        raise
+    finally:
+        _current.reset(token)
+        if backup_metrics.status == "running":
+            backup_metrics.status = "success"
+        registry.record(backup_metrics)
+
+
+@contextmanager
+def track_stage(stage: str) -> Generator[None, None, None]:
+    """Measure stage of current backup, no-op outside of `track_backup`."""
+    backup_metrics = _current.get()
+    if backup_metrics is None:
+        yield
+        return
+
+    start = time.monotonic()
+    backup_metrics._stages.append(stage)
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        backup_metrics._stages.pop()
+        seconds = backup_metrics.stage_seconds
+        seconds[stage] = seconds.get(stage, 0) + elapsed
+        if backup_metrics._stages:
+            parent = backup_metrics._stages[-1]
+            seconds[parent] = seconds.get(parent, 0) - elapsed
+
+
+def record_compressed_bytes(size: int) -> None:
+    backup_metrics = _current.get()
+    if backup_metrics is not None:
+        backup_metrics.compressed_bytes = size
+
+
+def record_cleanup(listed: int, deleted: int) -> None:
+    backup_metrics = _current.get()
+    if backup_metrics is not None:
+        backup_metrics.cleanup_listed = listed
+        backup_metrics.cleanup_deleted = deleted
+
+
+def path_size(path: Path) -> int | None:
+    """Size of backup file or directory, None for streamed backups.
+
+    Streamed backup is zip archive already, so its raw size is not known.
+    """
+    # core imports metrics
+    from ogion import core
+
+    if core.get_zip_archive_path(path) == path:
+        return None
+    try:
+        if not path.is_dir():
+            return path.stat().st_size
+        abs_path = path.resolve()
+        return sum(
+            file_path.stat().st_size
+            for _, file_path in walk_paths(abs_path)
+            if file_path.is_file()
+        )
+    except FileNotFoundError:
+        return None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        body = registry.render().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug("metrics request: " + format, *args)
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    log.info("serving prometheus metrics on port %s at /metrics", port)
+    return server
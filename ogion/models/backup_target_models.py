@@ -1,8 +1,9 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import logging
 from pathlib import Path
-from typing import Self
+from typing import Literal, Self
 
 from croniter import croniter
 from pydantic import (
@@ -16,6 +17,8 @@ from pydantic import (
 
 from ogion import config
 
+log = logging.getLogger(__name__)
+
 
 class TargetModel(BaseModel):
     name: str = "test"
@@ -25,6 +28,9 @@ class TargetModel(BaseModel):
     min_retention_days: int = Field(
         ge=0, le=36600, default=config.options.BACKUP_MIN_RETENTION_DAYS
     )
+    zip_archive_threads: int = Field(
+        ge=1, le=1024, default=config.options.ZIP_ARCHIVE_THREADS
+    )
 
     model_config = ConfigDict(frozen=True)
 
@@ -44,6 +50,23 @@ class PostgreSQLTargetModel(TargetModel):
     port: int = 5432
     db: str = "postgres"
     password: SecretStr
+    streaming: bool = False
+    dump_format: Literal["plain", "custom", "directory"] = "plain"
+    jobs: int = Field(ge=1, le=128, default=1)
+
+    @model_validator(mode="after")
+    def dump_format_is_valid(self) -> Self:
+        if self.jobs > 1 and self.dump_format != "directory":
+            raise ValueError(
+                f"jobs={self.jobs} requires dump_format=directory\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        if self.streaming and self.dump_format == "directory":
+            raise ValueError(
+                "streaming cannot be used with dump_format=directory\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        return self
 
 
 class MySQLTargetModel(TargetModel):
@@ -53,6 +76,30 @@ class MySQLTargetModel(TargetModel):
     port: int = 3306
     db: str = "mysql"
     password: SecretStr
+    streaming: bool = False
+    jobs: int = Field(ge=1, le=128, default=1)
+    inconsistent_parallel_jobs: bool = False
+
+    @model_validator(mode="after")
+    def jobs_is_valid(self) -> Self:
+        if self.streaming and self.jobs > 1:
+            raise ValueError(
+                f"streaming cannot be used with jobs={self.jobs}\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        if self.jobs > 1 and not self.inconsistent_parallel_jobs:
+            raise ValueError(
+                f"jobs={self.jobs} requires inconsistent_parallel_jobs=true\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        if self.jobs > 1:
+            log.warning(
+                "%s: jobs=%s dumps every table in its own transaction, "
+                "tables are not consistent with each other",
+                self.env_name,
+                self.jobs,
+            )
+        return self
 
 
 class MariaDBTargetModel(TargetModel):
@@ -62,11 +109,37 @@ class MariaDBTargetModel(TargetModel):
     port: int = 3306
     db: str = "mariadb"
     password: SecretStr
+    streaming: bool = False
+    jobs: int = Field(ge=1, le=128, default=1)
+    inconsistent_parallel_jobs: bool = False
+
+    @model_validator(mode="after")
+    def jobs_is_valid(self) -> Self:
+        if self.streaming and self.jobs > 1:
+            raise ValueError(
+                f"streaming cannot be used with jobs={self.jobs}\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        if self.jobs > 1 and not self.inconsistent_parallel_jobs:
+            raise ValueError(
+                f"jobs={self.jobs} requires inconsistent_parallel_jobs=true\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        if self.jobs > 1:
+            log.warning(
+                "%s: jobs=%s dumps every table in its own transaction, "
+                "tables are not consistent with each other",
+                self.env_name,
+                self.jobs,
+            )
+        return self
 
 
 class SingleFileTargetModel(TargetModel):
     name: config.BackupTargetEnum = config.BackupTargetEnum.FILE
     abs_path: Path
+    skip_unchanged: bool = False
+    streaming: bool = False
 
     @model_validator(mode="after")
     def abs_path_is_valid(self) -> Self:
@@ -81,6 +154,10 @@ class SingleFileTargetModel(TargetModel):
 class DirectoryTargetModel(TargetModel):
     name: config.BackupTargetEnum = config.BackupTargetEnum.FOLDER
     abs_path: Path
+    skip_unchanged: bool = False
+    incremental: bool = False
+    full_backup_every: int = Field(ge=1, le=998, default=7)
+    streaming: bool = False
 
     @model_validator(mode="after")
     def abs_path_is_valid(self) -> Self:
@@ -90,3 +167,26 @@ class DirectoryTargetModel(TargetModel):
                 f"Error validating environment variable: {self.env_name}"
             )
         return self
+
+    @model_validator(mode="after")
+    def full_backup_every_is_valid(self) -> Self:
+        # differential backups are useless once their full backup is removed,
+        # any 2 * n - 1 backups in a row contain complete cycle of n backups
+        min_max_backups = 2 * self.full_backup_every - 1
+        if self.incremental and self.max_backups < min_max_backups:
+            raise ValueError(
+                f"max_backups={self.max_backups} must be at least "
+                f"{min_max_backups} (2 * full_backup_every - 1) "
+                f"with full_backup_every={self.full_backup_every}\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        return self
+
+    @model_validator(mode="after")
+    def streaming_is_valid(self) -> Self:
+        if self.streaming and self.incremental:
+            raise ValueError(
+                "streaming cannot be used with incremental=true\n "
+                f"Error validating environment variable: {self.env_name}"
+            )
+        return self
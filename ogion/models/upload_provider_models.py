@@ -2,12 +2,38 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import base64
+from typing import Self
 
-from pydantic import BaseModel, ConfigDict, SecretStr, field_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    SecretStr,
+    field_validator,
+    model_validator,
+)
 
 from ogion import config
 
 
+def streaming_is_valid(streaming: bool) -> bool:
+    if streaming and config.options.ZIP_ARCHIVE_FORMAT == "7z":
+        raise ValueError(
+            "streaming cannot be used with ZIP_ARCHIVE_FORMAT=7z, "
+            "7-zip can write only zip archives to stdout"
+        )
+    if (
+        streaming
+        and not config.options.ZIP_SKIP_INTEGRITY_CHECK
+        and config.options.ZIP_INTEGRITY_CHECK != "checksum"
+    ):
+        raise ValueError(
+            "streaming requires ZIP_INTEGRITY_CHECK=checksum or "
+            "ZIP_SKIP_INTEGRITY_CHECK=true, streamed archive cannot be tested"
+        )
+    return streaming
+
+
 class ProviderModel(BaseModel):
     name: str
 
@@ -25,6 +51,30 @@ class GCSProviderModel(ProviderModel):
     service_account_base64: SecretStr
     chunk_size_mb: int = 100
     chunk_timeout_secs: int = 60
+    max_concurrency: int = Field(ge=1, le=64, default=1)
+    max_bandwidth: int | None = Field(ge=1, default=None)
+    streaming: bool = False
+
+    _streaming_is_valid = field_validator("streaming")(streaming_is_valid)
+
+    @model_validator(mode="after")
+    def max_concurrency_is_valid(self) -> Self:
+        if self.max_concurrency == 1:
+            return self
+        # parts uploaded concurrently are read by google client from file
+        if self.streaming:
+            raise ValueError(
+                f"streaming cannot be used with max_concurrency={self.max_concurrency}"
+            )
+        if (
+            self.max_bandwidth is not None
+            or config.options.UPLOAD_MAX_BANDWIDTH is not None
+        ):
+            raise ValueError(
+                f"max_concurrency={self.max_concurrency} cannot be used with "
+                "max_bandwidth or UPLOAD_MAX_BANDWIDTH"
+            )
+        return self
 
     @field_validator("service_account_base64")
     def process_service_account_base64(
@@ -41,10 +91,21 @@ class AWSProviderModel(ProviderModel):
     key_id: str
     key_secret: SecretStr
     region: str
-    max_bandwidth: int | None = None
+    multipart_chunksize_mb: int = Field(ge=5, le=5120, default=8)
+    max_concurrency: int = Field(ge=1, le=64, default=10)
+    max_bandwidth: int | None = Field(ge=1, default=None)
+    streaming: bool = False
+
+    _streaming_is_valid = field_validator("streaming")(streaming_is_valid)
 
 
 class AzureProviderModel(ProviderModel):
     name: str = config.UploadProviderEnum.AZURE
     container_name: str
     connect_string: SecretStr
+    block_size_mb: int = Field(ge=1, le=4000, default=4)
+    max_concurrency: int = Field(ge=1, le=64, default=1)
+    max_bandwidth: int | None = Field(ge=1, default=None)
+    streaming: bool = False
+
+    _streaming_is_valid = field_validator("streaming")(streaming_is_valid)
@@ -1,14 +1,62 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import email.utils
+import functools
 import logging
 from abc import ABC, abstractmethod
+from datetime import UTC, datetime
 from typing import final
 
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
 log = logging.getLogger(__name__)
 
 
+@functools.cache
+def get_http_session() -> requests.Session:
+    """Session shared by webhook notifications, keeps connections open in pool."""
+    session = requests.Session()
+    retry = Retry(
+        total=4,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("", adapter=adapter)
+    return session
+
+
+class RateLimitedError(Exception):
+    """Notification system asked to retry sending after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str | None, default: float) -> float:
+    """Seconds to wait from `Retry-After` header, in seconds or HTTP date."""
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=UTC)
+    return max(0.0, (retry_at - datetime.now(UTC)).total_seconds())
+
+
 class NotificationSystem(ABC):
+    # minimal seconds between messages, to stay below rate limits of channel
+    min_interval_secs: float = 0
+
     @abstractmethod
     def _send(self, message: str) -> bool:  # pragma: no cover
         pass
@@ -17,6 +65,8 @@ class NotificationSystem(ABC):
     def send(self, message: str) -> bool:
         try:
             return self._send(message=message)
+        except RateLimitedError:
+            raise
         except Exception as err:
             log.error(
                 "fatal error when sending notification to '%s': %s",
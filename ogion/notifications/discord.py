@@ -3,19 +3,25 @@
 
 import logging
 
-import requests
-from requests.adapters import HTTPAdapter, Retry
-
 from ogion import config
-from ogion.notifications.base_notification_system import NotificationSystem
+from ogion.notifications.base_notification_system import (
+    NotificationSystem,
+    RateLimitedError,
+    get_http_session,
+    parse_retry_after,
+)
 
 log = logging.getLogger(__name__)
 
 
 STATUS_CODE_204 = 204
+STATUS_CODE_429 = 429
+RETRY_AFTER_DEFAULT_SECS = 2
 
 
 class Discord(NotificationSystem):
+    min_interval_secs = 2
+
     def _send(self, message: str) -> bool:
         if not config.options.DISCORD_WEBHOOK_URL:
             log.info("skip sending discord notification, no setup")
@@ -27,29 +33,27 @@ class Discord(NotificationSystem):
             message=message, limit=config.options.DISCORD_MAX_MSG_LEN
         )
 
-        with requests.session() as session:
-            retry = Retry(
-                total=4,
-                backoff_factor=0.5,
-                status_forcelist=[500, 502, 503, 504],
-            )
-            adapter = HTTPAdapter(max_retries=retry)
-            session.mount("", adapter=adapter)
-
-            discord_resp = session.post(
-                str(config.options.DISCORD_WEBHOOK_URL),
-                json={"content": content},
-                headers={"Content-Type": "application/json"},
-                timeout=3,
-            )
+        session = get_http_session()
+        discord_resp = session.post(
+            str(config.options.DISCORD_WEBHOOK_URL),
+            json={"content": content},
+            headers={"Content-Type": "application/json"},
+            timeout=3,
+        )
 
-            if discord_resp.status_code != STATUS_CODE_204:
-                log.error(
-                    "failed send discord `%s` to %s with status code %s and resp: %s",
-                    message,
-                    config.options.DISCORD_WEBHOOK_URL,
-                    discord_resp.status_code,
-                    discord_resp.content,
+        if discord_resp.status_code == STATUS_CODE_429:
+            raise RateLimitedError(
+                parse_retry_after(
+                    discord_resp.headers.get("Retry-After"), RETRY_AFTER_DEFAULT_SECS
                 )
-                return False
-            return True
+            )
+        if discord_resp.status_code != STATUS_CODE_204:
+            log.error(
+                "failed send discord `%s` to %s with status code %s and resp: %s",
+                message,
+                config.options.DISCORD_WEBHOOK_URL,
+                discord_resp.status_code,
+                discord_resp.content,
+            )
+            return False
+        return True
@@ -5,15 +5,21 @@
 https://discord.com/developers/docs/resources/webhook#execute-webhook
 """
 
+import collections
 import logging
+import threading
+import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
 from contextlib import ContextDecorator
 from datetime import UTC, datetime
 from enum import StrEnum
 from types import TracebackType
 
-from ogion import config
+from ogion import config, core
+from ogion.notifications.base_notification_system import (
+    NotificationSystem,
+    RateLimitedError,
+)
 from ogion.notifications.discord import Discord
 from ogion.notifications.slack import Slack
 from ogion.notifications.smtp import SMTP
@@ -30,6 +36,130 @@ class PROGRAM_STEP(StrEnum):
     DEBUG_NOTIFICATIONS = "debug check notifications are fired"
 
 
+class _Channel:
+    def __init__(self, system: NotificationSystem) -> None:
+        self.system = system
+        self.outbox: collections.deque[str] = collections.deque()
+        self.next_send_at = 0.0
+        self.attempts = 0
+
+
+class NotificationQueue:
+    """Fail messages are sent to notification systems in background thread.
+
+    Failures put within NOTIFICATIONS_DIGEST_SECS after the first one, for
+    example when many targets fail during database host outage, are joined
+    into one digest message. Every notification system has own outbox, keeps
+    its minimal interval between messages and waits `Retry-After` seconds
+    when rate limited, so backups never wait for slow or throttled webhooks.
+    """
+
+    MAX_ATTEMPTS = 5
+    MAX_RETRY_AFTER_SECS = 300
+
+    def __init__(self, systems: list[NotificationSystem]) -> None:
+        self._channels = [_Channel(system) for system in systems]
+        self._failures: list[tuple[str, str]] = []
+        self._window_ends_at = 0.0
+        self._thread: threading.Thread | None = None
+        self._cond = threading.Condition()
+
+    def put(self, summary: str, message: str) -> None:
+        with self._cond:
+            if not self._failures:
+                self._window_ends_at = (
+                    time.monotonic() + config.options.NOTIFICATIONS_DIGEST_SECS
+                )
+            self._failures.append((summary, message))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="notifications", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Wait until all messages are sent, False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._thread is None, timeout=timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                if self._failures and now >= self._window_ends_at:
+                    message = self.digest_message(self._failures)
+                    self._failures = []
+                    for channel in self._channels:
+                        channel.outbox.append(message)
+                ready = [
+                    channel
+                    for channel in self._channels
+                    if channel.outbox and channel.next_send_at <= now
+                ]
+                if not ready:
+                    wake_ups = [
+                        channel.next_send_at
+                        for channel in self._channels
+                        if channel.outbox
+                    ]
+                    if self._failures:
+                        wake_ups.append(self._window_ends_at)
+                    if not wake_ups:
+                        self._thread = None
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(timeout=min(wake_ups) - now)
+                    continue
+            core.map_io(self._deliver, ready, len(ready))
+
+    def _deliver(self, channel: _Channel) -> None:
+        system_name = channel.system.__class__.__name__
+        try:
+            channel.system.send(channel.outbox[0])
+        except RateLimitedError as err:
+            channel.attempts += 1
+            if (
+                channel.attempts < self.MAX_ATTEMPTS
+                and err.retry_after <= self.MAX_RETRY_AFTER_SECS
+            ):
+                log.warning(
+                    "notification to '%s' is rate limited, retry in %ss",
+                    system_name,
+                    err.retry_after,
+                )
+                with self._cond:
+                    channel.next_send_at = time.monotonic() + err.retry_after
+                return
+            log.error(
+                "dropping notification to '%s', rate limited %s times, "
+                "retry after %ss",
+                system_name,
+                channel.attempts,
+                err.retry_after,
+            )
+        with self._cond:
+            channel.attempts = 0
+            channel.outbox.popleft()
+            channel.next_send_at = time.monotonic() + channel.system.min_interval_secs
+
+    def digest_message(self, failures: list[tuple[str, str]]) -> str:
+        if len(failures) == 1:
+            return failures[0][1]
+        log.info("joining %s fail messages into digest", len(failures))
+        summaries = collections.Counter(summary for summary, _ in failures)
+        # summaries go first, so they are not cut by message length limits
+        msg = f"[FAIL] {len(failures)} failures\n"
+        msg += f"Ogion Host: {config.options.INSTANCE_NAME}\n\n"
+        for summary, count in summaries.items():
+            msg += f"- {summary}{f' (x{count})' if count > 1 else ''}\n"
+        msg += "\n" + "\n\n".join(message for _, message in failures)
+        return msg
+
+
+queue = NotificationQueue(systems=[Discord(), SMTP(), Slack()])
+
+
 class NotificationsContext(ContextDecorator):
     def __init__(
         self,
@@ -57,11 +187,15 @@ class NotificationsContext(ContextDecorator):
         msg += f"\n{tb}\n"
         return msg
 
-    def send_all(self, message: str) -> None:
-        with ThreadPoolExecutor() as executor:
-            executor.submit(Discord().send, message)
-            executor.submit(SMTP().send, message)
-            executor.submit(Slack().send, message)
+    def create_summary(
+        self, exc_type: type[BaseException], exc_val: BaseException
+    ) -> str:
+        target = f", target {self.env_name}" if self.env_name else ""
+        exc_first_line = next(iter(str(exc_val).splitlines()), "")
+        return f"{self.step_name}{target}: {exc_type.__name__}: {exc_first_line}"
+
+    def send_all(self, message: str, summary: str) -> None:
+        queue.put(summary=summary, message=message)
 
     def __enter__(self) -> None:
         log.debug("start notifications context: %s, %s", self.step_name, self.env_name)
@@ -81,4 +215,7 @@ class NotificationsContext(ContextDecorator):
 
             log.debug("fail message: %s", fail_message)
 
-            self.send_all(message=fail_message)
+            self.send_all(
+                message=fail_message,
+                summary=self.create_summary(exc_type=exc_type, exc_val=exc_val),
+            )
@@ -3,19 +3,25 @@
 
 import logging
 
-import requests
-from requests.adapters import HTTPAdapter, Retry
-
 from ogion import config
-from ogion.notifications.base_notification_system import NotificationSystem
+from ogion.notifications.base_notification_system import (
+    NotificationSystem,
+    RateLimitedError,
+    get_http_session,
+    parse_retry_after,
+)
 
 log = logging.getLogger(__name__)
 
 
 STATUS_CODE_200 = 200
+STATUS_CODE_429 = 429
+RETRY_AFTER_DEFAULT_SECS = 1
 
 
 class Slack(NotificationSystem):
+    min_interval_secs = 1
+
     def _send(self, message: str) -> bool:
         if not config.options.SLACK_WEBHOOK_URL:
             log.info("skip sending slack notification, no setup")
@@ -27,29 +33,27 @@ class Slack(NotificationSystem):
             message=message, limit=config.options.SLACK_MAX_MSG_LEN
         )
 
-        with requests.session() as session:
-            retry = Retry(
-                total=4,
-                backoff_factor=0.5,
-                status_forcelist=[500, 502, 503, 504],
-            )
-            adapter = HTTPAdapter(max_retries=retry)
-            session.mount("", adapter=adapter)
-
-            slack_resp = session.post(
-                str(config.options.SLACK_WEBHOOK_URL),
-                json={"text": content},
-                headers={"Content-Type": "application/json"},
-                timeout=3,
-            )
+        session = get_http_session()
+        slack_resp = session.post(
+            str(config.options.SLACK_WEBHOOK_URL),
+            json={"text": content},
+            headers={"Content-Type": "application/json"},
+            timeout=3,
+        )
 
-            if slack_resp.status_code != STATUS_CODE_200:
-                log.error(
-                    "failed send slack `%s` to %s with status code %s and resp: %s",
-                    message,
-                    config.options.SLACK_WEBHOOK_URL,
-                    slack_resp.status_code,
-                    slack_resp.content,
+        if slack_resp.status_code == STATUS_CODE_429:
+            raise RateLimitedError(
+                parse_retry_after(
+                    slack_resp.headers.get("Retry-After"), RETRY_AFTER_DEFAULT_SECS
                 )
-                return False
-            return True
+            )
+        if slack_resp.status_code != STATUS_CODE_200:
+            log.error(
+                "failed send slack `%s` to %s with status code %s and resp: %s",
+                message,
+                config.options.SLACK_WEBHOOK_URL,
+                slack_resp.status_code,
+                slack_resp.content,
+            )
+            return False
+        return True
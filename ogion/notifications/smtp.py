@@ -4,6 +4,9 @@
 import logging
 import smtplib
 import ssl
+import threading
+import time
+from contextlib import suppress
 
 from ogion import config
 from ogion.notifications.base_notification_system import NotificationSystem
@@ -12,6 +15,68 @@ log = logging.getLogger(__name__)
 
 context = ssl.create_default_context()
 
+# reused connection older than that is likely closed by server already
+SMTP_KEEPALIVE_SECS = 60
+SMTP_NOOP_OK = 250
+
+
+class SMTPConnection:
+    """Logged in connection reused by notifications sent shortly one after another."""
+
+    def __init__(self) -> None:
+        self._server: smtplib.SMTP | None = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        log.debug("connecting to smtp server %s", config.options.SMTP_HOST)
+        server = smtplib.SMTP(
+            host=config.options.SMTP_HOST, port=config.options.SMTP_PORT
+        )
+        try:
+            server.starttls(context=context)
+            server.login(
+                user=config.options.SMTP_FROM_ADDR,
+                password=config.options.SMTP_PASSWORD.get_secret_value(),
+            )
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _is_alive(self, server: smtplib.SMTP) -> bool:
+        if time.monotonic() - self._last_used > SMTP_KEEPALIVE_SECS:
+            return False
+        try:
+            return server.noop()[0] == SMTP_NOOP_OK
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _close(self) -> None:
+        if self._server is not None:
+            with suppress(smtplib.SMTPException, OSError):
+                self._server.quit()
+            self._server = None
+
+    def sendmail(self, to_addrs: list[str], msg: str) -> None:
+        with self._lock:
+            if self._server is None or not self._is_alive(self._server):
+                self._close()
+                self._server = self._connect()
+            try:
+                self._server.sendmail(
+                    from_addr=config.options.SMTP_FROM_ADDR,
+                    to_addrs=to_addrs,
+                    msg=msg,
+                )
+            except Exception:
+                self._close()
+                raise
+            self._last_used = time.monotonic()
+
+
+connection = SMTPConnection()
+
 
 class SMTP(NotificationSystem):
     def _send(self, message: str) -> bool:
@@ -36,19 +101,5 @@ class SMTP(NotificationSystem):
             email_message,
         )
 
-        with smtplib.SMTP(
-            host=config.options.SMTP_HOST, port=config.options.SMTP_PORT
-        ) as smtp_server:
-            smtp_server.starttls(context=context)
-
-            smtp_server.login(
-                user=config.options.SMTP_FROM_ADDR,
-                password=config.options.SMTP_PASSWORD.get_secret_value(),
-            )
-
-            smtp_server.sendmail(
-                from_addr=config.options.SMTP_FROM_ADDR,
-                to_addrs=config.options.smtp_addresses,
-                msg=email_message,
-            )
-            return True
+        connection.sendmail(to_addrs=config.options.smtp_addresses, msg=email_message)
+        return True
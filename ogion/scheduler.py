@@ -0,0 +1,136 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import heapq
+import itertools
+import logging
+import queue
+import threading
+from collections.abc import Callable
+from datetime import UTC, datetime
+
+from ogion.backup_targets.base_target import BaseBackupTarget
+
+log = logging.getLogger(__name__)
+
+# wall clock can jump (ntp sync, host suspend), so long sleeps are split
+MAX_SLEEP_SECS = 60.0
+
+
+class BackupScheduler:
+    """Runs due backups on fixed number of worker threads.
+
+    When more targets are due than there are workers, the rest waits in
+    queue and the earliest scheduled backup is picked first.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[BaseBackupTarget], None],
+        workers: int,
+        exit_event: threading.Event,
+    ) -> None:
+        self.run = run
+        self.workers = workers
+        self.exit_event = exit_event
+        self._queue: queue.PriorityQueue[tuple[datetime, int, BaseBackupTarget]] = (
+            queue.PriorityQueue()
+        )
+        # tie breaker, targets itself are not comparable
+        self._counter = itertools.count()
+        self._pending: set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        log.info("starting %s backup workers", self.workers)
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, daemon=True, name=f"Worker-{number}"
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, target: BaseBackupTarget, scheduled_at: datetime) -> bool:
+        with self._pending_lock:
+            if target.env_name in self._pending:
+                log.warning(
+                    "previous backup of target `%s` is still queued or running, "
+                    "skipping backup scheduled at %s",
+                    target.env_name,
+                    scheduled_at,
+                )
+                return False
+            self._pending.add(target.env_name)
+
+        log.debug("queue backup of target `%s` at %s", target.env_name, scheduled_at)
+        self._queue.put((scheduled_at, next(self._counter), target))
+        return True
+
+    def pending(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def wait_until_idle(self) -> None:
+        while self.pending() and not self.exit_event.wait(0.5):
+            pass
+
+    def _worker(self) -> None:
+        while not self.exit_event.is_set():
+            try:
+                _, _, target = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            worker_name = threading.current_thread().name
+            threading.current_thread().name = (
+                f"Thread-{target.env_name.replace('_', '-')}"
+            )
+            try:
+                self.run(target)
+            except Exception:
+                # errors are already logged and notified in run
+                log.error("backup of target `%s` failed", target.env_name)
+            finally:
+                threading.current_thread().name = worker_name
+                with self._pending_lock:
+                    self._pending.discard(target.env_name)
+                self._queue.task_done()
+
+
+class CronTimer:
+    """Heap of targets ordered by their next backup time.
+
+    Sleeps until the earliest backup is due and reschedules only the
+    targets that fired, other cron rules are not evaluated again.
+    """
+
+    def __init__(self, targets: list[BaseBackupTarget]) -> None:
+        self._counter = itertools.count()
+        self._heap: list[tuple[datetime, int, BaseBackupTarget]] = [
+            (target.next_backup_time, next(self._counter), target) for target in targets
+        ]
+        heapq.heapify(self._heap)
+
+    def wait_for_due_targets(
+        self, exit_event: threading.Event
+    ) -> list[BaseBackupTarget]:
+        while self._heap and not exit_event.is_set():
+            next_backup_time = self._heap[0][0]
+            sleep_secs = (next_backup_time - datetime.now(UTC)).total_seconds()
+            if sleep_secs > 0:
+                exit_event.wait(min(sleep_secs, MAX_SLEEP_SECS))
+                continue
+
+            due_targets: list[BaseBackupTarget] = []
+            now = datetime.now(UTC)
+            while self._heap and self._heap[0][0] <= now:
+                _, _, target = heapq.heappop(self._heap)
+                target.schedule_next_backup()
+                heapq.heappush(
+                    self._heap,
+                    (target.next_backup_time, next(self._counter), target),
+                )
+                due_targets.append(target)
+            return due_targets
+        return []
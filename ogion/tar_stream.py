@@ -0,0 +1,96 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import io
+import logging
+import os
+import tarfile
+from pathlib import Path
+from typing import IO
+
+from ogion.fingerprint import walk_paths
+
+log = logging.getLogger(__name__)
+
+COPY_BUFSIZE = 1024 * 1024
+
+
+def _send_file(path: Path, size: int, stream: IO[bytes]) -> int:
+    """Copy first `size` bytes of file to stream, return number of bytes copied.
+
+    When stream is backed by file descriptor (pipe to 7-zip), data is copied
+    by kernel with sendfile and never passes through python buffers.
+    """
+    copied = 0
+    with open(path, "rb") as file:
+        try:
+            out_fd = stream.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            out_fd = None
+
+        if out_fd is not None:
+            stream.flush()
+            while copied < size:
+                sent = os.sendfile(out_fd, file.fileno(), copied, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+            return copied
+
+        while copied < size:
+            chunk = file.read(min(COPY_BUFSIZE, size - copied))
+            if not chunk:
+                break
+            stream.write(chunk)
+            copied += len(chunk)
+    return copied
+
+
+def write_tar_stream(abs_path: Path, stream: IO[bytes]) -> None:
+    """Write tar archive of file or directory to forward only stream.
+
+    Hardlinked files are stored once, symlinks are stored as links, not
+    followed. Files that shrink while read are padded with zeros and files
+    that grow are truncated to size from their header.
+    """
+    # used only to build headers, hardlinks are detected by its inode map
+    headers = tarfile.TarFile(fileobj=io.BytesIO(), mode="w")
+    root_name = abs_path.name
+    # target path itself can be symlink, its content is archived
+    abs_path = abs_path.resolve()
+    paths = walk_paths(abs_path)
+    if abs_path.is_dir():
+        paths = [(root_name, abs_path), *paths]
+
+    entries = 0
+    for relative_path, path in paths:
+        if path == abs_path:
+            arcname = root_name
+        else:
+            arcname = f"{root_name}/{relative_path}"
+        try:
+            tarinfo = headers.gettarinfo(path, arcname=arcname)
+        except FileNotFoundError:
+            log.warning("skipping %s removed while creating tar stream", path)
+            continue
+        if tarinfo is None:
+            log.warning("skipping %s, sockets cannot be archived", path)
+            continue
+
+        stream.write(tarinfo.tobuf(headers.format, headers.encoding, headers.errors))
+        entries += 1
+        if not tarinfo.isreg():
+            continue
+
+        copied = _send_file(path, tarinfo.size, stream)
+        if copied < tarinfo.size:
+            log.warning("%s shrank while creating tar stream, padding it", path)
+            stream.write(tarfile.NUL * (tarinfo.size - copied))
+        remainder = tarinfo.size % tarfile.BLOCKSIZE
+        if remainder:
+            stream.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    # end of archive marker, padded to full record like tar does
+    stream.write(tarfile.NUL * tarfile.RECORDSIZE)
+    stream.flush()
+    log.debug("finished tar stream of %s with %s entries", abs_path, entries)
@@ -0,0 +1,394 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Benchmark of archive and upload stages on synthetic backups.
+
+Measures start of ogion process with every provider imported, generates SQL
+dump and directory tree of given size and entropy, measures creating zip
+archive with every given format and level, then end-to-end
+`run_backup` to provider from BACKUP_PROVIDER environment variable. Use
+local stand-ins like Azurite or fake-gcs-server to benchmark cloud providers
+without costs. Results are saved as JSON and can be compared with results of
+previous release using --compare.
+
+    BACKUP_PROVIDER="name=debug" ZIP_ARCHIVE_PASSWORD=benchmark \\
+        python -m ogion.tools.benchmark --size-mb 256 --output benchmark.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, TypeVar
+
+from ogion import config, core, main, metrics
+from ogion.backup_targets import base_target, targets_mapping
+from ogion.models import backup_target_models
+from ogion.upload_providers import base_provider, providers_mapping
+
+_T = TypeVar("_T")
+
+CHUNK_SIZE = 1024 * 1024
+FILES_PER_FOLDER = 50
+IMPORT_SCRIPT = """
+import resource, sys
+from ogion import main
+from ogion.upload_providers import providers_mapping
+providers_mapping.get_provider_cls(sys.argv[1])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+LOREM = (
+    b"Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod "
+    b"tempor incididunt ut labore et dolore magna aliqua. "
+)
+
+
+def _payload(size: int, entropy: float, rng: random.Random) -> bytes:
+    """Bytes of given size where `entropy` part is random and rest is text."""
+    random_size = int(size * entropy)
+    random_part = base64.b64encode(rng.randbytes(random_size))[:random_size]
+    text_size = size - len(random_part)
+    text_part = (LOREM * (text_size // len(LOREM) + 1))[:text_size]
+    return text_part + random_part
+
+
+def generate_sql_dump(path: Path, size: int, entropy: float, seed: int) -> Path:
+    rng = random.Random(seed)
+    with open(path, "wb") as dump:
+        dump.write(b"CREATE TABLE benchmark (id bigint PRIMARY KEY, payload text);\n")
+        row_id = 0
+        while dump.tell() < size:
+            row_id += 1
+            payload = _payload(rng.randint(64, 512), entropy, rng)
+            dump.write(
+                b"INSERT INTO benchmark (id, payload) VALUES (%d, '%s');\n"
+                % (row_id, payload)
+            )
+    return path
+
+
+def generate_directory(
+    path: Path, size: int, files: int, entropy: float, seed: int
+) -> Path:
+    rng = random.Random(seed)
+    file_size = size // files
+    for file_number in range(files):
+        folder = path / f"folder_{file_number // FILES_PER_FOLDER}"
+        folder.mkdir(parents=True, exist_ok=True)
+        with open(folder / f"file_{file_number}.txt", "wb") as file:
+            left = file_size
+            while left > 0:
+                chunk = min(left, CHUNK_SIZE)
+                file.write(_payload(chunk, entropy, rng))
+                left -= chunk
+    return path
+
+
+@contextmanager
+def _options(**options: Any) -> Generator[None, None, None]:
+    previous = {name: getattr(config.options, name) for name in options}
+    for name, value in options.items():
+        setattr(config.options, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(config.options, name, value)
+
+
+def _measure(func: Callable[[], Any], repeat: int) -> list[float]:
+    seconds: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def _mb_per_sec(size: int, seconds: float) -> float:
+    return size / 1024 / 1024 / seconds
+
+
+def benchmark_import(provider_name: str, repeat: int) -> dict[str, Any]:
+    """Start of new python process importing ogion and class of provider."""
+    max_rss_kb: list[int] = []
+
+    def import_provider() -> None:
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT, provider_name],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        max_rss_kb.append(int(result.stdout))
+
+    seconds = _measure(import_provider, repeat)
+    return {
+        "name": f"import/{provider_name}",
+        "benchmark": "import",
+        "provider": provider_name,
+        "seconds": statistics.median(seconds),
+        "seconds_min": min(seconds),
+        "max_rss_kb": statistics.median(max_rss_kb),
+    }
+
+
+def benchmark_archive(
+    dataset: str, backup_file: Path, formats: list[str], levels: list[int], repeat: int
+) -> list[dict[str, Any]]:
+    raw_bytes = metrics.path_size(backup_file)
+    assert raw_bytes is not None
+    results: list[dict[str, Any]] = []
+    for archive_format in formats:
+        for level in levels:
+            integrity_check = config.options.ZIP_INTEGRITY_CHECK
+            if archive_format == "7z":
+                # 7-zip can write only zip archives to stdout
+                integrity_check = "test"
+            with _options(
+                ZIP_ARCHIVE_FORMAT=archive_format,
+                ZIP_ARCHIVE_LEVEL=level,
+                ZIP_INTEGRITY_CHECK=integrity_check,
+            ):
+                out_file = core.get_zip_archive_path(backup_file)
+
+                def create_zip_archive() -> None:
+                    core.remove_path(out_file)
+                    core.run_create_zip_archive(backup_file)
+                    core.pop_zip_archive_md5(out_file)
+
+                seconds = _measure(create_zip_archive, repeat)
+                compressed_bytes = out_file.stat().st_size
+                core.remove_path(out_file)
+
+            median = statistics.median(seconds)
+            results.append(
+                {
+                    "name": f"archive/{dataset}/{archive_format}/{level}",
+                    "benchmark": "archive",
+                    "dataset": dataset,
+                    "format": archive_format,
+                    "level": level,
+                    "raw_bytes": raw_bytes,
+                    "compressed_bytes": compressed_bytes,
+                    "compression_ratio": raw_bytes / compressed_bytes,
+                    "seconds": median,
+                    "seconds_min": min(seconds),
+                    "mb_per_sec": _mb_per_sec(raw_bytes, median),
+                }
+            )
+    return results
+
+
+def benchmark_backup(
+    dataset: str,
+    target: base_target.BaseBackupTarget,
+    provider: base_provider.BaseUploadProvider,
+    provider_name: str,
+    repeat: int,
+) -> dict[str, Any]:
+    runs: list[metrics.BackupMetrics] = []
+
+    def run_backup() -> None:
+        main.run_backup(target=target, provider=provider)
+        backup_metrics = metrics.registry.last(target.env_name)
+        assert backup_metrics is not None and backup_metrics.status == "success"
+        runs.append(backup_metrics)
+
+    seconds = _measure(run_backup, repeat)
+    core.remove_path(config.CONST_BACKUP_FOLDER_PATH / target.env_name)
+
+    upload_speeds = [
+        run.upload_bytes_per_second / 1024 / 1024
+        for run in runs
+        if run.upload_bytes_per_second is not None
+    ]
+    return {
+        "name": f"backup/{dataset}/{provider_name}",
+        "benchmark": "backup",
+        "dataset": dataset,
+        "provider": provider_name,
+        "raw_bytes": runs[-1].raw_bytes,
+        "compressed_bytes": runs[-1].compressed_bytes,
+        "seconds": statistics.median(seconds),
+        "seconds_min": min(seconds),
+        "stage_seconds": {
+            stage: statistics.median(run.stage_seconds.get(stage, 0) for run in runs)
+            for stage in metrics.STAGES
+        },
+        "upload_mb_per_sec": (
+            statistics.median(upload_speeds) if upload_speeds else None
+        ),
+    }
+
+
+def compare(
+    results: list[dict[str, Any]], baseline: list[dict[str, Any]], threshold: float
+) -> list[str]:
+    """Names of benchmarks slower than in baseline by more than threshold %."""
+    baseline_seconds = {result["name"]: result["seconds"] for result in baseline}
+    regressions: list[str] = []
+    for result in results:
+        previous = baseline_seconds.get(result["name"])
+        if previous is None:
+            continue
+        change = (result["seconds"] / previous - 1) * 100
+        regression = change > threshold
+        print(
+            f"{result['name']:<40} {previous:>10.3f}s {result['seconds']:>10.3f}s "
+            f"{change:>+8.1f}%{'  REGRESSION' if regression else ''}"
+        )
+        if regression:
+            regressions.append(result["name"])
+    return regressions
+
+
+def _comma_list(value_type: Callable[[str], _T]) -> Callable[[str], list[_T]]:
+    return lambda value: [value_type(item) for item in value.split(",")]
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark of archive and upload stages"
+    )
+    parser.add_argument("--size-mb", type=int, default=64, help="size of datasets")
+    parser.add_argument(
+        "--entropy",
+        type=float,
+        default=0.3,
+        help="part of random, uncompressible data in datasets, from 0 to 1",
+    )
+    parser.add_argument(
+        "--files", type=int, default=500, help="number of files in directory"
+    )
+    parser.add_argument("--formats", type=_comma_list(str), default=["zip", "7z"])
+    parser.add_argument("--levels", type=_comma_list(int), default=[1, 3, 5, 9])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--providers",
+        type=_comma_list(str),
+        default=list(providers_mapping.PROVIDER_CLS_PATHS),
+        help="providers to benchmark import time of",
+    )
+    parser.add_argument(
+        "--skip-backup",
+        action="store_true",
+        help="benchmark only archive, without end-to-end backup to provider",
+    )
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("--compare", type=Path, help="results of previous benchmark")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="slowdown in %% reported as regression by --compare",
+    )
+    args = parser.parse_args(argv)
+    if not 0 <= args.entropy <= 1:
+        parser.error("--entropy must be between 0 and 1")
+    if args.size_mb < 1 or args.files < 1 or args.repeat < 1:
+        parser.error("--size-mb, --files and --repeat must be positive")
+    if not set(args.formats) <= {"zip", "7z"}:
+        parser.error("--formats must be zip or 7z")
+    providers = providers_mapping.PROVIDER_CLS_PATHS
+    if not set(args.providers) <= set(providers):
+        parser.error(f"--providers must be one of {', '.join(providers)}")
+    if not set(args.levels) <= set(range(1, 10)):
+        parser.error("--levels must be between 1 and 9")
+    return args
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    size = args.size_mb * 1024 * 1024
+    results = [
+        benchmark_import(provider_name, args.repeat) for provider_name in args.providers
+    ]
+    with tempfile.TemporaryDirectory(prefix="ogion_benchmark_") as tmp_dir:
+        datasets = {
+            "sql_dump": generate_sql_dump(
+                Path(tmp_dir) / "dump.sql", size, args.entropy, args.seed
+            ),
+            "directory": generate_directory(
+                Path(tmp_dir) / "directory", size, args.files, args.entropy, args.seed
+            ),
+        }
+        for dataset, backup_file in datasets.items():
+            results += benchmark_archive(
+                dataset, backup_file, args.formats, args.levels, args.repeat
+            )
+
+        if not args.skip_backup:
+            provider_model = core.create_provider_model()
+            provider = providers_mapping.get_provider_cls(provider_model.name)(
+                target_provider=provider_model
+            )
+            target_cls_map = targets_mapping.get_target_cls_map()
+            target_models: dict[str, backup_target_models.TargetModel] = {
+                "sql_dump": backup_target_models.SingleFileTargetModel(
+                    env_name="benchmark_sql_dump",
+                    cron_rule="* * * * *",
+                    abs_path=datasets["sql_dump"],
+                    max_backups=1,
+                    min_retention_days=0,
+                ),
+                "directory": backup_target_models.DirectoryTargetModel(
+                    env_name="benchmark_directory",
+                    cron_rule="* * * * *",
+                    abs_path=datasets["directory"],
+                    max_backups=1,
+                    min_retention_days=0,
+                ),
+            }
+            for dataset, target_model in target_models.items():
+                target = target_cls_map[target_model.name](target_model=target_model)
+                results.append(
+                    benchmark_backup(
+                        dataset, target, provider, provider_model.name, args.repeat
+                    )
+                )
+
+    return {
+        "created_at": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "params": {
+            "size_mb": args.size_mb,
+            "entropy": args.entropy,
+            "files": args.files,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "zip_archive_threads": config.options.ZIP_ARCHIVE_THREADS,
+            "zip_integrity_check": config.options.ZIP_INTEGRITY_CHECK,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    args.output.write_text(json.dumps(report, indent=2))
+
+    for result in report["results"]:
+        if result["benchmark"] == "import":
+            details = f"max rss {result['max_rss_kb'] / 1024:>6.1f} MB"
+        else:
+            details = f"ratio {result['raw_bytes'] / result['compressed_bytes']:>6.2f}"
+        print(f"{result['name']:<40} {result['seconds']:>10.3f}s {details}")
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())["results"]
+        if compare(report["results"], baseline, args.threshold):
+            sys.exit(1)
@@ -1,30 +1,45 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import hashlib
 import logging
+import math
+from functools import partial
 from pathlib import Path
 from typing import Any, TypedDict
 
 import boto3
 from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 
-from ogion import core
+from ogion import backup_index, config, core, metrics, upload_sessions
 from ogion.models.upload_provider_models import AWSProviderModel
 from ogion.upload_providers.base_provider import BaseUploadProvider
 
 log = logging.getLogger(__name__)
 
+# s3 limit of parts in one multipart upload
+MAX_PARTS = 10_000
+MIB = 1024 * 1024
+
 
 class DeleteItemDict(TypedDict):
     Key: str
 
 
+def _multipart_e_tag(part_md5s: list[bytes]) -> str:
+    """E-tag of s3 multipart upload, md5 of md5 digests of its parts and their count."""
+    e_tag_md5 = hashlib.md5(b"".join(part_md5s), usedforsecurity=False)
+    return f"{e_tag_md5.hexdigest()}-{len(part_md5s)}"
+
+
 class UploadProviderAWS(BaseUploadProvider):
     """AWS S3 bucket for storing backups"""
 
     def __init__(self, target_provider: AWSProviderModel) -> None:
         self.bucket_upload_path = target_provider.bucket_upload_path
         self.max_bandwidth = target_provider.max_bandwidth
+        self.streaming = target_provider.streaming
 
         s3: Any = boto3.resource(
             "s3",
@@ -34,28 +49,262 @@ class UploadProviderAWS(BaseUploadProvider):
         )
 
         self.bucket = s3.Bucket(target_provider.bucket_name)
-        self.transfer_config = TransferConfig(max_bandwidth=self.max_bandwidth)
-
-    def _post_save(self, backup_file: Path) -> str:
-        zip_backup_file = core.run_create_zip_archive(backup_file=backup_file)
+        multipart_chunksize = target_provider.multipart_chunksize_mb * 1024 * 1024
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunksize,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=target_provider.max_concurrency,
+            use_threads=target_provider.max_concurrency > 1,
+            max_bandwidth=self.max_bandwidth,
+        )
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = target_provider.max_concurrency
+        # boto3 applies max_bandwidth to its own transfers
+        self.bandwidth_limiters = core.get_upload_bandwidth_limiters()
+        # resumable multipart upload is made without boto3 transfer manager
+        self.multipart_bandwidth_limiters = core.get_upload_bandwidth_limiters(
+            self.max_bandwidth
+        )
+        self.upload_sessions = upload_sessions.UploadSessions(
+            config.UploadProviderEnum.AWS_S3, abort=self._abort_multipart_upload
+        )
+        self.location = f"s3://{target_provider.bucket_name}/{self.bucket_upload_path}"
+        self.backup_index = backup_index.BackupIndex(
+            config.UploadProviderEnum.AWS_S3, self.location
+        )
 
-        backup_dest_in_bucket = (
+    def _get_backup_dest_in_bucket(self, zip_backup_file: Path) -> str:
+        return (
             f"{self.bucket_upload_path}/"
             f"{zip_backup_file.parent.name}/"
             f"{zip_backup_file.name}"
         )
 
+    def _verify_uploaded_e_tag(
+        self,
+        zip_backup_file: Path,
+        backup_dest_in_bucket: str,
+        archive_stream: core.ZipArchiveStream,
+    ) -> None:
+        """Compare e-tag of uploaded object with archive read by `archive_stream`."""
+        e_tag: str = self.bucket.Object(backup_dest_in_bucket).e_tag.strip('"')
+        if "-" not in e_tag:
+            core.verify_zip_archive_md5(zip_backup_file, archive_stream.md5(), e_tag)
+            return
+        expected_e_tag = _multipart_e_tag(archive_stream.part_md5s())
+        if expected_e_tag != e_tag:
+            raise core.ZipArchiveIntegrityError(
+                f"zip archive {zip_backup_file} e-tag {expected_e_tag} does not "
+                f"match e-tag {e_tag} of uploaded file"
+            )
+        log.info("zip archive %s e-tag matches uploaded file", zip_backup_file)
+
+    def _read_zip_archive(
+        self, zip_backup_file: Path, expected_md5: str
+    ) -> core.ZipArchiveStream:
+        """Read archive again, computing md5 of parts it was uploaded in."""
+        part_size = self._get_part_size(zip_backup_file.stat().st_size)
+        with open(zip_backup_file, "rb") as zip_file:
+            archive_stream = core.ZipArchiveStream(zip_file, part_size)
+            while archive_stream.read(MIB):
+                pass
+        if archive_stream.md5() != expected_md5:
+            raise core.ZipArchiveIntegrityError(
+                f"zip archive {zip_backup_file} md5 {archive_stream.md5()} does not "
+                f"match md5 {expected_md5} computed while it was written"
+            )
+        return archive_stream
+
+    def _post_save(self, backup_file: Path) -> str:
+        if self.streaming:
+            return self._post_save_streaming(backup_file=backup_file)
+
+        zip_backup_file = core.run_create_zip_archive(backup_file=backup_file)
+        return self._upload_zip_archive(zip_backup_file)
+
+    def _resume_upload(self, env_name: str) -> str | None:
+        session = self.upload_sessions.pending(env_name)
+        if session is None:
+            return None
+        log.info("resuming interrupted upload of %s", session.zip_file)
+        try:
+            return self._upload_zip_archive(Path(session.zip_file))
+        except Exception:
+            # do not retry it before every next backup
+            self.upload_sessions.drop(env_name)
+            raise
+
+    def _upload_zip_archive(self, zip_backup_file: Path) -> str:
+        backup_dest_in_bucket = self._get_backup_dest_in_bucket(zip_backup_file)
+
         log.info("start uploading %s to %s", zip_backup_file, backup_dest_in_bucket)
 
-        self.bucket.upload_file(
-            Filename=zip_backup_file,
-            Key=backup_dest_in_bucket,
-            Config=self.transfer_config,
+        with core.upload_slots:
+            if zip_backup_file.stat().st_size > self.multipart_chunksize:
+                self._upload_multipart(zip_backup_file, backup_dest_in_bucket)
+            elif self.bandwidth_limiters:
+                with open(zip_backup_file, "rb") as zip_file:
+                    self.bucket.upload_fileobj(
+                        Fileobj=core.ThrottledReader(zip_file, self.bandwidth_limiters),
+                        Key=backup_dest_in_bucket,
+                        Config=self.transfer_config,
+                    )
+            else:
+                self.bucket.upload_file(
+                    Filename=zip_backup_file,
+                    Key=backup_dest_in_bucket,
+                    Config=self.transfer_config,
+                )
+
+        expected_md5 = core.pop_zip_archive_md5(zip_backup_file)
+        if expected_md5 is not None:
+            try:
+                self._verify_uploaded_e_tag(
+                    zip_backup_file,
+                    backup_dest_in_bucket,
+                    self._read_zip_archive(zip_backup_file, expected_md5),
+                )
+            except core.ZipArchiveIntegrityError:
+                log.error("removing corrupted %s from aws s3", backup_dest_in_bucket)
+                self.bucket.Object(backup_dest_in_bucket).delete()
+                raise
+
+        log.info("uploaded %s to %s", zip_backup_file, backup_dest_in_bucket)
+        self.backup_index.add(
+            zip_backup_file.parent.name,
+            backup_dest_in_bucket,
+            zip_backup_file.stat().st_size,
+            expected_md5,
+        )
+        metrics.record_compressed_bytes(zip_backup_file.stat().st_size)
+        return backup_dest_in_bucket
+
+    def _abort_multipart_upload(self, session: upload_sessions.UploadSession) -> None:
+        self.bucket.meta.client.abort_multipart_upload(
+            Bucket=self.bucket.name, Key=session.key, UploadId=session.session_id
         )
 
+    def _list_uploaded_parts(self, key: str, upload_id: str) -> dict[int, str]:
+        paginator = self.bucket.meta.client.get_paginator("list_parts")
+        return {
+            part["PartNumber"]: part["ETag"]
+            for page in paginator.paginate(
+                Bucket=self.bucket.name, Key=key, UploadId=upload_id
+            )
+            for part in page.get("Parts", [])
+        }
+
+    def _get_part_size(self, size: int) -> int:
+        """Part size of multipart upload, raised to whole MiB for huge archives."""
+        if size <= self.multipart_chunksize * MAX_PARTS:
+            return self.multipart_chunksize
+        return math.ceil(size / MAX_PARTS / MIB) * MIB
+
+    def _upload_multipart(self, zip_backup_file: Path, key: str) -> None:
+        """Multipart upload that can be resumed after restart from its session."""
+        client = self.bucket.meta.client
+        part_size = self._get_part_size(zip_backup_file.stat().st_size)
+        session = self.upload_sessions.find(zip_backup_file, key, part_size)
+        uploaded: dict[int, str] = {}
+        if session is not None:
+            try:
+                uploaded = self._list_uploaded_parts(key, session.session_id)
+            except ClientError as err:
+                log.warning(
+                    "cannot resume upload of %s, starting again: %s",
+                    zip_backup_file,
+                    err,
+                )
+                self.upload_sessions.drop(zip_backup_file.parent.name)
+                session = None
+        if session is None:
+            upload_id = client.create_multipart_upload(
+                Bucket=self.bucket.name, Key=key
+            )["UploadId"]
+            session = self.upload_sessions.start(
+                zip_backup_file, key, part_size, upload_id
+            )
+
+        def upload_part(part_number: int, data: bytes) -> str:
+            response = client.upload_part(
+                Bucket=self.bucket.name,
+                Key=key,
+                PartNumber=part_number,
+                UploadId=session.session_id,
+                Body=data,
+            )
+            return str(response["ETag"])
+
+        uploaded |= upload_sessions.upload_parts(
+            session,
+            set(uploaded),
+            upload_part,
+            self.max_concurrency,
+            self.multipart_bandwidth_limiters,
+        )
+        client.complete_multipart_upload(
+            Bucket=self.bucket.name,
+            Key=key,
+            UploadId=session.session_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": part_number, "ETag": uploaded[part_number]}
+                    for part_number in sorted(uploaded)
+                ]
+            },
+        )
+        self.upload_sessions.remove(zip_backup_file.parent.name)
+
+    def _post_save_streaming(self, backup_file: Path) -> str:
+        zip_backup_file = core.get_zip_archive_path(backup_file)
+        backup_dest_in_bucket = self._get_backup_dest_in_bucket(zip_backup_file)
+
+        log.info("start streaming %s to %s", zip_backup_file, backup_dest_in_bucket)
+
+        try:
+            with (
+                core.upload_slots,
+                # boto3 buffers parts of stream read by its upload threads
+                core.reserve_upload_memory(
+                    self.multipart_chunksize * self.max_concurrency
+                ),
+                # boto3 uploads stream in parts of multipart_chunksize
+                core.open_zip_archive_stream(
+                    backup_file, self.multipart_chunksize
+                ) as archive_stream,
+            ):
+                self.bucket.upload_fileobj(
+                    Fileobj=core.ThrottledReader(
+                        archive_stream, self.bandwidth_limiters
+                    ),
+                    Key=backup_dest_in_bucket,
+                    Config=self.transfer_config,
+                )
+            if core.use_checksum_integrity_check():
+                self._verify_uploaded_e_tag(
+                    zip_backup_file, backup_dest_in_bucket, archive_stream
+                )
+        except (core.CoreSubprocessError, core.ZipArchiveIntegrityError):
+            log.error("removing incomplete %s from aws s3", backup_dest_in_bucket)
+            self.bucket.Object(backup_dest_in_bucket).delete()
+            raise
+
         log.info("uploaded %s to %s", zip_backup_file, backup_dest_in_bucket)
+        self.backup_index.add(
+            zip_backup_file.parent.name,
+            backup_dest_in_bucket,
+            archive_stream.tell(),
+            archive_stream.md5(),
+        )
+        metrics.record_compressed_bytes(archive_stream.tell())
         return backup_dest_in_bucket
 
+    def _list_backups(self, prefix: str) -> list[str]:
+        return [
+            bucket_obj.key
+            for bucket_obj in self.bucket.objects.filter(Delimiter="/", Prefix=prefix)
+        ]
+
     def _clean(
         self, backup_file: Path, max_backups: int, min_retention_days: int
     ) -> None:
@@ -63,10 +312,12 @@ class UploadProviderAWS(BaseUploadProvider):
             core.remove_path(backup_path)
             log.info("removed %s from local disk", backup_path)
 
-        backup_list_cloud: list[str] = []
-        prefix = f"{self.bucket_upload_path}/{backup_file.parent.name}/"
-        for bucket_obj in self.bucket.objects.filter(Delimiter="/", Prefix=prefix):
-            backup_list_cloud.append(bucket_obj.key)
+        env_name = backup_file.parent.name
+        prefix = f"{self.bucket_upload_path}/{env_name}/"
+        backup_list_cloud = self.backup_index.backup_keys(
+            env_name, partial(self._list_backups, prefix)
+        )
+        backups_count = len(backup_list_cloud)
 
         # remove oldest
         backup_list_cloud.sort(reverse=True)
@@ -103,3 +354,7 @@ class UploadProviderAWS(BaseUploadProvider):
                 "%s backups were successfully deleted from aws s3 bucket",
                 len(items_to_delete),
             )
+            self.backup_index.remove(
+                env_name, [item["Key"] for item in items_to_delete]
+            )
+        metrics.record_cleanup(backups_count, len(items_to_delete))
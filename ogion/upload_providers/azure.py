@@ -2,33 +2,84 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import logging
+from functools import partial
+from http import HTTPStatus
 from pathlib import Path
+from typing import Any
 
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobBlock, BlobClient, BlobServiceClient
 
-from ogion import core
+from ogion import backup_index, config, core, metrics, upload_sessions
 from ogion.models.upload_provider_models import AzureProviderModel
 from ogion.upload_providers.base_provider import BaseUploadProvider
 
 log = logging.getLogger(__name__)
 
+# azure blob batch limit of subrequests
+DELETE_BATCH_SIZE = 256
+DELETE_BATCH_WORKERS = 4
+# bigger archives are uploaded in staged blocks, like azure sdk default
+MAX_SINGLE_PUT_SIZE = 64 * 1024 * 1024
+
 
 class UploadProviderAzure(BaseUploadProvider):
     """Azure blob storage for storing backups"""
 
     def __init__(self, target_provider: AzureProviderModel) -> None:
         self.container_name = target_provider.container_name
+        self.streaming = target_provider.streaming
+
+        self.max_concurrency = target_provider.max_concurrency
+        self.bandwidth_limiters = core.get_upload_bandwidth_limiters(
+            target_provider.max_bandwidth
+        )
+
+        self.block_size = target_provider.block_size_mb * 1024 * 1024
+        self.upload_sessions = upload_sessions.UploadSessions(
+            config.UploadProviderEnum.AZURE
+        )
 
         blob_service_client = BlobServiceClient.from_connection_string(
-            target_provider.connect_string.get_secret_value()
+            target_provider.connect_string.get_secret_value(),
+            max_block_size=self.block_size,
+            max_single_put_size=MAX_SINGLE_PUT_SIZE,
         )
         self.container_client = blob_service_client.get_container_client(
             container=self.container_name
         )
+        self.location = f"azure://{self.container_name}"
+        self.backup_index = backup_index.BackupIndex(
+            config.UploadProviderEnum.AZURE, self.location
+        )
+
+    def _get_uploaded_md5(self, upload_result: dict[str, Any]) -> str | None:
+        # returned only for blobs uploaded in single request, blocks are
+        # verified one by one with their transactional md5 instead
+        content_md5: bytes | None = upload_result.get("content_md5")
+        if content_md5 is None:
+            return None
+        return bytes(content_md5).hex()
 
     def _post_save(self, backup_file: Path) -> str:
+        if self.streaming:
+            return self._post_save_streaming(backup_file=backup_file)
+
         zip_backup_file = core.run_create_zip_archive(backup_file=backup_file)
+        return self._upload_zip_archive(zip_backup_file)
+
+    def _resume_upload(self, env_name: str) -> str | None:
+        session = self.upload_sessions.pending(env_name)
+        if session is None:
+            return None
+        log.info("resuming interrupted upload of %s", session.zip_file)
+        try:
+            return self._upload_zip_archive(Path(session.zip_file))
+        except Exception:
+            # do not retry it before every next backup
+            self.upload_sessions.drop(env_name)
+            raise
 
+    def _upload_zip_archive(self, zip_backup_file: Path) -> str:
         backup_dest_in_azure_container = (
             f"{zip_backup_file.parent.name}/{zip_backup_file.name}"
         )
@@ -40,8 +91,139 @@ class UploadProviderAzure(BaseUploadProvider):
             "start uploading %s to %s", zip_backup_file, backup_dest_in_azure_container
         )
 
-        with open(file=zip_backup_file, mode="rb") as data:
-            blob_client.upload_blob(data=data)
+        upload_result: dict[str, Any] | None = None
+        with core.upload_slots:
+            if zip_backup_file.stat().st_size > MAX_SINGLE_PUT_SIZE:
+                self._upload_blocks(zip_backup_file, blob_client)
+            else:
+                with (
+                    # blob uploaded in single request is read to memory
+                    core.reserve_upload_memory(zip_backup_file.stat().st_size),
+                    open(file=zip_backup_file, mode="rb") as data,
+                ):
+                    upload_result = blob_client.upload_blob(
+                        data=core.ThrottledReader(  # type: ignore[arg-type]
+                            data, self.bandwidth_limiters
+                        ),
+                        length=zip_backup_file.stat().st_size,
+                        max_concurrency=self.max_concurrency,
+                    )
+
+        expected_md5 = core.pop_zip_archive_md5(zip_backup_file)
+        if expected_md5 is not None and upload_result is None:
+            log.info("md5 of every uploaded block of %s was verified", zip_backup_file)
+        elif expected_md5 is not None and upload_result is not None:
+            try:
+                core.verify_zip_archive_md5(
+                    zip_backup_file,
+                    expected_md5,
+                    self._get_uploaded_md5(upload_result),
+                )
+            except core.ZipArchiveIntegrityError:
+                log.error(
+                    "removing corrupted %s from azure blob storage",
+                    backup_dest_in_azure_container,
+                )
+                blob_client.delete_blob()
+                raise
+
+        log.info(
+            "uploaded %s to %s in %s",
+            zip_backup_file,
+            backup_dest_in_azure_container,
+            self.container_name,
+        )
+        self.backup_index.add(
+            zip_backup_file.parent.name,
+            backup_dest_in_azure_container,
+            zip_backup_file.stat().st_size,
+            expected_md5,
+        )
+        metrics.record_compressed_bytes(zip_backup_file.stat().st_size)
+        return backup_dest_in_azure_container
+
+    def _upload_blocks(self, zip_backup_file: Path, blob_client: BlobClient) -> None:
+        """Staged blocks upload that can be resumed after restart from its session.
+
+        Uncommitted blocks are kept by azure for a week, block ids are
+        derived from part numbers, so staged ones are found after restart.
+        With checksum integrity check, azure rejects blocks not matching their md5.
+        """
+        session = self.upload_sessions.find(
+            zip_backup_file, blob_client.blob_name, self.block_size
+        )
+        staged: set[int] = set()
+        if session is not None:
+            _, uncommitted = blob_client.get_block_list("uncommitted")
+            staged = {int(block.id) for block in uncommitted if block.id.isdigit()}
+        else:
+            session = self.upload_sessions.start(
+                zip_backup_file, blob_client.blob_name, self.block_size, ""
+            )
+
+        def stage_block(part_number: int, data: bytes) -> None:
+            blob_client.stage_block(
+                block_id=f"{part_number:08d}",
+                data=data,
+                length=len(data),
+                validate_content=core.use_checksum_integrity_check(),
+            )
+
+        upload_sessions.upload_parts(
+            session,
+            staged,
+            stage_block,
+            self.max_concurrency,
+            self.bandwidth_limiters,
+        )
+        blob_client.commit_block_list(
+            [
+                BlobBlock(block_id=f"{part_number:08d}")
+                for part_number in range(1, session.parts_count() + 1)
+            ]
+        )
+        self.upload_sessions.remove(zip_backup_file.parent.name)
+
+    def _post_save_streaming(self, backup_file: Path) -> str:
+        zip_backup_file = core.get_zip_archive_path(backup_file)
+
+        backup_dest_in_azure_container = (
+            f"{zip_backup_file.parent.name}/{zip_backup_file.name}"
+        )
+        blob_client = self.container_client.get_blob_client(
+            blob=backup_dest_in_azure_container
+        )
+
+        log.info(
+            "start streaming %s to %s", zip_backup_file, backup_dest_in_azure_container
+        )
+
+        try:
+            with (
+                core.upload_slots,
+                # azure client buffers blocks of stream read by its upload threads
+                core.reserve_upload_memory(self.block_size * self.max_concurrency),
+                core.open_zip_archive_stream(backup_file) as archive_stream,
+            ):
+                # stream of unknown size is always uploaded in blocks
+                blob_client.upload_blob(
+                    data=core.ThrottledReader(  # type: ignore[arg-type]
+                        archive_stream, self.bandwidth_limiters
+                    ),
+                    max_concurrency=self.max_concurrency,
+                    validate_content=core.use_checksum_integrity_check(),
+                )
+            if core.use_checksum_integrity_check():
+                log.info(
+                    "md5 of every uploaded block of %s was verified", zip_backup_file
+                )
+        except (core.CoreSubprocessError, core.ZipArchiveIntegrityError):
+            log.error(
+                "removing incomplete %s from azure blob storage",
+                backup_dest_in_azure_container,
+            )
+            blob_client.delete_blob()
+            raise
 
         log.info(
             "uploaded %s to %s in %s",
@@ -49,8 +231,21 @@ class UploadProviderAzure(BaseUploadProvider):
             backup_dest_in_azure_container,
             self.container_name,
         )
+        self.backup_index.add(
+            zip_backup_file.parent.name,
+            backup_dest_in_azure_container,
+            archive_stream.tell(),
+            archive_stream.md5(),
+        )
+        metrics.record_compressed_bytes(archive_stream.tell())
         return backup_dest_in_azure_container
 
+    def _list_backups(self, prefix: str) -> list[str]:
+        return [
+            blob.name
+            for blob in self.container_client.list_blobs(name_starts_with=prefix)
+        ]
+
     def _clean(
         self, backup_file: Path, max_backups: int, min_retention_days: int
     ) -> None:
@@ -58,14 +253,15 @@ class UploadProviderAzure(BaseUploadProvider):
             core.remove_path(backup_path)
             log.info("removed %s from local disk", backup_path)
 
-        backup_list_cloud: list[str] = []
-        for blob in self.container_client.list_blobs(
-            name_starts_with=backup_file.parent.name
-        ):
-            backup_list_cloud.append(blob.name)
+        env_name = backup_file.parent.name
+        backup_list_cloud = self.backup_index.backup_keys(
+            env_name, partial(self._list_backups, env_name)
+        )
+        backups_count = len(backup_list_cloud)
 
         # remove oldest
         backup_list_cloud.sort(reverse=True)
+        items_to_delete: list[str] = []
 
         while len(backup_list_cloud) > max_backups:
             backup_to_remove = backup_list_cloud.pop()
@@ -81,5 +277,52 @@ class UploadProviderAzure(BaseUploadProvider):
                 )
                 break
 
-            self.container_client.delete_blob(blob=backup_to_remove)
-            log.info("deleted backup %s from azure blob storage", backup_to_remove)
+            items_to_delete.append(backup_to_remove)
+            log.info(
+                "backup %s will be deleted from azure blob storage", backup_to_remove
+            )
+
+        failed: list[str] = []
+        if items_to_delete:
+            failed = self._delete_blobs(items_to_delete)
+            self.backup_index.remove(
+                env_name, [name for name in items_to_delete if name not in failed]
+            )
+        metrics.record_cleanup(backups_count, len(items_to_delete) - len(failed))
+        if failed:
+            raise RuntimeError(
+                f"Fail to delete backups from azure blob storage: {failed}"
+            )
+
+    def _delete_blob_batch(self, blob_names: list[str]) -> list[str]:
+        responses = self.container_client.delete_blobs(
+            *blob_names, raise_on_any_failure=False
+        )
+        # blob that is already gone does not need to be deleted again
+        return [
+            blob_name
+            for blob_name, response in zip(blob_names, responses, strict=True)
+            if response.status_code not in (HTTPStatus.ACCEPTED, HTTPStatus.NOT_FOUND)
+        ]
+
+    def _delete_blobs(self, blob_names: list[str]) -> list[str]:
+        """Delete blobs in batch requests, up to 4 batches at once."""
+        batches = [
+            blob_names[start : start + DELETE_BATCH_SIZE]
+            for start in range(0, len(blob_names), DELETE_BATCH_SIZE)
+        ]
+        failed = [
+            blob_name
+            for batch_failed in core.map_io(
+                self._delete_blob_batch, batches, DELETE_BATCH_WORKERS
+            )
+            for blob_name in batch_failed
+        ]
+
+        log.info(
+            "%s of %s backups were deleted from azure blob storage in %s batches",
+            len(blob_names) - len(failed),
+            len(blob_names),
+            len(batches),
+        )
+        return failed
@@ -12,6 +12,9 @@ log = logging.getLogger(__name__)
 
 
 class BaseUploadProvider(ABC):
+    # where backups are uploaded to, like s3://bucket/path
+    location: str
+
     def __init__(self, target_provider: ProviderModel) -> None:  # pragma: no cover
         pass
 
@@ -23,6 +26,14 @@ class BaseUploadProvider(ABC):
             log.error(err, exc_info=True)
             raise
 
+    @final
+    def resume_upload(self, env_name: str) -> str | None:
+        try:
+            return self._resume_upload(env_name=env_name)
+        except Exception as err:
+            log.error(err, exc_info=True)
+            raise
+
     @final
     def clean(
         self, backup_file: Path, max_backups: int, min_retention_days: int
@@ -46,3 +57,7 @@ class BaseUploadProvider(ABC):
         self, backup_file: Path, max_backups: int, min_retention_days: int
     ) -> None:  # pragma: no cover
         pass
+
+    def _resume_upload(self, env_name: str) -> str | None:
+        """Finish upload of target interrupted by restart, if there is one."""
+        return None
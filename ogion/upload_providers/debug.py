@@ -4,7 +4,7 @@
 import logging
 from pathlib import Path
 
-from ogion import core
+from ogion import config, core, metrics
 from ogion.models.upload_provider_models import DebugProviderModel
 from ogion.upload_providers.base_provider import BaseUploadProvider
 
@@ -18,20 +18,25 @@ class UploadProviderLocalDebug(BaseUploadProvider):
     """
 
     def __init__(self, target_provider: DebugProviderModel) -> None:
-        pass
+        self.location = f"file://{config.CONST_BACKUP_FOLDER_PATH}"
 
     def _post_save(self, backup_file: Path) -> str:
         zip_file = core.run_create_zip_archive(backup_file=backup_file)
+        # nothing is uploaded to compare md5 with
+        core.pop_zip_archive_md5(zip_file)
+        metrics.record_compressed_bytes(zip_file.stat().st_size)
         return str(zip_file)
 
     def _clean(
         self, backup_file: Path, max_backups: int, min_retention_days: int
     ) -> None:
-        core.remove_path(backup_file)
+        if core.get_zip_archive_path(backup_file) != backup_file:
+            core.remove_path(backup_file)
         files: list[str] = []
         for backup_path in backup_file.parent.iterdir():
             files.append(str(backup_path.absolute()))
         files.sort(reverse=True)
+        backups_count = len(files)
         while len(files) > max_backups:
             backup_to_remove = Path(files.pop())
             if core.file_before_retention_period_ends(
@@ -51,3 +56,4 @@ class UploadProviderLocalDebug(BaseUploadProvider):
                 log.error(
                     "could not remove path %s: %s", backup_to_remove, e, exc_info=True
                 )
+        metrics.record_cleanup(backups_count, backups_count - len(files))
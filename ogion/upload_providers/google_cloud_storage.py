@@ -4,16 +4,29 @@
 import base64
 import logging
 import os
+from functools import partial
+from http import HTTPStatus
 from pathlib import Path
 
 import google.cloud.storage as cloud_storage
+import google_crc32c
+import requests
+from google.api_core import exceptions
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.retry import DEFAULT_RETRY
 
-from ogion import config, core
+from ogion import backup_index, config, core, metrics, upload_sessions
 from ogion.models.upload_provider_models import GCSProviderModel
 from ogion.upload_providers.base_provider import BaseUploadProvider
 
 log = logging.getLogger(__name__)
 
+# google cloud storage limit of requests in one batch
+DELETE_BATCH_SIZE = 100
+CRC32C_READ_SIZE = 1024 * 1024
+# retries chunks of resumable upload on connection errors, 429 and 5xx responses
+UPLOAD_CHUNK_RETRY = DEFAULT_RETRY
+
 
 class UploadProviderGCS(BaseUploadProvider):
     """GCS bucket for storing backups"""
@@ -32,29 +45,325 @@ class UploadProviderGCS(BaseUploadProvider):
         self.bucket_upload_path = target_provider.bucket_upload_path
         self.chunk_size_bytes = target_provider.chunk_size_mb * 1024 * 1024
         self.chunk_timeout_secs = target_provider.chunk_timeout_secs
+        self.max_concurrency = target_provider.max_concurrency
+        self.bandwidth_limiters = core.get_upload_bandwidth_limiters(
+            target_provider.max_bandwidth
+        )
+        self.streaming = target_provider.streaming
+        self.upload_sessions = upload_sessions.UploadSessions(
+            config.UploadProviderEnum.GCS
+        )
+        self.location = f"gs://{target_provider.bucket_name}/{self.bucket_upload_path}"
+        self.backup_index = backup_index.BackupIndex(
+            config.UploadProviderEnum.GCS, self.location
+        )
 
-    def _post_save(self, backup_file: Path) -> str:
-        zip_backup_file = core.run_create_zip_archive(backup_file=backup_file)
-
-        backup_dest_in_bucket = (
+    def _get_backup_dest_in_bucket(self, zip_backup_file: Path) -> str:
+        return (
             f"{self.bucket_upload_path}/"
             f"{zip_backup_file.parent.name}/"
             f"{zip_backup_file.name}"
         )
 
+    def _get_uploaded_md5(self, blob: cloud_storage.Blob) -> str | None:
+        if blob.md5_hash is None:
+            return None
+        return base64.b64decode(blob.md5_hash).hex()
+
+    def _post_save(self, backup_file: Path) -> str:
+        if self.streaming:
+            return self._post_save_streaming(backup_file=backup_file)
+
+        zip_backup_file = core.run_create_zip_archive(backup_file=backup_file)
+        return self._upload_zip_archive(zip_backup_file)
+
+    def _resume_upload(self, env_name: str) -> str | None:
+        session = self.upload_sessions.pending(env_name)
+        if session is None:
+            return None
+        log.info("resuming interrupted upload of %s", session.zip_file)
+        try:
+            return self._upload_zip_archive(Path(session.zip_file))
+        except Exception:
+            # do not retry it before every next backup
+            self.upload_sessions.drop(env_name)
+            raise
+
+    def _upload_zip_archive(self, zip_backup_file: Path) -> str:
+        backup_dest_in_bucket = self._get_backup_dest_in_bucket(zip_backup_file)
+
         log.info("start uploading %s to %s", zip_backup_file, backup_dest_in_bucket)
 
         blob = self.bucket.blob(backup_dest_in_bucket, chunk_size=self.chunk_size_bytes)
-        blob.upload_from_filename(
-            zip_backup_file,
+        with core.upload_slots:
+            if self.max_concurrency > 1:
+                # xml api multipart upload, parts are read from file by threads
+                with core.reserve_upload_memory(
+                    self.chunk_size_bytes * self.max_concurrency
+                ):
+                    transfer_manager.upload_chunks_concurrently(
+                        str(zip_backup_file),
+                        blob,
+                        chunk_size=self.chunk_size_bytes,
+                        worker_type=transfer_manager.THREAD,
+                        max_workers=self.max_concurrency,
+                        timeout=self.chunk_timeout_secs,
+                    )
+                # checksums of uploaded object are needed for integrity check
+                blob.reload()
+            elif zip_backup_file.stat().st_size > self.chunk_size_bytes:
+                self._upload_resumable(zip_backup_file, blob)
+            elif self.bandwidth_limiters:
+                with open(zip_backup_file, "rb") as zip_file:
+                    blob.upload_from_file(
+                        core.ThrottledReader(zip_file, self.bandwidth_limiters),
+                        size=zip_backup_file.stat().st_size,
+                        timeout=self.chunk_timeout_secs,
+                        if_generation_match=0,
+                        checksum="crc32c",
+                    )
+            else:
+                blob.upload_from_filename(
+                    zip_backup_file,
+                    timeout=self.chunk_timeout_secs,
+                    if_generation_match=0,
+                    checksum="crc32c",
+                )
+
+        expected_md5 = core.pop_zip_archive_md5(zip_backup_file)
+        if expected_md5 is not None:
+            try:
+                self._verify_uploaded_checksum(zip_backup_file, expected_md5, blob)
+            except core.ZipArchiveIntegrityError:
+                log.error(
+                    "removing corrupted %s from google cloud storage",
+                    backup_dest_in_bucket,
+                )
+                blob.delete()
+                raise
+
+        log.info("uploaded %s to %s", zip_backup_file, backup_dest_in_bucket)
+        self.backup_index.add(
+            zip_backup_file.parent.name,
+            backup_dest_in_bucket,
+            zip_backup_file.stat().st_size,
+            expected_md5,
+        )
+        metrics.record_compressed_bytes(zip_backup_file.stat().st_size)
+        return backup_dest_in_bucket
+
+    def _verify_uploaded_checksum(
+        self, zip_backup_file: Path, expected_md5: str, blob: cloud_storage.Blob
+    ) -> None:
+        uploaded_md5 = self._get_uploaded_md5(blob)
+        if uploaded_md5 is not None:
+            core.verify_zip_archive_md5(zip_backup_file, expected_md5, uploaded_md5)
+            return
+        # objects uploaded with xml multipart upload have crc32c, but no md5
+        if blob.crc32c is None:
+            raise core.ZipArchiveIntegrityError(
+                f"google cloud storage returned neither md5 nor crc32c "
+                f"of uploaded {blob.name}"
+            )
+        checksum = google_crc32c.Checksum()
+        self._update_crc32c(
+            checksum, zip_backup_file, 0, zip_backup_file.stat().st_size
+        )
+        crc32c = base64.b64encode(checksum.digest()).decode()
+        if crc32c != blob.crc32c:
+            raise core.ZipArchiveIntegrityError(
+                f"zip archive {zip_backup_file} crc32c {crc32c} does not match "
+                f"crc32c {blob.crc32c} of uploaded file"
+            )
+        log.info("zip archive %s crc32c matches uploaded file", zip_backup_file)
+
+    def _update_crc32c(
+        self,
+        checksum: google_crc32c.Checksum,
+        zip_backup_file: Path,
+        start: int,
+        end: int,
+    ) -> None:
+        with open(zip_backup_file, "rb") as zip_file:
+            zip_file.seek(start)
+            while start < end:
+                chunk = zip_file.read(min(CRC32C_READ_SIZE, end - start))
+                checksum.update(chunk)
+                start += len(chunk)
+
+    def _get_session_offset(self, response: requests.Response, size: int) -> int:
+        """Number of bytes persisted by gcs in resumable upload session."""
+        if response.status_code in (HTTPStatus.OK, HTTPStatus.CREATED):
+            return size
+        if response.status_code != HTTPStatus.PERMANENT_REDIRECT:
+            if response.status_code >= HTTPStatus.BAD_REQUEST:
+                raise exceptions.from_http_response(response)
+            raise RuntimeError(
+                f"Unexpected resumable upload response: {response.status_code}"
+            )
+        # for example "bytes=0-1048575", missing when nothing is persisted yet
+        persisted_range = response.headers.get("Range")
+        if persisted_range is None:
+            return 0
+        return int(persisted_range.rsplit("-", 1)[1]) + 1
+
+    def _query_session(
+        self, session: upload_sessions.UploadSession
+    ) -> requests.Response:
+        return requests.put(
+            session.session_id,
+            headers={"Content-Range": f"bytes */{session.size}"},
             timeout=self.chunk_timeout_secs,
-            if_generation_match=0,
-            checksum="crc32c",
         )
 
+    def _upload_chunk(
+        self,
+        session: upload_sessions.UploadSession,
+        offset: int,
+        checksum: google_crc32c.Checksum,
+    ) -> int:
+        """Send chunk from offset and add bytes persisted by gcs to checksum."""
+        size = session.size
+        with core.reserve_upload_memory(self.chunk_size_bytes):
+            data = upload_sessions.read_part(
+                Path(session.zip_file),
+                offset,
+                self.chunk_size_bytes,
+                self.bandwidth_limiters,
+            )
+            headers = {
+                "Content-Range": f"bytes {offset}-{offset + len(data) - 1}/{size}"
+            }
+            if offset + len(data) == size:
+                # gcs rejects last chunk when crc32c of whole object does not match
+                object_checksum = checksum.copy()
+                object_checksum.update(data)
+                crc32c = base64.b64encode(object_checksum.digest()).decode()
+                headers["X-Goog-Hash"] = f"crc32c={crc32c}"
+            response = requests.put(
+                session.session_id,
+                data=data,
+                headers=headers,
+                timeout=self.chunk_timeout_secs,
+            )
+            persisted = self._get_session_offset(response, size)
+            checksum.update(data[: persisted - offset])
+        return persisted
+
+    def _upload_resumable(
+        self, zip_backup_file: Path, blob: cloud_storage.Blob
+    ) -> None:
+        """Resumable upload that can be continued after restart from its session."""
+        size = zip_backup_file.stat().st_size
+        session = self.upload_sessions.find(
+            zip_backup_file, blob.name, self.chunk_size_bytes
+        )
+        offset = 0
+        if session is not None:
+            response = self._query_session(session)
+            if response.status_code in (HTTPStatus.NOT_FOUND, HTTPStatus.GONE):
+                log.warning(
+                    "upload session of %s expired, starting again", zip_backup_file
+                )
+                session = None
+            else:
+                offset = self._get_session_offset(response, size)
+                log.info(
+                    "resuming upload of %s from byte %s of %s",
+                    zip_backup_file,
+                    offset,
+                    size,
+                )
+        if session is None:
+            session_url = blob.create_resumable_upload_session(
+                size=size,
+                timeout=self.chunk_timeout_secs,
+                if_generation_match=0,
+            )
+            session = self.upload_sessions.start(
+                zip_backup_file, blob.name, self.chunk_size_bytes, session_url
+            )
+
+        checksum = google_crc32c.Checksum()
+        # part persisted before restart counts to crc32c of whole object too
+        self._update_crc32c(checksum, zip_backup_file, 0, offset)
+        retrying = False
+
+        def upload_next_chunk() -> None:
+            nonlocal offset, retrying
+            if retrying:
+                # part of failed chunk might have been persisted by gcs
+                persisted = self._get_session_offset(self._query_session(session), size)
+                self._update_crc32c(checksum, zip_backup_file, offset, persisted)
+                offset = persisted
+                retrying = False
+            if offset < size:
+                offset = self._upload_chunk(session, offset, checksum)
+
+        def on_chunk_error(err: Exception) -> None:
+            nonlocal retrying
+            retrying = True
+            log.warning("retrying chunk upload of %s: %s", zip_backup_file, err)
+
+        upload_next_chunk_with_retry = UPLOAD_CHUNK_RETRY(
+            upload_next_chunk, on_error=on_chunk_error
+        )
+        while offset < size:
+            upload_next_chunk_with_retry()
+
+        self.upload_sessions.remove(zip_backup_file.parent.name)
+        # md5 of uploaded object is needed for checksum integrity check
+        blob.reload()
+
+    def _post_save_streaming(self, backup_file: Path) -> str:
+        zip_backup_file = core.get_zip_archive_path(backup_file)
+        backup_dest_in_bucket = self._get_backup_dest_in_bucket(zip_backup_file)
+
+        log.info("start streaming %s to %s", zip_backup_file, backup_dest_in_bucket)
+
+        # chunk_size makes it resumable upload, sent chunk by chunk from stream
+        blob = self.bucket.blob(backup_dest_in_bucket, chunk_size=self.chunk_size_bytes)
+        try:
+            with (
+                core.upload_slots,
+                # google client buffers one chunk of stream
+                core.reserve_upload_memory(self.chunk_size_bytes),
+                core.open_zip_archive_stream(backup_file) as archive_stream,
+            ):
+                blob.upload_from_file(
+                    core.ThrottledReader(archive_stream, self.bandwidth_limiters),
+                    timeout=self.chunk_timeout_secs,
+                    if_generation_match=0,
+                    checksum="crc32c",
+                )
+            if core.use_checksum_integrity_check():
+                core.verify_zip_archive_md5(
+                    zip_backup_file, archive_stream.md5(), self._get_uploaded_md5(blob)
+                )
+        except (core.CoreSubprocessError, core.ZipArchiveIntegrityError):
+            log.error(
+                "removing incomplete %s from google cloud storage",
+                backup_dest_in_bucket,
+            )
+            blob.delete()
+            raise
+
         log.info("uploaded %s to %s", zip_backup_file, backup_dest_in_bucket)
+        self.backup_index.add(
+            zip_backup_file.parent.name,
+            backup_dest_in_bucket,
+            archive_stream.tell(),
+            archive_stream.md5(),
+        )
+        metrics.record_compressed_bytes(archive_stream.tell())
         return backup_dest_in_bucket
 
+    def _list_backups(self, prefix: str) -> list[str]:
+        return [
+            blob.name
+            for blob in self.storage_client.list_blobs(self.bucket, prefix=prefix)
+        ]
+
     def _clean(
         self, backup_file: Path, max_backups: int, min_retention_days: int
     ) -> None:
@@ -62,13 +371,17 @@ class UploadProviderGCS(BaseUploadProvider):
             core.remove_path(backup_path)
             log.info("removed %s from local disk", backup_path)
 
-        backup_list_cloud: list[str] = []
-        prefix = f"{self.bucket_upload_path}/{backup_file.parent.name}"
-        for blob in self.storage_client.list_blobs(self.bucket, prefix=prefix):
-            backup_list_cloud.append(blob.name)
+        env_name = backup_file.parent.name
+        prefix = f"{self.bucket_upload_path}/{env_name}"
+        backup_list_cloud = self.backup_index.backup_keys(
+            env_name, partial(self._list_backups, prefix)
+        )
+        backups_count = len(backup_list_cloud)
 
         # remove oldest
         backup_list_cloud.sort(reverse=True)
+        items_to_delete: list[str] = []
+
         while len(backup_list_cloud) > max_backups:
             backup_to_remove = backup_list_cloud.pop()
             file_name = backup_to_remove.split("/")[-1]
@@ -83,6 +396,59 @@ class UploadProviderGCS(BaseUploadProvider):
                 )
                 break
 
-            blob = self.bucket.blob(backup_to_remove)
-            blob.delete()
-            log.info("deleted backup %s from google cloud storage", backup_to_remove)
+            items_to_delete.append(backup_to_remove)
+            log.info(
+                "backup %s will be deleted from google cloud storage", backup_to_remove
+            )
+
+        failed: list[str] = []
+        if items_to_delete:
+            failed = self._delete_blobs(items_to_delete)
+            self.backup_index.remove(
+                env_name, [name for name in items_to_delete if name not in failed]
+            )
+        metrics.record_cleanup(backups_count, len(items_to_delete) - len(failed))
+        if failed:
+            raise RuntimeError(
+                f"Fail to delete backups from google cloud storage: {failed}"
+            )
+
+    def _delete_blob_batch(self, blob_names: list[str]) -> list[str]:
+        batch = self.storage_client.batch(raise_exception=False)
+        # client keeps stack of current batches, so they run one by one
+        with batch:
+            for blob_name in blob_names:
+                self.bucket.delete_blob(blob_name)
+        # delete_blob returns nothing in batch, responses are stored by finish()
+        # in order of requests, one per delete, see test pinning it to client
+        # blob that is already gone does not need to be deleted again
+        return [
+            blob_name
+            for blob_name, response in zip(blob_names, batch._responses, strict=True)
+            if response.status_code not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_FOUND)
+        ]
+
+    def _delete_blobs(self, blob_names: list[str]) -> list[str]:
+        """Delete blobs in batch requests, each with up to 100 deletes."""
+        failed: list[str] = []
+        batches = 0
+        for start in range(0, len(blob_names), DELETE_BATCH_SIZE):
+            batch_blob_names = blob_names[start : start + DELETE_BATCH_SIZE]
+            batches += 1
+            try:
+                failed.extend(self._delete_blob_batch(batch_blob_names))
+            except exceptions.GoogleAPIError as err:
+                log.error(
+                    "fail to delete batch of %s backups from google cloud storage: %s",
+                    len(batch_blob_names),
+                    err,
+                )
+                failed.extend(batch_blob_names)
+
+        log.info(
+            "%s of %s backups were deleted from google cloud storage in %s batches",
+            len(blob_names) - len(failed),
+            len(blob_names),
+            batches,
+        )
+        return failed
@@ -1,20 +1,33 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import importlib
+
 from ogion.config import UploadProviderEnum
-from ogion.upload_providers import (
-    aws_s3,
-    azure,
-    base_provider,
-    debug,
-    google_cloud_storage,
-)
+from ogion.upload_providers import base_provider
+
+# provider modules import heavy cloud SDKs, so only configured one is imported
+PROVIDER_CLS_PATHS: dict[str, tuple[str, str]] = {
+    UploadProviderEnum.AWS_S3: ("ogion.upload_providers.aws_s3", "UploadProviderAWS"),
+    UploadProviderEnum.AZURE: ("ogion.upload_providers.azure", "UploadProviderAzure"),
+    UploadProviderEnum.GCS: (
+        "ogion.upload_providers.google_cloud_storage",
+        "UploadProviderGCS",
+    ),
+    UploadProviderEnum.LOCAL_FILES_DEBUG: (
+        "ogion.upload_providers.debug",
+        "UploadProviderLocalDebug",
+    ),
+}
+
+
+def get_provider_cls(name: str) -> type[base_provider.BaseUploadProvider]:
+    module_name, cls_name = PROVIDER_CLS_PATHS[name]
+    provider_cls: type[base_provider.BaseUploadProvider] = getattr(
+        importlib.import_module(module_name), cls_name
+    )
+    return provider_cls
 
 
 def get_provider_cls_map() -> dict[str, type[base_provider.BaseUploadProvider]]:
-    return {
-        UploadProviderEnum.AWS_S3: aws_s3.UploadProviderAWS,
-        UploadProviderEnum.AZURE: azure.UploadProviderAzure,
-        UploadProviderEnum.GCS: google_cloud_storage.UploadProviderGCS,
-        UploadProviderEnum.LOCAL_FILES_DEBUG: debug.UploadProviderLocalDebug,
-    }
+    return {name: get_provider_cls(name) for name in PROVIDER_CLS_PATHS}
@@ -0,0 +1,185 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import logging
+import math
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TypeVar
+
+from ogion import config, core
+
+log = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+@dataclass
+class UploadSession:
+    zip_file: str
+    key: str
+    size: int
+    mtime_ns: int
+    part_size: int
+    # s3 multipart upload id, gcs resumable session uri, empty for azure blocks
+    session_id: str
+
+    def parts_count(self) -> int:
+        return max(1, math.ceil(self.size / self.part_size))
+
+
+class UploadSessions:
+    """Sessions of unfinished uploads saved in config folder, one per target.
+
+    When process is killed during upload, next backup of the target resumes
+    the upload of archive left on disk from the last part acknowledged by
+    provider instead of starting from scratch.
+    """
+
+    def __init__(
+        self,
+        provider_name: str,
+        abort: Callable[[UploadSession], None] | None = None,
+    ) -> None:
+        self.provider_name = provider_name
+        # cancels upload in provider, so its uploaded parts are not kept there
+        self.abort = abort
+
+    def path(self, env_name: str) -> Path:
+        return (
+            config.CONST_CONFIG_FOLDER_PATH
+            / f"{env_name}.{self.provider_name}.upload.json"
+        )
+
+    def _read(self, env_name: str) -> UploadSession:
+        return UploadSession(**json.loads(self.path(env_name).read_text()))
+
+    def pending(self, env_name: str) -> UploadSession | None:
+        """Session of interrupted upload whose archive is unchanged on disk."""
+        path = self.path(env_name)
+        try:
+            session = self._read(env_name)
+        except FileNotFoundError:
+            return None
+        except (ValueError, TypeError) as err:
+            log.warning("ignoring invalid upload session %s: %s", path, err)
+            self.remove(env_name)
+            return None
+
+        zip_file = Path(session.zip_file)
+        try:
+            stat = zip_file.stat()
+        except FileNotFoundError:
+            stat = None
+        if stat is None or (stat.st_size, stat.st_mtime_ns) != (
+            session.size,
+            session.mtime_ns,
+        ):
+            log.warning(
+                "archive %s of interrupted upload is missing or changed, "
+                "dropping its upload session",
+                zip_file,
+            )
+            self.drop(env_name)
+            return None
+        return session
+
+    def find(self, zip_file: Path, key: str, part_size: int) -> UploadSession | None:
+        session = self.pending(zip_file.parent.name)
+        if session is None:
+            return None
+        if (
+            session.zip_file != str(zip_file)
+            or session.key != key
+            or session.part_size != part_size
+        ):
+            # new session replaces it, so it could not be resumed anymore
+            self.drop(zip_file.parent.name)
+            return None
+        return session
+
+    def start(
+        self, zip_file: Path, key: str, part_size: int, session_id: str
+    ) -> UploadSession:
+        stat = zip_file.stat()
+        session = UploadSession(
+            zip_file=str(zip_file),
+            key=key,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            part_size=part_size,
+            session_id=session_id,
+        )
+        path = self.path(zip_file.parent.name)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(asdict(session)))
+        tmp_path.replace(path)
+        return session
+
+    def remove(self, env_name: str) -> None:
+        self.path(env_name).unlink(missing_ok=True)
+
+    def drop(self, env_name: str) -> None:
+        """Abort upload that will not be resumed and remove its session."""
+        try:
+            session = self._read(env_name)
+        except (OSError, ValueError, TypeError):
+            session = None
+        if session is not None and self.abort is not None:
+            try:
+                self.abort(session)
+            except Exception as err:
+                log.warning("cannot abort upload of %s: %s", session.zip_file, err)
+        self.remove(env_name)
+
+
+def read_part(
+    zip_file: Path, offset: int, size: int, limiters: list[core.BandwidthLimiter]
+) -> bytes:
+    with open(zip_file, "rb") as file:
+        file.seek(offset)
+        data = file.read(size)
+    for limiter in limiters:
+        limiter.consume(len(data))
+    return data
+
+
+def upload_parts(
+    session: UploadSession,
+    uploaded: set[int],
+    upload_part: Callable[[int, bytes], _T],
+    max_workers: int,
+    limiters: list[core.BandwidthLimiter],
+) -> dict[int, _T]:
+    """Upload parts of archive that are not already `uploaded`, in parallel.
+
+    Parts are numbered from 1 like s3 multipart upload parts.
+    """
+    parts_count = session.parts_count()
+    missing = [
+        part_number
+        for part_number in range(1, parts_count + 1)
+        if part_number not in uploaded
+    ]
+    if uploaded:
+        log.info(
+            "resuming upload of %s, %s of %s parts are already uploaded",
+            session.zip_file,
+            parts_count - len(missing),
+            parts_count,
+        )
+
+    def upload(part_number: int) -> _T:
+        with core.reserve_upload_memory(session.part_size):
+            data = read_part(
+                Path(session.zip_file),
+                (part_number - 1) * session.part_size,
+                session.part_size,
+                limiters,
+            )
+            return upload_part(part_number, data)
+
+    results = core.map_io(upload, missing, max_workers)
+    return dict(zip(missing, results, strict=True))
@@ -0,0 +1,91 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import time
+from unittest.mock import Mock, call
+
+import pytest
+
+from ogion import backup_index, config
+
+
+@pytest.fixture
+def index() -> backup_index.BackupIndex:
+    return backup_index.BackupIndex("aws", "s3://bucket/path")
+
+
+def test_backup_index_path(index: backup_index.BackupIndex) -> None:
+    assert index.path("env") == config.CONST_CONFIG_FOLDER_PATH / "env.aws.index.json"
+
+
+def test_backup_index_lists_backups_only_to_reconcile(
+    index: backup_index.BackupIndex,
+) -> None:
+    list_backups = Mock(return_value=["env/a", "env/b"])
+    assert index.backup_keys("env", list_backups) == ["env/a", "env/b"]
+    assert index.backup_keys("env", list_backups) == ["env/a", "env/b"]
+    list_backups.assert_called_once_with()
+
+
+def test_backup_index_add_and_remove(index: backup_index.BackupIndex) -> None:
+    # without index created from listing, there is nothing to update
+    index.add("env", "env/a", 1, None)
+    index.remove("env", ["env/a"])
+    assert not index.path("env").exists()
+
+    index.backup_keys("env", Mock(return_value=["env/a"]))
+    index.add("env", "env/b", 1, "md5")
+    index.remove("env", ["env/a", "env/unknown"])
+
+    list_backups = Mock()
+    assert index.backup_keys("env", list_backups) == ["env/b"]
+    list_backups.assert_not_called()
+    backups = json.loads(index.path("env").read_text())["backups"]
+    assert backups["env/b"]["md5"] == "md5"
+
+
+def test_backup_index_reconciles_after_reconcile_hours(
+    index: backup_index.BackupIndex, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    index.backup_keys("env", Mock(return_value=["env/a", "env/b"]))
+    index.add("env", "env/c", 1, "md5")
+
+    now = time.time() + config.options.BACKUP_INDEX_RECONCILE_HOURS * 3600
+    monkeypatch.setattr("time.time", Mock(return_value=now))
+    assert index.backup_keys("env", Mock(return_value=["env/b", "env/c"])) == [
+        "env/b",
+        "env/c",
+    ]
+    # metadata of backups that still exist is kept
+    backups = json.loads(index.path("env").read_text())["backups"]
+    assert backups["env/c"]["md5"] == "md5"
+
+
+def test_backup_index_reconcile_hours_zero_lists_every_time(
+    index: backup_index.BackupIndex, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "BACKUP_INDEX_RECONCILE_HOURS", 0)
+    list_backups = Mock(return_value=["env/a"])
+    index.backup_keys("env", list_backups)
+    index.backup_keys("env", list_backups)
+    assert list_backups.call_args_list == [call(), call()]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "not json",
+        "[]",
+        '{"location": "s3://other/path", "reconciled_at": 0, "backups": {}}',
+        '{"location": "s3://bucket/path", "backups": []}',
+    ],
+)
+def test_backup_index_reconciles_invalid_or_outdated_index(
+    index: backup_index.BackupIndex, content: str
+) -> None:
+    index.path("env").write_text(content)
+    list_backups = Mock(return_value=["env/a"])
+    assert index.backup_keys("env", list_backups) == ["env/a"]
+    list_backups.assert_called_once_with()
+    assert json.loads(index.path("env").read_text())["location"] == index.location
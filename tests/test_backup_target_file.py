@@ -2,9 +2,13 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 
+import shlex
+import tarfile
+from pathlib import Path
+
 from freezegun import freeze_time
 
-from ogion import config
+from ogion import config, core
 from ogion.backup_targets.file import File
 
 from .conftest import CONST_TOKEN_URLSAFE, FILE_1
@@ -29,3 +33,43 @@ def test_run_file_backup_output_file_has_exact_same_content() -> None:
     out_backup = file.make_backup()
 
     assert out_backup.read_text() == FILE_1.abs_path.read_text()
+
+
+def test_run_file_backup_is_unchanged_since_last_backup(tmp_path: Path) -> None:
+    abs_path = tmp_path / "file.txt"
+    abs_path.write_text("abc")
+    target_model = FILE_1.model_copy(
+        update={"abs_path": abs_path, "skip_unchanged": True}
+    )
+    file = File(target_model=target_model)
+
+    assert not file.is_unchanged_since_last_backup("s3://bucket")
+    file.mark_backup_uploaded()
+    assert file.is_unchanged_since_last_backup("s3://bucket")
+    abs_path.write_text("abcd")
+    assert not file.is_unchanged_since_last_backup("s3://bucket")
+
+
+def test_run_file_backup_is_never_unchanged_without_skip_unchanged() -> None:
+    file = File(target_model=FILE_1)
+
+    assert not file.is_unchanged_since_last_backup("s3://bucket")
+    file.mark_backup_uploaded()
+    assert not file.is_unchanged_since_last_backup("s3://bucket")
+    assert not file.fingerprint_cache.path.exists()
+
+
+def test_run_file_backup_streaming_creates_zip_archive_of_tar(tmp_path: Path) -> None:
+    abs_path = tmp_path / "file.txt"
+    abs_path.write_text("abc")
+    target_model = FILE_1.model_copy(update={"abs_path": abs_path, "streaming": True})
+    file = File(target_model=target_model)
+    out_backup = file.make_backup()
+
+    assert out_backup.name.endswith(".tar.zip")
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(f"unzip -P {passwd} -d {tmp_path / 'out'} {out_backup}")
+    with tarfile.open(tmp_path / "out" / out_backup.with_suffix("").name) as tar:
+        assert tar.getnames() == ["file.txt"]
+        tar_file = tar.extractfile("file.txt")
+        assert tar_file is not None and tar_file.read() == b"abc"
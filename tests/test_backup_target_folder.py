@@ -2,9 +2,13 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 
+import shlex
+import tarfile
+from pathlib import Path
+
 from freezegun import freeze_time
 
-from ogion import config
+from ogion import config, core
 from ogion.backup_targets.folder import Folder
 
 from .conftest import CONST_TOKEN_URLSAFE, FOLDER_1
@@ -32,3 +36,62 @@ def test_run_folder_backup_output_file_in_folder_has_exact_same_content() -> Non
     file_in_out_folder = out_backup / "file.txt"
 
     assert file_in_folder.read_text() == file_in_out_folder.read_text()
+
+
+def test_run_folder_backup_is_unchanged_since_last_backup(tmp_path: Path) -> None:
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.txt").write_text("abc")
+    target_model = FOLDER_1.model_copy(
+        update={"abs_path": source, "skip_unchanged": True}
+    )
+    folder = Folder(target_model=target_model)
+
+    assert not folder.is_unchanged_since_last_backup("s3://bucket")
+    folder.mark_backup_uploaded()
+    assert folder.is_unchanged_since_last_backup("s3://bucket")
+    (source / "other.txt").write_text("abc")
+    assert not folder.is_unchanged_since_last_backup("s3://bucket")
+
+
+@freeze_time("2024-03-14")
+def test_run_folder_backup_incremental(tmp_path: Path) -> None:
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.txt").write_text("abc")
+    target_model = FOLDER_1.model_copy(
+        update={"abs_path": source, "incremental": True, "full_backup_every": 2}
+    )
+    folder = Folder(target_model=target_model)
+
+    full_backup = folder.make_backup()
+    assert full_backup.name == f"{folder.env_name}_20240314_0000_source_full_mock"
+    assert full_backup.is_symlink()
+    folder.mark_backup_uploaded()
+    core.remove_path(full_backup)
+
+    (source / "new.txt").write_text("abc")
+    diff_backup = folder.make_backup()
+    assert diff_backup.name == f"{folder.env_name}_20240314_0000_source_diff_mock"
+    assert (diff_backup / "new.txt").is_symlink()
+    assert not (diff_backup / "file.txt").exists()
+    folder.mark_backup_uploaded()
+
+    assert folder.make_backup() == full_backup
+
+
+def test_run_folder_backup_streaming_creates_zip_archive_of_tar(tmp_path: Path) -> None:
+    abs_path = tmp_path / "source"
+    abs_path.mkdir()
+    (abs_path / "file.txt").write_text("abc")
+    target_model = FOLDER_1.model_copy(update={"abs_path": abs_path, "streaming": True})
+    folder = Folder(target_model=target_model)
+    out_backup = folder.make_backup()
+
+    assert out_backup.name.endswith(".tar.zip")
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(f"unzip -P {passwd} -d {tmp_path / 'out'} {out_backup}")
+    with tarfile.open(tmp_path / "out" / out_backup.with_suffix("").name) as tar:
+        assert tar.getnames() == ["source", "source/file.txt"]
+        tar_file = tar.extractfile("source/file.txt")
+        assert tar_file is not None and tar_file.read() == b"abc"
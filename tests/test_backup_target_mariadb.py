@@ -2,13 +2,18 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 
+import json
 import shlex
+import subprocess
+import time
+from unittest.mock import MagicMock, Mock
 
 import pytest
 from freezegun import freeze_time
 from pydantic import SecretStr
 
-from ogion import config, core
+from ogion import config, core, db_probes
+from ogion.backup_targets import mariadb
 from ogion.backup_targets.mariadb import MariaDB
 from ogion.models.backup_target_models import MariaDBTargetModel
 
@@ -49,9 +54,31 @@ def test_run_mariadb_dump(mariadb_target: MariaDBTargetModel) -> None:
     assert out_backup == out_path
 
 
+@freeze_time("2022-12-11")
 @pytest.mark.parametrize("mariadb_target", ALL_MARIADB_DBS_TARGETS)
-def test_end_to_end_successful_restore_after_backup(
+def test_run_mariadb_dump_streaming_to_zip_archive(
     mariadb_target: MariaDBTargetModel,
+) -> None:
+    target_model = mariadb_target.model_copy(update={"streaming": True})
+    db = MariaDB(target_model=target_model)
+    out_backup = db.make_backup()
+
+    escaped_name = "database_12"
+    escaped_version = db.db_version.replace(".", "")
+    out_file = (
+        f"{db.env_name}/"
+        f"{db.env_name}_20221211_0000_{escaped_name}_{escaped_version}_{CONST_TOKEN_URLSAFE}.sql.zip"
+    )
+    out_path = config.CONST_BACKUP_FOLDER_PATH / out_file
+    assert out_backup == out_path
+    assert out_backup.exists()
+    assert not out_backup.with_suffix("").exists()
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+@pytest.mark.parametrize("mariadb_target", ALL_MARIADB_DBS_TARGETS)
+def test_end_to_end_successful_restore_after_backup(
+    mariadb_target: MariaDBTargetModel, jobs: int
 ) -> None:
     root_target_model = mariadb_target.model_copy(
         update={
@@ -70,7 +97,9 @@ def test_end_to_end_successful_restore_after_backup(
         "'CREATE DATABASE test_db;'",
     )
 
-    test_db_target = root_target_model.model_copy(update={"db": "test_db"})
+    test_db_target = root_target_model.model_copy(
+        update={"db": "test_db", "jobs": jobs, "inconsistent_parallel_jobs": True}
+    )
     test_db = MariaDB(target_model=test_db_target)
 
     table_query = (
@@ -105,10 +134,19 @@ def test_end_to_end_successful_restore_after_backup(
         "'CREATE DATABASE test_db;'",
     )
 
-    core.run_subprocess(
-        f"mariadb --defaults-file={test_db.option_file} {test_db.db_name}"
-        f" < {test_db_backup}",
-    )
+    restore_files = [test_db_backup]
+    if jobs > 1:
+        manifest = json.loads((test_db_backup / mariadb.MANIFEST_NAME).read_text())
+        restore_files = [
+            test_db_backup / manifest["schema"],
+            *(test_db_backup / file for file in manifest["tables"].values()),
+            test_db_backup / manifest["triggers"],
+        ]
+    for restore_file in restore_files:
+        core.run_subprocess(
+            f"mariadb --defaults-file={test_db.option_file} {test_db.db_name}"
+            f" < {restore_file}",
+        )
 
     result = core.run_subprocess(
         f"mariadb --defaults-file={test_db.option_file} {test_db.db_name}"
@@ -116,3 +154,54 @@ def test_end_to_end_successful_restore_after_backup(
     )
 
     assert result == ("id\tname\tage\n" "1\tGeralt z Rivii\t60\n" "2\trafsaf\t24\n")
+
+
+@pytest.mark.parametrize("mariadb_target", ALL_MARIADB_DBS_TARGETS[:1])
+def test_mariadb_probe_checks_version_in_process_before_backup(
+    mariadb_target: MariaDBTargetModel, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    pymysql = Mock()
+    cursor = MagicMock()
+    cursor.fetchone.side_effect = [("11.3.2-MariaDB",), ("11.3.3-MariaDB",)]
+    pymysql.connect.return_value.cursor.return_value = cursor
+    cursor.__enter__.return_value = cursor
+    monkeypatch.setattr(db_probes, "pymysql", pymysql)
+
+    db = MariaDB(target_model=mariadb_target)
+    assert db.db_version == "11.3.2"
+    db.make_backup()
+    assert db.db_version == "11.3.3"
+    pymysql.connect.assert_called_once()
+
+
+@pytest.mark.parametrize("mariadb_target", ALL_MARIADB_DBS_TARGETS[:1])
+def test_mariadb_parallel_backup_cancels_tables_and_removes_dump_on_timeout(
+    mariadb_target: MariaDBTargetModel, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    dumped_tables: list[str] = []
+
+    def run_subprocess(shell_args: str) -> str:
+        if "version()" in shell_args:
+            return "8.0.36"
+        if "SHOW FULL TABLES" in shell_args:
+            return "".join(f"table_{number}\tBASE TABLE\n" for number in range(1, 5))
+        if "--single-transaction" in shell_args:
+            table = shell_args.split()[-1]
+            dumped_tables.append(table)
+            if table == "table_1":
+                raise subprocess.TimeoutExpired(shell_args, 1)
+            time.sleep(0.2)
+        return ""
+
+    monkeypatch.setattr(core, "client_version", Mock(return_value="8.0.36"))
+    monkeypatch.setattr(core, "run_subprocess", run_subprocess)
+    target_model = mariadb_target.model_copy(
+        update={"jobs": 2, "inconsistent_parallel_jobs": True}
+    )
+    db = MariaDB(target_model=target_model)
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        db.make_backup()
+    # tables still waiting for free job are never dumped
+    assert "table_4" not in dumped_tables
+    assert not list((config.CONST_BACKUP_FOLDER_PATH / db.env_name).iterdir())
@@ -3,11 +3,12 @@
 
 
 import shlex
+from unittest.mock import MagicMock, Mock
 
 import pytest
 from freezegun import freeze_time
 
-from ogion import config, core
+from ogion import config, core, db_probes
 from ogion.backup_targets.postgresql import PostgreSQL
 from ogion.models.backup_target_models import PostgreSQLTargetModel
 
@@ -51,6 +52,65 @@ def test_run_pg_dump(postgres_target: PostgreSQLTargetModel) -> None:
     assert out_backup == out_path
 
 
+@freeze_time("2022-12-11")
+@pytest.mark.parametrize("postgres_target", ALL_POSTGRES_DBS_TARGETS)
+def test_run_pg_dump_streaming_to_zip_archive(
+    postgres_target: PostgreSQLTargetModel,
+) -> None:
+    target_model = postgres_target.model_copy(update={"streaming": True})
+    db = PostgreSQL(target_model=target_model)
+    out_backup = db.make_backup()
+
+    escaped_name = "database_12"
+    escaped_version = db.db_version.replace(".", "")
+
+    out_file = (
+        f"{db.env_name}/"
+        f"{db.env_name}_20221211_0000_{escaped_name}_{escaped_version}_{CONST_TOKEN_URLSAFE}.sql.zip"
+    )
+    out_path = config.CONST_BACKUP_FOLDER_PATH / out_file
+    assert out_backup == out_path
+    assert out_backup.exists()
+    assert not out_backup.with_suffix("").exists()
+
+
+@freeze_time("2022-12-11")
+@pytest.mark.parametrize("postgres_target", ALL_POSTGRES_DBS_TARGETS)
+@pytest.mark.parametrize(
+    "dump_format,jobs,streaming,suffix",
+    [
+        ("custom", 1, False, ".dump"),
+        ("custom", 1, True, ".dump.zip"),
+        ("directory", 2, False, ".dir"),
+    ],
+)
+def test_run_pg_dump_dump_format(
+    postgres_target: PostgreSQLTargetModel,
+    dump_format: str,
+    jobs: int,
+    streaming: bool,
+    suffix: str,
+) -> None:
+    target_model = postgres_target.model_copy(
+        update={"dump_format": dump_format, "jobs": jobs, "streaming": streaming}
+    )
+    db = PostgreSQL(target_model=target_model)
+    out_backup = db.make_backup()
+
+    escaped_name = "database_12"
+    escaped_version = db.db_version.replace(".", "")
+
+    out_file = (
+        f"{db.env_name}/"
+        f"{db.env_name}_20221211_0000_{escaped_name}_{escaped_version}_{CONST_TOKEN_URLSAFE}{suffix}"
+    )
+    out_path = config.CONST_BACKUP_FOLDER_PATH / out_file
+    assert out_backup == out_path
+    assert out_backup.exists()
+    if dump_format == "directory":
+        assert (out_backup / "toc.dat").is_file()
+
+
 @pytest.mark.parametrize("postgres_target", ALL_POSTGRES_DBS_TARGETS)
 def test_end_to_end_successful_restore_after_backup(
     postgres_target: PostgreSQLTargetModel,
@@ -111,3 +171,24 @@ def test_end_to_end_successful_restore_after_backup(
         "  2 | rafsaf         |  24\n"
         "(2 rows)\n\n"
     )
+
+
+@pytest.mark.parametrize("postgres_target", ALL_POSTGRES_DBS_TARGETS[:1])
+def test_postgres_probe_checks_version_in_process_before_backup(
+    postgres_target: PostgreSQLTargetModel, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    psycopg = Mock()
+    cursor = MagicMock()
+    cursor.fetchone.side_effect = [
+        ("PostgreSQL 16.2 on x86_64",),
+        ("PostgreSQL 16.3 on x86_64",),
+    ]
+    psycopg.connect.return_value.cursor.return_value = cursor
+    cursor.__enter__.return_value = cursor
+    monkeypatch.setattr(db_probes, "psycopg", psycopg)
+
+    db = PostgreSQL(target_model=postgres_target)
+    assert db.db_version == "16.2"
+    db.make_backup()
+    assert db.db_version == "16.3"
+    psycopg.connect.assert_called_once()
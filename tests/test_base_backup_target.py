@@ -11,7 +11,7 @@ from ogion.models.backup_target_models import TargetModel
 
 
 @freeze_time("2023-05-03 17:58")
-def test_base_backup_target_next_backup() -> None:
+def test_base_backup_target_first_backup_time() -> None:
     class MyTargetModel(BaseBackupTarget):
         def _backup(self) -> Path:
             return Path(__file__)
@@ -25,10 +25,19 @@ def test_base_backup_target_next_backup() -> None:
     assert target.env_name == "env"
     assert target.last_backup_time == datetime(2023, 5, 3, 17, 58, tzinfo=UTC)
     assert target.next_backup_time == datetime(2023, 5, 3, 17, 59, tzinfo=UTC)
-    assert not target.next_backup()
-    assert target.last_backup_time == datetime(2023, 5, 3, 17, 58, tzinfo=UTC)
-    assert target.next_backup_time == datetime(2023, 5, 3, 17, 59, tzinfo=UTC)
-    with freeze_time("2023-05-03 17:59:02"):
-        assert target.next_backup()
-        assert target.last_backup_time == datetime(2023, 5, 3, 17, 59, tzinfo=UTC)
-        assert target.next_backup_time == datetime(2023, 5, 3, 18, 0, tzinfo=UTC)
+
+
+@freeze_time("2023-05-03 17:58")
+def test_base_backup_target_schedule_next_backup() -> None:
+    class MyTargetModel(BaseBackupTarget):
+        def _backup(self) -> Path:
+            return Path(__file__)
+
+    target = MyTargetModel(
+        target_model=TargetModel(cron_rule="*/5 * * * *", env_name="env")
+    )
+    assert target.next_backup_time == datetime(2023, 5, 3, 18, 0, tzinfo=UTC)
+    with freeze_time("2023-05-03 18:11:02"):
+        target.schedule_next_backup()
+        assert target.last_backup_time == datetime(2023, 5, 3, 18, 0, tzinfo=UTC)
+        assert target.next_backup_time == datetime(2023, 5, 3, 18, 15, tzinfo=UTC)
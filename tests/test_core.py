@@ -1,13 +1,21 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import hashlib
+import io
 import os
 import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import IO
 from unittest.mock import Mock
 
 import pytest
 from freezegun import freeze_time
+from pydantic import SecretStr
 from pytest import LogCaptureFixture
 
 from ogion import config, core
@@ -38,15 +46,95 @@ def test_run_subprocess_fail(caplog: LogCaptureFixture) -> None:
 
 
 def test_run_subprocess_success(caplog: LogCaptureFixture) -> None:
-    core.run_subprocess("echo 'welcome'")
+    assert core.run_subprocess("echo 'welcome'; echo 'progress' >&2") == "welcome\n"
     assert caplog.messages == [
-        "run_subprocess running: 'echo 'welcome''",
+        "run_subprocess running: 'echo 'welcome'; echo 'progress' >&2'",
+        "run_subprocess stderr: progress",
         "run_subprocess finished with status 0",
         "run_subprocess stdout: welcome\n",
-        "run_subprocess stderr: ",
     ]
 
 
+def test_run_subprocess_keeps_only_tail_of_stderr(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "SUBPROCESS_OUTPUT_TAIL_KB", 1)
+    with pytest.raises(core.CoreSubprocessError) as err:
+        core.run_subprocess('for i in $(seq 1000); do echo "line $i" >&2; done; exit 1')
+    stderr = str(err.value)
+    assert stderr.startswith("(output truncated to last 1024 bytes)\n")
+    assert stderr.endswith("line 999\nline 1000\n")
+    assert "line 1\n" not in stderr
+
+
+def test_run_subprocess_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config.options, "SUBPROCESS_TIMEOUT_SECS", 0.1)
+    with pytest.raises(subprocess.TimeoutExpired):
+        core.run_subprocess("exec sleep 5")
+
+
+def test_client_version_runs_command_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    run_subprocess_mock = Mock(return_value="psql (PostgreSQL) 17.0")
+    monkeypatch.setattr(core, "run_subprocess", run_subprocess_mock)
+    monkeypatch.setattr(core, "_client_versions", {})
+
+    for _ in range(3):
+        assert core.client_version("psql -V") == "psql (PostgreSQL) 17.0"
+    run_subprocess_mock.assert_called_once_with("psql -V")
+
+
+def test_client_version_runs_different_commands_at_once(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    started = {"psql -V": threading.Event(), "mariadb -V": threading.Event()}
+
+    def run_subprocess(command: str) -> str:
+        started[command].set()
+        # both commands must be running to finish
+        assert all(event.wait(timeout=5) for event in started.values())
+        return command
+
+    monkeypatch.setattr(core, "run_subprocess", run_subprocess)
+    monkeypatch.setattr(core, "_client_versions", {})
+
+    with ThreadPoolExecutor(max_workers=len(started)) as executor:
+        assert list(executor.map(core.client_version, started)) == list(started)
+
+
+def test_client_version_runs_failed_command_again(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    run_subprocess_mock = Mock(
+        side_effect=[core.CoreSubprocessError("fail"), "psql (PostgreSQL) 17.0"]
+    )
+    monkeypatch.setattr(core, "run_subprocess", run_subprocess_mock)
+    monkeypatch.setattr(core, "_client_versions", {})
+
+    with pytest.raises(core.CoreSubprocessError):
+        core.client_version("psql -V")
+    assert core.client_version("psql -V") == "psql (PostgreSQL) 17.0"
+
+
+def test_output_tail_truncates_long_line(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config.options, "SUBPROCESS_OUTPUT_TAIL_KB", 1)
+    tail = core.OutputTail()
+    tail.append(b"a" * 2000 + b"end")
+    assert tail.truncated
+    assert tail.text().endswith("a" * (1024 - len("end")) + "end")
+
+
+def test_reserve_upload_memory(monkeypatch: pytest.MonkeyPatch) -> None:
+    with core.reserve_upload_memory(1024):
+        pass
+
+    budget = core.ResourceBudget(total=1024)
+    monkeypatch.setattr(core, "upload_memory_budget", budget)
+    reserved = 256
+    with core.reserve_upload_memory(reserved):
+        assert budget._free == budget.total - reserved
+    assert budget._free == budget.total
+
+
 @freeze_time("2022-12-11")
 def test_get_new_backup_path() -> None:
     new_path = core.get_new_backup_path("env_name", "db_string")
@@ -87,6 +175,272 @@ def test_run_create_zip_archive_can_be_unzipped_using_unzip(tmp_path: Path) -> N
     assert fake_backup_file.read_text() == "xxxąć”©#$%"
 
 
+def test_run_create_zip_archive_skips_already_created_zip_archive(
+    tmp_path: Path,
+) -> None:
+    fake_backup_file = tmp_path / "fake_backup.sql"
+    fake_backup_file.write_text("abcdefghijk\n12345")
+    archive_file = core.run_create_zip_archive(fake_backup_file)
+
+    assert core.run_create_zip_archive(archive_file) == archive_file
+
+
+@pytest.mark.parametrize("integrity", [True, False])
+def test_run_create_zip_archive_from_stdout_can_be_unzipped_using_unzip(
+    tmp_path: Path, integrity: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_SKIP_INTEGRITY_CHECK", integrity)
+    fake_backup_file = tmp_path / "test_archive.sql"
+
+    archive_file = core.run_create_zip_archive_from_stdout(
+        "echo 'xxxąć”©#$%' && echo 'verbose output' >&2", fake_backup_file
+    )
+    assert archive_file == tmp_path / "test_archive.sql.zip"
+    assert not fake_backup_file.exists()
+
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(f"unzip -P {passwd} -d {tmp_path} {archive_file}")
+
+    assert fake_backup_file.read_text() == "xxxąć”©#$%\n"
+
+
+@pytest.mark.parametrize("from_stdout", [True, False])
+def test_run_create_zip_archive_7z_format_can_be_extracted_using_7zip(
+    tmp_path: Path, from_stdout: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_ARCHIVE_FORMAT", "7z")
+    fake_backup_file = tmp_path / "test_archive.sql"
+    if from_stdout:
+        archive_file = core.run_create_zip_archive_from_stdout(
+            "echo 'xxxąć”©#$%'", fake_backup_file
+        )
+    else:
+        fake_backup_file.write_text("xxxąć”©#$%\n")
+        archive_file = core.run_create_zip_archive(fake_backup_file)
+        fake_backup_file.unlink()
+    assert archive_file == tmp_path / "test_archive.sql.7z"
+    assert core.run_create_zip_archive(archive_file) == archive_file
+
+    # file names are encrypted too
+    with pytest.raises(core.CoreSubprocessError):
+        core.run_subprocess(
+            f"{config.options.seven_zip_bin_path} l -p'wrong' {archive_file}"
+        )
+
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(
+        f"{config.options.seven_zip_bin_path} x -p{passwd} -o{tmp_path} {archive_file}"
+    )
+    assert fake_backup_file.read_text() == "xxxąć”©#$%\n"
+
+
+def test_run_create_zip_archive_from_stdout_fail_removes_archive(
+    tmp_path: Path,
+) -> None:
+    fake_backup_file = tmp_path / "test_archive.sql"
+
+    with pytest.raises(core.CoreSubprocessError, match="dump failed"):
+        core.run_create_zip_archive_from_stdout(
+            "echo 'partial' && echo 'dump failed' >&2 && exit 1", fake_backup_file
+        )
+    assert not (tmp_path / "test_archive.sql.zip").exists()
+
+
+@pytest.mark.parametrize("from_stdout", [True, False])
+def test_run_create_zip_archive_checksum_integrity_check_saves_md5(
+    tmp_path: Path, from_stdout: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    run_subprocess_mock = Mock(side_effect=core.run_subprocess)
+    monkeypatch.setattr(core, "run_subprocess", run_subprocess_mock)
+    fake_backup_file = tmp_path / "test_archive.sql"
+    if from_stdout:
+        archive_file = core.run_create_zip_archive_from_stdout(
+            "echo 'xxxąć”©#$%'", fake_backup_file
+        )
+    else:
+        fake_backup_file.write_text("xxxąć”©#$%\n")
+        archive_file = core.run_create_zip_archive(fake_backup_file)
+        fake_backup_file.unlink()
+
+    # archive is not read again with 7-zip test command
+    run_subprocess_mock.assert_not_called()
+    md5 = hashlib.md5(archive_file.read_bytes(), usedforsecurity=False).hexdigest()
+    assert core.pop_zip_archive_md5(archive_file) == md5
+    assert core.pop_zip_archive_md5(archive_file) is None
+
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(f"unzip -P {passwd} -d {tmp_path} {archive_file}")
+    assert fake_backup_file.read_text() == "xxxąć”©#$%\n"
+
+
+def test_run_create_zip_archive_checksum_integrity_check_fail_removes_archive(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+
+    with pytest.raises(core.CoreSubprocessError):
+        core.run_create_zip_archive(tmp_path / "missing")
+    assert not (tmp_path / "missing.zip").exists()
+    assert core.pop_zip_archive_md5(tmp_path / "missing.zip") is None
+
+
+def test_verify_zip_archive_md5(tmp_path: Path, caplog: LogCaptureFixture) -> None:
+    zip_file = tmp_path / "file.zip"
+    core.verify_zip_archive_md5(zip_file, "abc", "abc")
+    assert "md5 matches uploaded file" in caplog.text
+    with pytest.raises(core.ZipArchiveIntegrityError, match="cannot be verified"):
+        core.verify_zip_archive_md5(zip_file, "abc", None)
+    with pytest.raises(core.ZipArchiveIntegrityError, match="does not match"):
+        core.verify_zip_archive_md5(zip_file, "abc", "abd")
+
+
+def test_run_create_zip_archive_checksum_integrity_check_rejects_7z_format() -> None:
+    with pytest.raises(ValueError, match="ZIP_INTEGRITY_CHECK=checksum"):
+        config.Settings(
+            BACKUP_PROVIDER="name=debug",
+            ZIP_ARCHIVE_PASSWORD=SecretStr("pass"),
+            ZIP_INTEGRITY_CHECK="checksum",
+            ZIP_ARCHIVE_FORMAT="7z",
+        )
+
+
+def test_run_create_zip_archive_from_stdout_timeout_removes_archive(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "SUBPROCESS_TIMEOUT_SECS", 1)
+    fake_backup_file = tmp_path / "test_archive.sql"
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        core.run_create_zip_archive_from_stdout("exec sleep 10", fake_backup_file)
+    assert not (tmp_path / "test_archive.sql.zip").exists()
+
+
+def test_wait_for_archiver_shares_timeout_of_producer_and_archiver(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "SUBPROCESS_TIMEOUT_SECS", 1.5)
+    producer = subprocess.Popen("exec sleep 1", shell=True, stderr=subprocess.PIPE)
+    archiver = subprocess.Popen(
+        "exec sleep 2", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+    # each of them alone finishes within timeout
+    with pytest.raises(subprocess.TimeoutExpired):
+        core._wait_for_archiver(archiver, tmp_path / "file.zip", "test", producer)
+    assert archiver.returncode is not None
+
+
+@pytest.mark.parametrize("integrity_check", ["test", "checksum"])
+def test_run_create_zip_archive_from_writer_can_be_unzipped_using_unzip(
+    tmp_path: Path, integrity_check: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", integrity_check)
+    fake_backup_file = tmp_path / "test_archive.tar"
+
+    def writer(stream: IO[bytes]) -> None:
+        stream.write("xxxąć”©#$%".encode())
+
+    archive_file = core.run_create_zip_archive_from_writer(writer, fake_backup_file)
+    assert archive_file == tmp_path / "test_archive.tar.zip"
+    assert not fake_backup_file.exists()
+    assert (core.pop_zip_archive_md5(archive_file) is None) == (
+        integrity_check == "test"
+    )
+
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(f"unzip -P {passwd} -d {tmp_path} {archive_file}")
+    assert fake_backup_file.read_text() == "xxxąć”©#$%"
+
+
+def test_run_create_zip_archive_from_writer_fail_removes_archive(
+    tmp_path: Path,
+) -> None:
+    def writer(stream: IO[bytes]) -> None:
+        stream.write(b"partial")
+        raise ValueError("writer failed")
+
+    with pytest.raises(ValueError, match="writer failed"):
+        core.run_create_zip_archive_from_writer(writer, tmp_path / "test_archive.tar")
+    assert not (tmp_path / "test_archive.tar.zip").exists()
+
+
+@pytest.mark.parametrize("archive_first", [True, False])
+def test_open_zip_archive_stream_can_be_unzipped_using_unzip(
+    tmp_path: Path, archive_first: bool
+) -> None:
+    fake_backup_file = tmp_path / "test_archive"
+    fake_backup_file.write_text("xxxąć”©#$%")
+    if archive_first:
+        fake_backup_file = core.run_create_zip_archive(fake_backup_file)
+
+    with core.open_zip_archive_stream(fake_backup_file) as archive_stream:
+        archive_bytes = archive_stream.read(100) + archive_stream.read()
+
+    archive_file = tmp_path / "streamed.zip"
+    archive_file.write_bytes(archive_bytes)
+    out_path = tmp_path / "out"
+
+    passwd = shlex.quote(config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value())
+    core.run_subprocess(f"unzip -P {passwd} -d {out_path} {archive_file}")
+
+    assert (out_path / "test_archive").read_text() == "xxxąć”©#$%"
+
+
+def test_open_zip_archive_stream_fail_on_missing_file(tmp_path: Path) -> None:
+    with pytest.raises(core.CoreSubprocessError):
+        with core.open_zip_archive_stream(tmp_path / "missing") as archive_stream:
+            archive_stream.read()
+
+
+def test_open_zip_archive_stream_reraise_consumer_error(tmp_path: Path) -> None:
+    fake_backup_file = tmp_path / "test_archive"
+    fake_backup_file.write_bytes(os.urandom(1024 * 1024))
+
+    with pytest.raises(ValueError):
+        with core.open_zip_archive_stream(fake_backup_file) as archive_stream:
+            archive_stream.read(10)
+            raise ValueError()
+
+
+def test_zip_archive_stream_can_seek_only_within_last_read_chunk() -> None:
+    archive_stream = core.ZipArchiveStream(io.BytesIO(b"0123456789"))
+    assert archive_stream.readable()
+    assert not archive_stream.seekable()
+
+    assert archive_stream.read(4) == b"0123"
+    assert archive_stream.read(4) == b"4567"
+    with pytest.raises(io.UnsupportedOperation):
+        archive_stream.seek(3)
+    with pytest.raises(io.UnsupportedOperation):
+        archive_stream.seek(0, io.SEEK_END)
+
+    archive_stream.seek(5)
+    assert archive_stream.read(1) == b"5"
+    archive_stream.seek(-1, io.SEEK_CUR)
+    assert archive_stream.read(2) == b"56"
+    archive_stream.seek(5)
+    assert archive_stream.read() == b"56789"
+    assert archive_stream.tell() == len(b"0123456789")
+    # data read again after seek is hashed only once
+    md5 = hashlib.md5(b"0123456789", usedforsecurity=False).hexdigest()
+    assert archive_stream.md5() == md5
+
+
+def test_zip_archive_stream_computes_md5_of_parts() -> None:
+    archive_stream = core.ZipArchiveStream(io.BytesIO(b"0123456789"), 4)
+    assert archive_stream.part_md5s() == []
+
+    assert archive_stream.read(3) == b"012"
+    assert archive_stream.read(3) == b"345"
+    archive_stream.seek(4)
+    assert archive_stream.read() == b"456789"
+    assert archive_stream.part_md5s() == [
+        hashlib.md5(part, usedforsecurity=False).digest()
+        for part in [b"0123", b"4567", b"89"]
+    ]
+
+
 test_data = [
     (
         [
@@ -149,6 +503,16 @@ test_data = [
         ],
         True,
     ),
+    (
+        [
+            (
+                "POSTGRESQL_FIRST_DB",
+                "host=localhost port=5432 password=secret cron_rule=* * * * * "
+                "streaming=true",
+            ),
+        ],
+        True,
+    ),
     (
         [
             (
@@ -217,3 +581,162 @@ def test_create_backup_targets(
     else:
         with pytest.raises(Exception):
             core.create_target_models()
+
+
+def test_thread_budget_caps_threads_to_total() -> None:
+    thread_budget = core.ResourceBudget(total=4)
+    with thread_budget.acquire(16) as threads:
+        assert threads == thread_budget.total
+
+
+def test_thread_budget_waits_for_free_threads_in_order() -> None:
+    thread_budget = core.ResourceBudget(total=4)
+    acquired: list[str] = []
+
+    def acquire(name: str, threads: int) -> None:
+        with thread_budget.acquire(threads):
+            acquired.append(name)
+
+    with thread_budget.acquire(3):
+        big = threading.Thread(target=acquire, args=("big", 4))
+        big.start()
+        time.sleep(0.05)
+        # fits in free thread, but must wait for big one queued before
+        small = threading.Thread(target=acquire, args=("small", 1))
+        small.start()
+        time.sleep(0.05)
+        assert acquired == []
+    big.join(timeout=1)
+    small.join(timeout=1)
+    assert acquired == ["big", "small"]
+
+
+def test_bandwidth_limiter_shares_limit_between_reads(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sleep_mock = Mock()
+    monkeypatch.setattr(time, "sleep", sleep_mock)
+    monkeypatch.setattr(time, "monotonic", Mock(return_value=100.0))
+    limiter = core.BandwidthLimiter(max_bandwidth=1000)
+
+    limiter.consume(500)
+    sleep_mock.assert_not_called()
+    # second read waits for the first one, third for both
+    limiter.consume(1000)
+    limiter.consume(0)
+    limiter.consume(250)
+    assert [sleep_call.args for sleep_call in sleep_mock.call_args_list] == [
+        (0.5,),
+        (1.5,),
+    ]
+
+
+def test_bandwidth_limiter_without_max_bandwidth_does_not_wait(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sleep_mock = Mock()
+    monkeypatch.setattr(time, "sleep", sleep_mock)
+    limiter = core.BandwidthLimiter(max_bandwidth=None)
+    limiter.consume(10**9)
+    limiter.consume(10**9)
+    sleep_mock.assert_not_called()
+
+
+def test_throttled_reader_consumes_read_bytes_in_all_limiters() -> None:
+    limiters = [Mock(), Mock()]
+    stream = io.BytesIO(b"abcdef")
+    reader = core.ThrottledReader(stream, limiters)  # type: ignore[arg-type]
+
+    assert reader.readable() and reader.seekable()
+    assert reader.read(4) == b"abcd"
+    assert reader.tell() == len(b"abcd")
+    assert reader.seek(1) == 1
+    assert reader.read() == b"bcdef"
+    for limiter in limiters:
+        assert limiter.consume.call_args_list == [((4,),), ((5,),)]
+
+
+@pytest.mark.parametrize(
+    "global_max_bandwidth,max_bandwidth,expected",
+    [
+        (None, None, []),
+        (None, 10, [10]),
+        (20, None, [20]),
+        (20, 10, [20, 10]),
+    ],
+)
+def test_get_upload_bandwidth_limiters(
+    global_max_bandwidth: int | None,
+    max_bandwidth: int | None,
+    expected: list[int],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    upload_bandwidth = core.BandwidthLimiter(global_max_bandwidth)
+    monkeypatch.setattr(core, "upload_bandwidth", upload_bandwidth)
+    limiters = core.get_upload_bandwidth_limiters(max_bandwidth)
+    assert [limiter.max_bandwidth for limiter in limiters] == expected
+    if global_max_bandwidth is not None:
+        assert limiters[0] is upload_bandwidth
+
+
+@pytest.mark.parametrize("target_threads,threads", [(None, 1), (3, 3)])
+def test_run_create_zip_archive_uses_target_zip_archive_threads(
+    tmp_path: Path,
+    target_threads: int | None,
+    threads: int,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    run_subprocess_mock = Mock(side_effect=core.run_subprocess)
+    monkeypatch.setattr(core, "run_subprocess", run_subprocess_mock)
+    monkeypatch.setattr(core, "zip_archive_thread_budget", core.ResourceBudget(8))
+    fake_backup_file = tmp_path / "fake_backup"
+    fake_backup_file.write_text("abc")
+
+    if target_threads is None:
+        core.run_create_zip_archive(fake_backup_file)
+    else:
+        with core.use_zip_archive_threads(target_threads):
+            core.run_create_zip_archive(fake_backup_file)
+
+    assert f"-mmt={threads} " in run_subprocess_mock.call_args_list[0].args[0]
+    assert core.zip_archive_threads.get() is None
+
+
+def test_map_io_returns_results_in_order_with_max_workers() -> None:
+    running: list[int] = []
+    max_running: list[int] = []
+    lock = threading.Lock()
+
+    def work(item: int) -> tuple[int, str]:
+        with lock:
+            running.append(item)
+            max_running.append(len(running))
+        time.sleep(0.01 * (item % 3))
+        with lock:
+            running.remove(item)
+        return item, threading.current_thread().name
+
+    threading.current_thread().name = "Thread-target"
+    try:
+        results = core.map_io(work, range(10), max_workers=2)
+    finally:
+        threading.current_thread().name = "MainThread"
+    assert [item for item, _ in results] == list(range(10))
+    # logs of io threads show name of thread that started the work
+    assert {thread_name for _, thread_name in results} == {"Thread-target"}
+    assert max(max_running) <= len(["first", "second"])
+    assert all(thread.name.startswith("io") for thread in core.io_threads)
+
+
+def test_map_io_stops_after_first_failure() -> None:
+    started: list[int] = []
+
+    def work(item: int) -> int:
+        started.append(item)
+        if item == 1:
+            raise ValueError(item)
+        return item
+
+    with pytest.raises(ValueError):
+        core.map_io(work, range(10), max_workers=1)
+    assert started == [0, 1]
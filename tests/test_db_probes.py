@@ -0,0 +1,116 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from unittest.mock import MagicMock, Mock
+
+import pytest
+from pydantic import SecretStr
+
+from ogion import db_probes
+from ogion.models.backup_target_models import (
+    MariaDBTargetModel,
+    MySQLTargetModel,
+    PostgreSQLTargetModel,
+)
+
+
+def connection(*rows: tuple[str] | Exception) -> MagicMock:
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchone.side_effect = rows
+    return conn
+
+
+def test_connection_probe_reuses_connection() -> None:
+    conn = connection(("PostgreSQL 16.2 on x86_64",), ("PostgreSQL 16.3 on x86_64",))
+    connect = Mock(return_value=conn)
+    probe = db_probes.ConnectionProbe(connect)
+
+    assert probe.version() == "PostgreSQL 16.2 on x86_64"
+    assert probe.version() == "PostgreSQL 16.3 on x86_64"
+    connect.assert_called_once()
+
+
+def test_connection_probe_reconnects_once_when_connection_is_broken() -> None:
+    broken = connection(("8.0.36",), ConnectionError("server closed the connection"))
+    broken.close.side_effect = OSError("already closed")
+    connect = Mock(side_effect=[broken, connection(("8.0.37",))])
+    probe = db_probes.ConnectionProbe(connect)
+
+    assert probe.version() == "8.0.36"
+    assert probe.version() == "8.0.37"
+    assert connect.call_count == len([broken, "new connection"])
+
+
+def test_connection_probe_raises_when_new_connection_fails() -> None:
+    connect = Mock(return_value=connection(ConnectionError("access denied")))
+    probe = db_probes.ConnectionProbe(connect)
+
+    with pytest.raises(ConnectionError):
+        probe.version()
+    connect.assert_called_once()
+
+
+def test_probes_are_none_without_drivers(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(db_probes, "psycopg", None)
+    monkeypatch.setattr(db_probes, "pymysql", None)
+    password = SecretStr("secret")
+
+    assert (
+        db_probes.postgres_probe(
+            PostgreSQLTargetModel(
+                env_name="pg", cron_rule="* * * * *", password=password
+            )
+        )
+        is None
+    )
+    assert (
+        db_probes.mysql_probe(
+            MySQLTargetModel(env_name="mysql", cron_rule="* * * * *", password=password)
+        )
+        is None
+    )
+
+
+def test_postgres_probe_connects_with_psycopg(monkeypatch: pytest.MonkeyPatch) -> None:
+    psycopg = Mock()
+    psycopg.connect.return_value = connection(("PostgreSQL 16.2 on x86_64",))
+    monkeypatch.setattr(db_probes, "psycopg", psycopg)
+    target_model = PostgreSQLTargetModel(
+        env_name="pg", cron_rule="* * * * *", password=SecretStr("secret")
+    )
+
+    probe = db_probes.postgres_probe(target_model)
+    assert probe is not None
+    assert probe.version() == "PostgreSQL 16.2 on x86_64"
+    psycopg.connect.assert_called_once_with(
+        host="localhost",
+        port=5432,
+        user="postgres",
+        password="secret",
+        dbname="postgres",
+        connect_timeout=db_probes.CONNECT_TIMEOUT_SECS,
+        autocommit=True,
+    )
+
+
+def test_mysql_probe_connects_with_pymysql(monkeypatch: pytest.MonkeyPatch) -> None:
+    pymysql = Mock()
+    pymysql.connect.return_value = connection(("11.3.2-MariaDB",))
+    monkeypatch.setattr(db_probes, "pymysql", pymysql)
+    target_model = MariaDBTargetModel(
+        env_name="mariadb", cron_rule="* * * * *", password=SecretStr("secret")
+    )
+
+    probe = db_probes.mysql_probe(target_model)
+    assert probe is not None
+    assert probe.version() == "11.3.2-MariaDB"
+    pymysql.connect.assert_called_once_with(
+        host="localhost",
+        port=3306,
+        user="root",
+        password="secret",
+        database="mariadb",
+        connect_timeout=db_probes.CONNECT_TIMEOUT_SECS,
+        autocommit=True,
+    )
@@ -0,0 +1,122 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import os
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+
+from ogion import config, fingerprint
+
+
+@pytest.fixture
+def source_folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "source"
+    (folder / "nested").mkdir(parents=True)
+    (folder / "file.txt").write_text("abc")
+    (folder / "nested" / "other.txt").write_text("ąćź")
+    return folder
+
+
+def test_compute_fingerprint_is_stable(source_folder: Path) -> None:
+    digest, entries = fingerprint.compute_fingerprint(source_folder, {})
+    assert fingerprint.compute_fingerprint(source_folder, entries)[0] == digest
+    assert fingerprint.compute_fingerprint(source_folder, {})[0] == digest
+    assert sorted(entries) == ["file.txt", "nested", "nested/other.txt"]
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda folder: (folder / "file.txt").write_text("abd"),
+        lambda folder: (folder / "new.txt").write_text(""),
+        lambda folder: (folder / "nested" / "other.txt").unlink(),
+        lambda folder: (folder / "empty").mkdir(),
+        lambda folder: (folder / "file.txt").rename(folder / "renamed.txt"),
+        lambda folder: (folder / "link").symlink_to(folder / "file.txt"),
+        lambda folder: (folder / "file.txt").chmod(0o600),
+    ],
+)
+def test_compute_fingerprint_detects_changes(
+    source_folder: Path, change: Callable[[Path], Any]
+) -> None:
+    digest, _ = fingerprint.compute_fingerprint(source_folder, {})
+    change(source_folder)
+    assert fingerprint.compute_fingerprint(source_folder, {})[0] != digest
+
+
+def test_compute_fingerprint_reuses_hash_of_files_with_same_stat(
+    source_folder: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    _, entries = fingerprint.compute_fingerprint(source_folder, {})
+    file_sha256_mock = Mock(side_effect=fingerprint._file_sha256)
+    monkeypatch.setattr(fingerprint, "_file_sha256", file_sha256_mock)
+
+    fingerprint.compute_fingerprint(source_folder, entries)
+    file_sha256_mock.assert_not_called()
+
+    # same size and content but modified, only this file is read again
+    file = source_folder / "file.txt"
+    os.utime(file, ns=(0, 0))
+    fingerprint.compute_fingerprint(source_folder, entries)
+    file_sha256_mock.assert_called_once_with(file)
+
+
+def test_compute_fingerprint_of_single_file(source_folder: Path) -> None:
+    file = source_folder / "file.txt"
+    digest, entries = fingerprint.compute_fingerprint(file, {})
+    assert list(entries) == ["file.txt"]
+    file.write_text("abd")
+    assert fingerprint.compute_fingerprint(file, {})[0] != digest
+
+
+def test_fingerprint_cache_is_unchanged_only_after_commit(
+    source_folder: Path,
+) -> None:
+    cache = fingerprint.FingerprintCache("env", source_folder)
+    assert cache.path == config.CONST_CONFIG_FOLDER_PATH / "env.fingerprint.json"
+    assert not cache.is_unchanged("s3://bucket")
+    assert not cache.is_unchanged("s3://bucket")
+
+    cache.commit()
+    assert cache.is_unchanged("s3://bucket")
+    assert fingerprint.FingerprintCache("env", source_folder).is_unchanged(
+        "s3://bucket"
+    )
+
+    (source_folder / "file.txt").write_text("abd")
+    assert not cache.is_unchanged("s3://bucket")
+
+
+def test_fingerprint_cache_commit_without_fingerprint_does_nothing(
+    source_folder: Path,
+) -> None:
+    cache = fingerprint.FingerprintCache("env", source_folder)
+    cache.commit()
+    assert not cache.path.exists()
+
+
+def test_fingerprint_cache_ignores_invalid_file(source_folder: Path) -> None:
+    cache = fingerprint.FingerprintCache("env", source_folder)
+    cache.path.write_text("{invalid")
+    assert not cache.is_unchanged("s3://bucket")
+    cache.commit()
+    assert cache.is_unchanged("s3://bucket")
+
+
+def test_fingerprint_cache_is_changed_for_other_provider_location(
+    source_folder: Path,
+) -> None:
+    cache = fingerprint.FingerprintCache("env", source_folder)
+    assert not cache.is_unchanged("s3://bucket")
+    cache.commit()
+    assert cache.is_unchanged("s3://bucket")
+
+    assert not cache.is_unchanged("gs://bucket")
+    assert not cache.is_unchanged("gs://bucket")
+    cache.commit()
+    assert cache.is_unchanged("gs://bucket")
+    assert not cache.is_unchanged("s3://bucket")
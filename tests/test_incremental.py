@@ -0,0 +1,112 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+from pathlib import Path
+
+import pytest
+
+from ogion import config, core, incremental
+
+
+@pytest.fixture
+def source_folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "source"
+    (folder / "nested").mkdir(parents=True)
+    (folder / "file.txt").write_text("abc")
+    (folder / "nested" / "other.txt").write_text("ąćź")
+    return folder
+
+
+def test_stat_entries(source_folder: Path) -> None:
+    entries = incremental.stat_entries(source_folder)
+    assert sorted(entries) == ["file.txt", "nested", "nested/other.txt"]
+    assert entries["nested"][3] == 1
+    assert entries["file.txt"][1:] == [
+        len("abc"),
+        (source_folder / "file.txt").stat().st_ino,
+        0,
+    ]
+
+
+def test_incremental_backup_full_backup_every(source_folder: Path) -> None:
+    full_backup_every = 3
+    incremental_backup = incremental.IncrementalBackup(
+        "env", source_folder, full_backup_every=full_backup_every
+    )
+    assert incremental_backup.path == (
+        config.CONST_CONFIG_FOLDER_PATH / "env.incremental.json"
+    )
+    backup_types: list[str] = []
+    for number in range(7):
+        out_path = config.CONST_BACKUP_FOLDER_PATH / f"backup_{number}"
+        if incremental_backup.next_backup_is_full():
+            incremental_backup.start_full_backup(out_path)
+            backup_types.append("full")
+        else:
+            incremental_backup.create_differential_backup(out_path)
+            backup_types.append("diff")
+        incremental_backup.commit()
+
+    assert backup_types == ["full", "diff", "diff", "full", "diff", "diff", "full"]
+
+
+def test_incremental_backup_is_full_until_full_backup_is_committed(
+    source_folder: Path,
+) -> None:
+    incremental_backup = incremental.IncrementalBackup("env", source_folder, 7)
+    incremental_backup.start_full_backup(config.CONST_BACKUP_FOLDER_PATH / "full")
+    assert incremental_backup.next_backup_is_full()
+    incremental_backup.commit()
+    assert not incremental_backup.next_backup_is_full()
+    incremental_backup.commit()
+    assert not incremental_backup.next_backup_is_full()
+
+
+def test_incremental_backup_differential_contains_only_changes(
+    source_folder: Path,
+) -> None:
+    incremental_backup = incremental.IncrementalBackup("env", source_folder, 7)
+    incremental_backup.start_full_backup(config.CONST_BACKUP_FOLDER_PATH / "full")
+    incremental_backup.commit()
+
+    (source_folder / "file.txt").write_text("abcd")
+    (source_folder / "nested" / "other.txt").unlink()
+    (source_folder / "new" / "empty").mkdir(parents=True)
+    (source_folder / "new" / "new.txt").write_text("new")
+
+    out_path = config.CONST_BACKUP_FOLDER_PATH / "diff"
+    incremental_backup.create_differential_backup(out_path)
+    staged = sorted(str(path.relative_to(out_path)) for path in out_path.rglob("*"))
+    assert staged == [
+        incremental.MANIFEST_NAME,
+        "file.txt",
+        "new",
+        "new/empty",
+        "new/new.txt",
+    ]
+    assert (out_path / "file.txt").read_text() == "abcd"
+    manifest = json.loads((out_path / incremental.MANIFEST_NAME).read_text())
+    assert manifest == {"full_backup_name": "full", "deleted": ["nested/other.txt"]}
+
+    zip_file = core.run_create_zip_archive(out_path)
+    password = config.options.ZIP_ARCHIVE_PASSWORD.get_secret_value()
+    zip_listing = core.run_subprocess(
+        f"{config.options.seven_zip_bin_path} l -p{password} {zip_file}"
+    )
+    assert "diff/new/new.txt" in zip_listing
+    assert "diff/nested" not in zip_listing
+
+
+def test_incremental_backup_commit_without_backup_does_nothing(
+    source_folder: Path,
+) -> None:
+    incremental_backup = incremental.IncrementalBackup("env", source_folder, 7)
+    incremental_backup.commit()
+    assert not incremental_backup.path.exists()
+
+
+def test_incremental_backup_ignores_invalid_state(source_folder: Path) -> None:
+    incremental_backup = incremental.IncrementalBackup("env", source_folder, 7)
+    incremental_backup.path.write_text('{"unknown": 1}')
+    assert incremental_backup.next_backup_is_full()
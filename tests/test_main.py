@@ -2,6 +2,7 @@
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 import sys
+import threading
 from pathlib import Path
 from typing import Any, NoReturn
 from unittest.mock import Mock
@@ -9,9 +10,13 @@ from unittest.mock import Mock
 import google.cloud.storage as cloud_storage
 import pytest
 
-from ogion import config, core, main
+from ogion import config, core, main, metrics, scheduler
 from ogion.models import upload_provider_models
-from ogion.notifications.notifications_context import NotificationsContext
+from ogion.notifications import notifications_context
+from ogion.notifications.notifications_context import (
+    NotificationQueue,
+    NotificationsContext,
+)
 from ogion.upload_providers.debug import UploadProviderLocalDebug
 from ogion.upload_providers.google_cloud_storage import UploadProviderGCS
 
@@ -45,6 +50,16 @@ def test_backup_targets(monkeypatch: pytest.MonkeyPatch) -> None:
     assert len(targets) == len(models)
 
 
+def test_backup_targets_keeps_order_of_target_models(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    models = [FILE_1, FOLDER_1] * 5
+    monkeypatch.setattr(config.options, "SETUP_TARGETS_WORKERS", 3)
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=models))
+    targets = main.backup_targets()
+    assert [target.target_model for target in targets] == models
+
+
 def test_empty_backup_targets_raise_runtime_error(
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
@@ -100,6 +115,67 @@ def test_main_single(monkeypatch: pytest.MonkeyPatch) -> None:
     assert count == len(target_envs)
 
 
+def test_main_submits_due_targets_to_backup_scheduler(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    monkeypatch.setattr(config.options, "BACKUP_PROVIDER", "name=debug")
+    monkeypatch.setattr(main, "exit_event", threading.Event())
+
+    def dummy_shutdown() -> NoReturn:
+        sys.exit(0)
+
+    def dummy_wait_for_due_targets(
+        self: scheduler.CronTimer, exit_event: threading.Event
+    ) -> list[Any]:
+        exit_event.set()
+        return [target for _, _, target in self._heap]
+
+    monkeypatch.setattr(main, "shutdown", dummy_shutdown)
+    monkeypatch.setattr(
+        scheduler.CronTimer, "wait_for_due_targets", dummy_wait_for_due_targets
+    )
+    submit_mock = Mock()
+    monkeypatch.setattr(scheduler.BackupScheduler, "submit", submit_mock)
+    monkeypatch.setattr(
+        core,
+        "create_target_models",
+        Mock(return_value=[FILE_1, FOLDER_1]),
+    )
+    with pytest.raises(SystemExit):
+        main.main()
+
+    assert submit_mock.call_count == len([FILE_1, FOLDER_1])
+
+
+def test_main_sends_fail_message_before_exit_on_setup_failure(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    monkeypatch.setattr(config.options, "BACKUP_PROVIDER", "name=nonexistent")
+    monkeypatch.setattr(config.options, "NOTIFICATIONS_DIGEST_SECS", 0.1)
+    system = Mock(min_interval_secs=0)
+    monkeypatch.setattr(
+        notifications_context, "queue", NotificationQueue(systems=[system])
+    )
+
+    with pytest.raises(KeyError):
+        main.main()
+    system.send.assert_called_once()
+
+
+def test_wait_for_notifications_warns_on_timeout(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    queue_mock = Mock()
+    queue_mock.join.return_value = False
+    monkeypatch.setattr(notifications_context, "queue", queue_mock)
+
+    main.wait_for_notifications(1)
+    queue_mock.join.assert_called_once_with(timeout=1)
+    assert "notifications were not sent in 1s" in caplog.text
+
+
 def test_main_debug_notifications(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setattr(sys, "argv", ["main.py", "--debug-notifications"])
 
@@ -122,7 +198,7 @@ def test_run_backup_notifications_fail_message_is_fired_when_it_fails(
     clean_side_effect: Any | None,
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
-    fail_message_mock = Mock()
+    fail_message_mock = Mock(return_value="fail message")
     monkeypatch.setattr(NotificationsContext, "create_fail_message", fail_message_mock)
     monkeypatch.setattr(
         core,
@@ -142,6 +218,147 @@ def test_run_backup_notifications_fail_message_is_fired_when_it_fails(
     fail_message_mock.assert_called_once()
 
 
+def test_run_backup_skips_unchanged_target(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.txt").write_text("abc")
+    target_model = FOLDER_1.model_copy(
+        update={"abs_path": source, "skip_unchanged": True}
+    )
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=[target_model]))
+    target = main.backup_targets()[0]
+    provider = UploadProviderLocalDebug(upload_provider_models.DebugProviderModel())
+    post_save_mock = Mock(side_effect=provider.post_save)
+    monkeypatch.setattr(provider, "post_save", post_save_mock)
+
+    main.run_backup(target=target, provider=provider)
+    post_save_mock.assert_called_once()
+    main.run_backup(target=target, provider=provider)
+    post_save_mock.assert_called_once()
+
+    (source / "file.txt").write_text("abcd")
+    main.run_backup(target=target, provider=provider)
+    assert post_save_mock.call_count == len(["first", "changed"])
+
+    # unchanged target is uploaded again when provider is switched
+    provider.location = "s3://bucket/path"
+    main.run_backup(target=target, provider=provider)
+    main.run_backup(target=target, provider=provider)
+    assert post_save_mock.call_count == len(["first", "changed", "switched"])
+
+
+def test_run_backup_does_not_save_fingerprint_when_upload_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    source = tmp_path / "source"
+    source.mkdir()
+    target_model = FOLDER_1.model_copy(
+        update={"abs_path": source, "skip_unchanged": True}
+    )
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=[target_model]))
+    target = main.backup_targets()[0]
+    provider = UploadProviderLocalDebug(upload_provider_models.DebugProviderModel())
+    monkeypatch.setattr(provider, "_post_save", Mock(side_effect=ValueError()))
+
+    with pytest.raises(ValueError):
+        main.run_backup(target=target, provider=provider)
+    assert not target.is_unchanged_since_last_backup(provider.location)
+
+
+def test_run_backup_makes_backup_when_resume_upload_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fail_message_mock = Mock(return_value="fail message")
+    monkeypatch.setattr(NotificationsContext, "create_fail_message", fail_message_mock)
+    source = tmp_path / "source"
+    source.mkdir()
+    target_model = FOLDER_1.model_copy(update={"abs_path": source})
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=[target_model]))
+    target = main.backup_targets()[0]
+    provider = UploadProviderLocalDebug(upload_provider_models.DebugProviderModel())
+    assert provider.resume_upload(target.env_name) is None
+    monkeypatch.setattr(provider, "_resume_upload", Mock(side_effect=ValueError()))
+    post_save_mock = Mock(side_effect=provider.post_save)
+    monkeypatch.setattr(provider, "post_save", post_save_mock)
+
+    main.run_backup(target=target, provider=provider)
+    fail_message_mock.assert_called_once()
+    post_save_mock.assert_called_once()
+
+
+def test_run_backup_records_metrics(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    registry = metrics.MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    source = tmp_path / "file.txt"
+    source.write_text("abc")
+    target_model = FILE_1.model_copy(
+        update={"abs_path": source, "skip_unchanged": True}
+    )
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=[target_model]))
+    target = main.backup_targets()[0]
+    provider = UploadProviderLocalDebug(upload_provider_models.DebugProviderModel())
+
+    main.run_backup(target=target, provider=provider)
+    backup_metrics = registry._last[target.env_name]
+    assert backup_metrics.status == "success"
+    assert sorted(backup_metrics.stage_seconds) == sorted(metrics.STAGES)
+    assert backup_metrics.raw_bytes == len("abc")
+    assert backup_metrics.compressed_bytes is not None
+    assert backup_metrics.cleanup_listed == 1
+
+    main.run_backup(target=target, provider=provider)
+    assert registry._last[target.env_name].status == "skipped"
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_run_backup_of_streaming_or_directory_target_records_no_raw_bytes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, streaming: bool
+) -> None:
+    registry = metrics.MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.txt").write_text("abc")
+    target_model = FOLDER_1.model_copy(
+        update={"abs_path": source, "streaming": streaming}
+    )
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=[target_model]))
+    target = main.backup_targets()[0]
+    provider = UploadProviderLocalDebug(upload_provider_models.DebugProviderModel())
+
+    main.run_backup(target=target, provider=provider)
+    backup_metrics = registry._last[target.env_name]
+    assert backup_metrics.status == "success"
+    assert backup_metrics.raw_bytes is None
+    assert backup_metrics.compressed_bytes is not None
+    assert f'ogion_backup_raw_bytes{{target="{target.env_name}"}}' not in (
+        registry.render()
+    )
+    assert "ogion_backup_compression_ratio{" not in registry.render()
+
+
+def test_main_starts_and_stops_metrics_server(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["main.py", "--single"])
+    monkeypatch.setattr(config.options, "BACKUP_PROVIDER", "name=debug")
+    monkeypatch.setattr(config.options, "METRICS_PORT", 9090)
+    monkeypatch.setattr(main, "exit_event", threading.Event())
+    monkeypatch.setattr(main, "shutdown", Mock(side_effect=SystemExit(0)))
+    start_metrics_server_mock = Mock()
+    monkeypatch.setattr(metrics, "start_metrics_server", start_metrics_server_mock)
+    monkeypatch.setattr(core, "create_target_models", Mock(return_value=[FILE_1]))
+
+    with pytest.raises(SystemExit):
+        main.main()
+    start_metrics_server_mock.assert_called_once_with(9090)
+    start_metrics_server_mock.return_value.shutdown.assert_called_once()
+
+
 def test_quit(monkeypatch: pytest.MonkeyPatch) -> None:
     exit_mock = Mock()
     monkeypatch.setattr(main, "exit_event", exit_mock)
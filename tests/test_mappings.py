@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 from collections.abc import Callable
 from typing import Any
 
@@ -9,7 +12,11 @@ from ogion.config import BackupTargetEnum, UploadProviderEnum
 from ogion.models import backup_target_models, upload_provider_models
 from ogion.models.models_mapping import get_provider_map, get_target_map
 from ogion.upload_providers.base_provider import BaseUploadProvider
-from ogion.upload_providers.providers_mapping import get_provider_cls_map
+from ogion.upload_providers.debug import UploadProviderLocalDebug
+from ogion.upload_providers.providers_mapping import (
+    get_provider_cls,
+    get_provider_cls_map,
+)
 
 
 def test_get_target_map_contains_all_enums_and_has_valid_value_types() -> None:
@@ -61,3 +68,27 @@ def test_all_mappings_value_classes_are_unique(
 ) -> None:
     values = list(mapping_func().values())
     assert len(values) == len(set(values))
+
+
+def test_get_provider_cls_returns_class_of_provider() -> None:
+    assert get_provider_cls(UploadProviderEnum.LOCAL_FILES_DEBUG) is (
+        UploadProviderLocalDebug
+    )
+
+
+def test_main_does_not_import_cloud_providers_sdk() -> None:
+    script = (
+        "import sys\n"
+        "from ogion import main\n"
+        "main.backup_provider()\n"
+        "print([m for m in ('boto3', 'google.cloud.storage', 'azure.storage.blob')"
+        " if m in sys.modules])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=os.environ | {"BACKUP_PROVIDER": "name=debug"},
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,138 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import json
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+
+from ogion import config, metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch: pytest.MonkeyPatch) -> metrics.MetricsRegistry:
+    registry = metrics.MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+    return registry
+
+
+def test_track_stage_excludes_nested_stages(monkeypatch: pytest.MonkeyPatch) -> None:
+    clock = iter([0.0, 1.0, 4.0, 10.0])
+    monkeypatch.setattr("time.monotonic", lambda: next(clock))
+
+    with metrics.track_backup("env") as backup_metrics:
+        with metrics.track_stage("upload"):
+            with metrics.track_stage("archive"):
+                pass
+
+    assert backup_metrics.status == "success"
+    assert backup_metrics.stage_seconds == {"archive": 3.0, "upload": 7.0}
+
+
+def test_track_stage_outside_of_backup_is_noop() -> None:
+    with metrics.track_stage("upload"):
+        metrics.record_compressed_bytes(1)
+        metrics.record_cleanup(1, 0)
+
+
+def test_track_backup_records_failed_backup(
+    registry: metrics.MetricsRegistry,
+) -> None:
+    with pytest.raises(ValueError), metrics.track_backup("env"):
+        raise ValueError()
+
+    assert registry._last["env"].status == "failed"
+    assert registry._totals == {("env", "failed"): 1}
+
+
+def test_track_backup_keeps_skipped_status(
+    registry: metrics.MetricsRegistry,
+) -> None:
+    with metrics.track_backup("env") as backup_metrics:
+        backup_metrics.status = "skipped"
+
+    last = registry.last("env")
+    assert last is not None and last.status == "skipped"
+    assert registry.last("other_env") is None
+
+
+def test_backup_metrics_ratios() -> None:
+    backup_metrics = metrics.BackupMetrics(env_name="env")
+    assert backup_metrics.compression_ratio is None
+    assert backup_metrics.upload_bytes_per_second is None
+
+    backup_metrics.raw_bytes = 4 * 1024 * 1024
+    backup_metrics.compressed_bytes = 2 * 1024 * 1024
+    backup_metrics.stage_seconds["upload"] = 2
+    assert backup_metrics.compression_ratio == float(len("ab"))
+    assert backup_metrics.as_dict()["upload_mb_per_sec"] == 1.0
+
+
+def test_registry_appends_metrics_to_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    metrics_file = tmp_path / "metrics.jsonl"
+    monkeypatch.setattr(config.options, "METRICS_FILE", metrics_file)
+
+    for env_name in ["env_1", "env_2"]:
+        with metrics.track_backup(env_name):
+            metrics.record_compressed_bytes(10)
+            metrics.record_cleanup(3, 1)
+
+    lines = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert [line["env_name"] for line in lines] == ["env_1", "env_2"]
+    assert lines[0]["status"] == "success"
+    assert lines[0]["compressed_bytes"] == len("0123456789")
+    assert [lines[0]["cleanup_listed"], lines[0]["cleanup_deleted"]] == [3, 1]
+
+
+def test_registry_render(registry: metrics.MetricsRegistry) -> None:
+    with metrics.track_backup("env") as backup_metrics:
+        backup_metrics.raw_bytes = 20
+        metrics.record_compressed_bytes(10)
+        metrics.record_cleanup(3, 1)
+
+    rendered = registry.render()
+    assert "# TYPE ogion_backups_total counter" in rendered
+    assert 'ogion_backups_total{target="env",status="success"} 1\n' in rendered
+    assert 'ogion_backup_raw_bytes{target="env"} 20\n' in rendered
+    assert 'ogion_backup_compression_ratio{target="env"} 2.0\n' in rendered
+    assert 'ogion_backup_cleanup_objects{target="env",action="listed"} 3\n' in rendered
+    # stages that did not run are not rendered
+    assert "ogion_backup_stage_seconds{" not in rendered
+    assert "ogion_backup_upload_bytes_per_second{" not in rendered
+
+
+def test_path_size(tmp_path: Path) -> None:
+    folder = tmp_path / "folder"
+    (folder / "nested").mkdir(parents=True)
+    (folder / "file").write_bytes(b"abc")
+    (folder / "nested" / "file").write_bytes(b"de")
+
+    assert metrics.path_size(folder / "file") == len("abc")
+    assert metrics.path_size(folder) == len("abcde")
+    assert metrics.path_size(tmp_path / "missing") is None
+    (folder / "file.zip").write_bytes(b"abc")
+    assert metrics.path_size(folder / "file.zip") is None
+
+
+def test_metrics_server(registry: metrics.MetricsRegistry) -> None:
+    with metrics.track_backup("env"):
+        pass
+
+    server = metrics.start_metrics_server(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode() == registry.render()
+
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(f"{url}/other")
+        assert err.value.code == HTTPStatus.NOT_FOUND
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -5,8 +5,9 @@ from pathlib import Path
 from typing import Any
 
 import pytest
-from pydantic import ValidationError
+from pydantic import SecretStr, ValidationError
 
+from ogion import config
 from ogion.models.backup_target_models import (
     DirectoryTargetModel,
     MariaDBTargetModel,
@@ -15,6 +16,11 @@ from ogion.models.backup_target_models import (
     SingleFileTargetModel,
     TargetModel,
 )
+from ogion.models.upload_provider_models import (
+    AWSProviderModel,
+    AzureProviderModel,
+    GCSProviderModel,
+)
 
 
 @pytest.mark.parametrize(
@@ -50,6 +56,60 @@ from ogion.models.backup_target_models import (
             {"password": "secret", "env_name": "valid", "cron_rule": "5 5 * * *"},
             True,
         ),
+        (
+            PostgreSQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "dump_format": "directory",
+                "jobs": 4,
+            },
+            True,
+        ),
+        (
+            PostgreSQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "dump_format": "custom",
+                "streaming": True,
+            },
+            True,
+        ),
+        (
+            PostgreSQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "dump_format": "custom",
+                "jobs": 4,
+            },
+            False,
+        ),
+        (
+            PostgreSQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "dump_format": "directory",
+                "streaming": True,
+            },
+            False,
+        ),
+        (
+            PostgreSQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "dump_format": "tar",
+            },
+            False,
+        ),
         (
             MySQLTargetModel,
             {
@@ -70,6 +130,72 @@ from ogion.models.backup_target_models import (
             },
             True,
         ),
+        (
+            MySQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "jobs": 8,
+                "inconsistent_parallel_jobs": True,
+            },
+            True,
+        ),
+        (
+            MySQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "jobs": 8,
+            },
+            False,
+        ),
+        (
+            MySQLTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "jobs": 8,
+                "inconsistent_parallel_jobs": True,
+                "streaming": True,
+            },
+            False,
+        ),
+        (
+            MariaDBTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "jobs": 8,
+                "inconsistent_parallel_jobs": True,
+            },
+            True,
+        ),
+        (
+            MariaDBTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "jobs": 8,
+            },
+            False,
+        ),
+        (
+            MariaDBTargetModel,
+            {
+                "password": "secret",
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "jobs": 8,
+                "inconsistent_parallel_jobs": True,
+                "streaming": True,
+            },
+            False,
+        ),
         (
             SingleFileTargetModel,
             {
@@ -102,6 +228,55 @@ from ogion.models.backup_target_models import (
             },
             True,
         ),
+        (
+            DirectoryTargetModel,
+            {
+                "abs_path": Path(__file__).parent,
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "incremental": True,
+                "full_backup_every": 7,
+                "max_backups": 14,
+            },
+            True,
+        ),
+        (
+            DirectoryTargetModel,
+            {
+                "abs_path": Path(__file__).parent,
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "incremental": True,
+                "full_backup_every": 7,
+                "max_backups": 14,
+                "streaming": True,
+            },
+            False,
+        ),
+        (
+            DirectoryTargetModel,
+            {
+                "abs_path": Path(__file__).parent,
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "incremental": True,
+                "full_backup_every": 7,
+                "max_backups": 13,
+            },
+            True,
+        ),
+        (
+            DirectoryTargetModel,
+            {
+                "abs_path": Path(__file__).parent,
+                "env_name": "valid",
+                "cron_rule": "5 5 * * *",
+                "incremental": True,
+                "full_backup_every": 7,
+                "max_backups": 12,
+            },
+            False,
+        ),
     ],
 )
 def test_backup_targets(
@@ -114,3 +289,132 @@ def test_backup_targets(
     else:
         with pytest.raises(ValidationError):
             target_cls(**target_params)
+
+
+@pytest.mark.parametrize("target_cls", [MySQLTargetModel, MariaDBTargetModel])
+def test_backup_targets_inconsistent_parallel_jobs_logs_warning(
+    target_cls: type[MySQLTargetModel | MariaDBTargetModel],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    target_cls(
+        password=SecretStr("secret"),
+        env_name="valid",
+        cron_rule="5 5 * * *",
+        jobs=8,
+        inconsistent_parallel_jobs=True,
+    )
+
+    assert "tables are not consistent with each other" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "provider_cls,provider_params",
+    [
+        (
+            GCSProviderModel,
+            {
+                "bucket_name": "name",
+                "bucket_upload_path": "test",
+                "service_account_base64": "Z29vZ2xlX3NlcnZpY2VfYWNjb3VudAo=",
+            },
+        ),
+        (
+            AWSProviderModel,
+            {
+                "bucket_name": "name",
+                "bucket_upload_path": "test",
+                "key_id": "id",
+                "key_secret": "secret",
+                "region": "region",
+            },
+        ),
+        (
+            AzureProviderModel,
+            {"container_name": "name", "connect_string": "connect_string"},
+        ),
+    ],
+)
+def test_streaming_providers_cannot_use_7z_archive_format(
+    provider_cls: type[GCSProviderModel | AWSProviderModel | AzureProviderModel],
+    provider_params: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_SKIP_INTEGRITY_CHECK", True)
+    provider_cls(**provider_params, streaming=True)
+    monkeypatch.setattr(config.options, "ZIP_ARCHIVE_FORMAT", "7z")
+    provider_cls(**provider_params, streaming=False)
+    with pytest.raises(ValidationError):
+        provider_cls(**provider_params, streaming=True)
+
+
+@pytest.mark.parametrize(
+    "provider_cls,provider_params",
+    [
+        (
+            GCSProviderModel,
+            {
+                "bucket_name": "name",
+                "bucket_upload_path": "test",
+                "service_account_base64": "Z29vZ2xlX3NlcnZpY2VfYWNjb3VudAo=",
+            },
+        ),
+        (
+            AWSProviderModel,
+            {
+                "bucket_name": "name",
+                "bucket_upload_path": "test",
+                "key_id": "id",
+                "key_secret": "secret",
+                "region": "region",
+            },
+        ),
+        (
+            AzureProviderModel,
+            {"container_name": "name", "connect_string": "connect_string"},
+        ),
+    ],
+)
+def test_streaming_providers_require_checksum_or_skipped_integrity_check(
+    provider_cls: type[GCSProviderModel | AWSProviderModel | AzureProviderModel],
+    provider_params: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    provider_cls(**provider_params, streaming=False)
+    with pytest.raises(ValidationError, match="ZIP_INTEGRITY_CHECK=checksum"):
+        provider_cls(**provider_params, streaming=True)
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    provider_cls(**provider_params, streaming=True)
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "test")
+    monkeypatch.setattr(config.options, "ZIP_SKIP_INTEGRITY_CHECK", True)
+    provider_cls(**provider_params, streaming=True)
+
+
+@pytest.mark.parametrize(
+    "provider_params,global_max_bandwidth,valid",
+    [
+        ({"max_concurrency": 8}, None, True),
+        ({"max_concurrency": 1, "streaming": True, "max_bandwidth": 10}, 10, True),
+        ({"max_concurrency": 8, "streaming": True}, None, False),
+        ({"max_concurrency": 8, "max_bandwidth": 10}, None, False),
+        ({"max_concurrency": 8}, 10, False),
+    ],
+)
+def test_gcs_provider_max_concurrency(
+    provider_params: dict[str, Any],
+    global_max_bandwidth: int | None,
+    valid: bool,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "UPLOAD_MAX_BANDWIDTH", global_max_bandwidth)
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    params = {
+        "bucket_name": "name",
+        "bucket_upload_path": "test",
+        "service_account_base64": "Z29vZ2xlX3NlcnZpY2VfYWNjb3VudAo=",
+        **provider_params,
+    }
+    if valid:
+        GCSProviderModel(**params)
+    else:
+        with pytest.raises(ValidationError):
+            GCSProviderModel(**params)
@@ -1,15 +1,23 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import time
 from typing import NoReturn
 from unittest.mock import Mock
 
 import pytest
 
+from ogion import config
+from ogion.notifications import notifications_context
+from ogion.notifications.base_notification_system import RateLimitedError
+from ogion.notifications.discord import Discord
 from ogion.notifications.notifications_context import (
     PROGRAM_STEP,
+    NotificationQueue,
     NotificationsContext,
 )
+from ogion.notifications.slack import Slack
+from ogion.notifications.smtp import SMTP
 
 
 @pytest.mark.parametrize(
@@ -38,3 +46,117 @@ def test_notifications_context_send_all_notifications_on_function_fail(
         fail_func_under_tests()
 
     send_all.assert_called_once()
+
+
+def test_notifications_context_sends_summary_with_first_line_of_exception(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    send_all = Mock()
+    monkeypatch.setattr(NotificationsContext, "send_all", send_all)
+
+    with (
+        pytest.raises(ValueError),
+        NotificationsContext(step_name=PROGRAM_STEP.UPLOAD, env_name="target"),
+    ):
+        raise ValueError("first line\nsecond line")
+
+    assert send_all.call_args.kwargs["summary"] == (
+        "upload to provider, target target: ValueError: first line"
+    )
+
+
+def test_send_all_sends_to_all_notification_systems(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "NOTIFICATIONS_DIGEST_SECS", 0)
+    send_mock = Mock(return_value=True)
+    for system in ["Discord", "SMTP", "Slack"]:
+        monkeypatch.setattr(getattr(notifications_context, system), "_send", send_mock)
+
+    queue = NotificationQueue(
+        systems=[
+            Discord(),
+            SMTP(),
+            Slack(),
+        ]
+    )
+    monkeypatch.setattr(notifications_context, "queue", queue)
+
+    NotificationsContext(step_name=PROGRAM_STEP.UPLOAD).send_all("message", "summary")
+    assert queue.join(timeout=5)
+    assert [call.kwargs["message"] for call in send_mock.call_args_list] == [
+        "message",
+        "message",
+        "message",
+    ]
+
+
+def test_notification_queue_joins_messages_put_within_window(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "NOTIFICATIONS_DIGEST_SECS", 0.2)
+    system = Mock(min_interval_secs=0)
+    queue = NotificationQueue(systems=[system])
+
+    for i in range(3):
+        queue.put(f"summary {i % 2}", f"message {i}")
+    assert system.send.call_count == 0
+    assert queue.join(timeout=5)
+
+    system.send.assert_called_once()
+    message: str = system.send.call_args.args[0]
+    assert message.startswith("[FAIL] 3 failures\n")
+    assert "- summary 0 (x2)\n- summary 1\n" in message
+    for i in range(3):
+        assert f"message {i}" in message
+
+    queue.put("summary", "single message")
+    assert queue.join(timeout=5)
+    assert system.send.call_args.args[0] == "single message"
+
+
+def test_notification_queue_waits_retry_after_and_min_interval(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "NOTIFICATIONS_DIGEST_SECS", 0)
+    retry_after, min_interval_secs = 0.1, 0.1
+
+    def send(message: str) -> bool:
+        if rate_limited.send.call_count == 1:
+            queue.put("summary", "second")
+            raise RateLimitedError(retry_after)
+        return True
+
+    rate_limited = Mock(
+        min_interval_secs=min_interval_secs, send=Mock(side_effect=send)
+    )
+    other = Mock(min_interval_secs=0)
+    queue = NotificationQueue(systems=[rate_limited, other])
+
+    start = time.monotonic()
+    queue.put("summary", "first")
+    assert queue.join(timeout=5)
+
+    assert [call.args[0] for call in rate_limited.send.call_args_list] == [
+        "first",
+        "first",
+        "second",
+    ]
+    assert [call.args[0] for call in other.send.call_args_list] == ["first", "second"]
+    assert time.monotonic() - start >= retry_after + min_interval_secs
+
+
+@pytest.mark.parametrize("retry_after", [0, 1000])
+def test_notification_queue_drops_message_rate_limited_too_long(
+    monkeypatch: pytest.MonkeyPatch, retry_after: float
+) -> None:
+    monkeypatch.setattr(config.options, "NOTIFICATIONS_DIGEST_SECS", 0)
+    monkeypatch.setattr(NotificationQueue, "MAX_ATTEMPTS", 2)
+    system = Mock(
+        min_interval_secs=0, send=Mock(side_effect=RateLimitedError(retry_after))
+    )
+    queue = NotificationQueue(systems=[system])
+
+    queue.put("summary", "message")
+    assert queue.join(timeout=5)
+    assert system.send.call_count == (1 if retry_after else 2)
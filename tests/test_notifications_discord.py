@@ -7,7 +7,7 @@ import pytest
 import responses
 
 from ogion import config
-from ogion.notifications import discord
+from ogion.notifications import base_notification_system, discord
 
 discord_webhook_url = "https://discord.com/api/webhooks/12345/token"
 
@@ -27,6 +27,12 @@ def test_limit_message_limited_text_if_behind_limit() -> None:
     assert limited_message == "a" * (678 - len(trunc_text)) + trunc_text
 
 
+def test_http_session_is_shared() -> None:
+    assert base_notification_system.get_http_session() is (
+        base_notification_system.get_http_session()
+    )
+
+
 def test_discord_skip_when_no_webhook_url() -> None:
     assert discord.Discord().send(message="text") is False
 
@@ -83,3 +89,43 @@ def test_discord_cases_when_webhook_url_in_config(
 
         monkeypatch.setattr(config.options, "DISCORD_WEBHOOK_URL", webhook_url)
         assert discord.Discord().send(message="text") == sent
+
+
+@pytest.mark.parametrize(
+    "headers,retry_after",
+    [({"Retry-After": "7"}, 7), ({}, discord.RETRY_AFTER_DEFAULT_SECS)],
+)
+def test_discord_raises_rate_limited_error_on_429(
+    headers: dict[str, str], retry_after: float, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with responses.RequestsMock() as rsps:
+        rsps.add(
+            method=responses.POST,
+            url=discord_webhook_url,
+            status=429,
+            headers=headers,
+            json={"message": "You are being rate limited.", "retry_after": 7},
+        )
+        monkeypatch.setattr(config.options, "DISCORD_WEBHOOK_URL", discord_webhook_url)
+        with pytest.raises(base_notification_system.RateLimitedError) as err:
+            discord.Discord().send(message="text")
+    assert err.value.retry_after == retry_after
+
+
+@pytest.mark.parametrize(
+    "value,retry_after",
+    [
+        (None, 5),
+        ("12", 12),
+        ("-3", 0),
+        ("invalid", 5),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0),
+        ("Wed, 21 Oct 2099 07:28:00", None),
+    ],
+)
+def test_parse_retry_after(value: str | None, retry_after: float | None) -> None:
+    parsed = base_notification_system.parse_retry_after(value, default=5)
+    if retry_after is None:
+        assert parsed > 0
+    else:
+        assert parsed == retry_after
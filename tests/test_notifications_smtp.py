@@ -15,11 +15,12 @@ def test_smtp_skip_when_no_webhook_url() -> None:
     assert not smtp.SMTP().send(message="text")
 
 
-def test_smtp_work_on_smtp_client_mock(monkeypatch: pytest.MonkeyPatch) -> None:
+@pytest.fixture
+def smtp_mock(monkeypatch: pytest.MonkeyPatch) -> Mock:
     smtp_mock = Mock()
-    smtp_mock.return_value.__enter__ = Mock()
-    smtp_mock.return_value.__exit__ = Mock()
+    smtp_mock.return_value.noop.return_value = (250, b"OK")
     monkeypatch.setattr(smtplib, "SMTP", smtp_mock)
+    monkeypatch.setattr(smtp, "connection", smtp.SMTPConnection())
     monkeypatch.setattr(config.options, "SMTP_HOST", "xxxx11231453.com")
     monkeypatch.setattr(config.options, "SMTP_FROM_ADDR", "example@example.com")
     monkeypatch.setattr(config.options, "SMTP_PORT", 587)
@@ -27,5 +28,57 @@ def test_smtp_work_on_smtp_client_mock(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setattr(
         config.options, "SMTP_TO_ADDRS", "example2@example.com,example3@example.com"
     )
+    return smtp_mock
+
+
+def test_smtp_work_on_smtp_client_mock(smtp_mock: Mock) -> None:
+    assert smtp.SMTP().send(message="text")
+    server = smtp_mock.return_value
+    server.login.assert_called_once_with(user="example@example.com", password="secret")
+    assert server.sendmail.call_args.kwargs["to_addrs"] == [
+        "example2@example.com",
+        "example3@example.com",
+    ]
+
+
+def test_smtp_reuses_connection(smtp_mock: Mock) -> None:
+    assert smtp.SMTP().send(message="text")
+    assert smtp.SMTP().send(message="text")
+    smtp_mock.assert_called_once()
+    assert smtp_mock.return_value.sendmail.call_count == len(["first", "second"])
+
+
+@pytest.mark.parametrize("stale", ["noop_error", "noop_status", "keepalive"])
+def test_smtp_reconnects_when_connection_is_stale(
+    smtp_mock: Mock, monkeypatch: pytest.MonkeyPatch, stale: str
+) -> None:
+    assert smtp.SMTP().send(message="text")
+    server = smtp_mock.return_value
+    if stale == "noop_error":
+        server.noop.side_effect = smtplib.SMTPServerDisconnected()
+    elif stale == "noop_status":
+        server.noop.return_value = (421, b"closing")
+    else:
+        monkeypatch.setattr(smtp, "SMTP_KEEPALIVE_SECS", -1)
 
     assert smtp.SMTP().send(message="text")
+    assert smtp_mock.call_count == len(["first", "reconnect"])
+    server.quit.assert_called_once()
+
+
+def test_smtp_drops_connection_after_send_error(smtp_mock: Mock) -> None:
+    server = smtp_mock.return_value
+    server.sendmail.side_effect = smtplib.SMTPRecipientsRefused({})
+    assert not smtp.SMTP().send(message="text")
+    server.quit.assert_called_once()
+
+    server.sendmail.side_effect = None
+    assert smtp.SMTP().send(message="text")
+    assert smtp_mock.call_count == len(["first", "reconnect"])
+
+
+def test_smtp_closes_server_when_login_fails(smtp_mock: Mock) -> None:
+    server = smtp_mock.return_value
+    server.login.side_effect = smtplib.SMTPAuthenticationError(535, b"bad")
+    assert not smtp.SMTP().send(message="text")
+    server.close.assert_called_once()
@@ -0,0 +1,152 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from ogion.backup_targets.base_target import BaseBackupTarget
+from ogion.backup_targets.file import File
+from ogion.models.backup_target_models import SingleFileTargetModel
+from ogion.scheduler import BackupScheduler, CronTimer
+
+from .conftest import FILE_1
+
+
+def _file_target(env_name: str) -> File:
+    target_model = SingleFileTargetModel(
+        env_name=env_name, cron_rule="* * * * *", abs_path=FILE_1.abs_path
+    )
+    return File(target_model=target_model)
+
+
+def test_scheduler_runs_earliest_scheduled_backup_first() -> None:
+    exit_event = threading.Event()
+    ran: list[str] = []
+    backup_scheduler = BackupScheduler(
+        run=lambda target: ran.append(target.env_name),
+        workers=1,
+        exit_event=exit_event,
+    )
+    now = datetime.now(UTC)
+    backup_scheduler.submit(_file_target("late"), scheduled_at=now)
+    backup_scheduler.submit(
+        _file_target("early"), scheduled_at=now - timedelta(minutes=1)
+    )
+    backup_scheduler.start()
+    backup_scheduler.wait_until_idle()
+    exit_event.set()
+
+    assert ran == ["early", "late"]
+    assert backup_scheduler.pending() == 0
+
+
+def test_scheduler_never_runs_more_backups_than_workers() -> None:
+    exit_event = threading.Event()
+    lock = threading.Lock()
+    running: list[str] = []
+    max_running: list[int] = [0]
+
+    def run(target: BaseBackupTarget) -> None:
+        with lock:
+            running.append(target.env_name)
+            max_running[0] = max(max_running[0], len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(target.env_name)
+
+    workers = 2
+    backup_scheduler = BackupScheduler(run=run, workers=workers, exit_event=exit_event)
+    backup_scheduler.start()
+    for number in range(6):
+        backup_scheduler.submit(
+            _file_target(f"target_{number}"), scheduled_at=datetime.now(UTC)
+        )
+    backup_scheduler.wait_until_idle()
+    exit_event.set()
+
+    assert 0 < max_running[0] <= workers
+
+
+def test_scheduler_skips_target_already_queued() -> None:
+    exit_event = threading.Event()
+    backup_scheduler = BackupScheduler(
+        run=lambda target: None, workers=1, exit_event=exit_event
+    )
+    target = _file_target("target")
+    assert backup_scheduler.submit(target, scheduled_at=datetime.now(UTC))
+    assert not backup_scheduler.submit(target, scheduled_at=datetime.now(UTC))
+    assert backup_scheduler.pending() == 1
+
+
+def test_scheduler_worker_survives_failed_backup(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    exit_event = threading.Event()
+    ran: list[str] = []
+
+    def run(target: BaseBackupTarget) -> None:
+        ran.append(target.env_name)
+        if target.env_name == "failing":
+            raise ValueError("backup failed")
+
+    backup_scheduler = BackupScheduler(run=run, workers=1, exit_event=exit_event)
+    now = datetime.now(UTC)
+    backup_scheduler.submit(_file_target("failing"), scheduled_at=now)
+    backup_scheduler.submit(_file_target("working"), scheduled_at=now)
+    backup_scheduler.start()
+    backup_scheduler.wait_until_idle()
+    exit_event.set()
+
+    assert ran == ["failing", "working"]
+    assert "backup of target `failing` failed" in caplog.text
+
+
+def test_scheduler_wait_until_idle_returns_on_exit_event() -> None:
+    exit_event = threading.Event()
+    backup_scheduler = BackupScheduler(
+        run=lambda target: None, workers=1, exit_event=exit_event
+    )
+    backup_scheduler.submit(_file_target("target"), scheduled_at=datetime.now(UTC))
+    exit_event.set()
+    backup_scheduler.wait_until_idle()
+    assert backup_scheduler.pending() == 1
+
+
+def test_cron_timer_returns_due_targets_and_reschedules_only_them() -> None:
+    now = datetime.now(UTC)
+    due_target = _file_target("due")
+    due_target.next_backup_time = now - timedelta(seconds=1)
+    not_due_target = _file_target("not_due")
+    not_due_target.next_backup_time = now + timedelta(hours=1)
+    cron_timer = CronTimer([not_due_target, due_target])
+
+    due_targets = cron_timer.wait_for_due_targets(threading.Event())
+
+    assert due_targets == [due_target]
+    assert due_target.last_backup_time == now - timedelta(seconds=1)
+    assert due_target.next_backup_time > now
+    assert not_due_target.next_backup_time == now + timedelta(hours=1)
+
+
+def test_cron_timer_sleeps_until_earliest_target_is_due() -> None:
+    target = _file_target("target")
+    target.next_backup_time = datetime.now(UTC) + timedelta(seconds=0.2)
+    cron_timer = CronTimer([target])
+
+    due_targets = cron_timer.wait_for_due_targets(threading.Event())
+
+    assert due_targets == [target]
+    assert datetime.now(UTC) >= target.last_backup_time
+
+
+def test_cron_timer_wakes_up_on_exit_event() -> None:
+    target = _file_target("target")
+    target.next_backup_time = datetime.now(UTC) + timedelta(hours=1)
+    cron_timer = CronTimer([target])
+    exit_event = threading.Event()
+    threading.Timer(0.1, exit_event.set).start()
+
+    assert cron_timer.wait_for_due_targets(exit_event) == []
@@ -1,17 +1,26 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import hashlib
+import os
 from pathlib import Path
+from typing import Any
 from unittest.mock import Mock
 
 import boto3
 import pytest
+from botocore.exceptions import ClientError
 from freezegun import freeze_time
+from moto import mock_aws
 from pydantic import SecretStr
 
+from ogion import config, core, upload_sessions
 from ogion.models.upload_provider_models import AWSProviderModel
+from ogion.upload_providers import aws_s3
 from ogion.upload_providers.aws_s3 import UploadProviderAWS
 
+real_boto3_resource = boto3.resource
+
 
 @pytest.fixture(autouse=True)
 def mock_google_storage_client(monkeypatch: pytest.MonkeyPatch) -> None:
@@ -71,6 +80,347 @@ def test_aws_post_save_with_bucket_upload_path(
     )
 
 
+def test_aws_post_save_with_upload_max_bandwidth_uploads_throttled_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    upload_bandwidth = core.BandwidthLimiter(10**9)
+    monkeypatch.setattr(core, "upload_bandwidth", upload_bandwidth)
+    aws = get_test_aws()
+    assert aws.bandwidth_limiters == [upload_bandwidth]
+    bucket_mock = Mock()
+    uploaded: list[bytes] = []
+    bucket_mock.upload_fileobj.side_effect = lambda **kwargs: uploaded.append(
+        kwargs["Fileobj"].read()
+    )
+    aws.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    aws.post_save(fake_backup_file_path)
+    bucket_mock.upload_file.assert_not_called()
+    assert uploaded == [(fake_backup_dir_path / "fake_backup.zip").read_bytes()]
+
+
+def test_aws_transfer_config_uses_upload_tuning() -> None:
+    max_bandwidth = 1000
+    aws = UploadProviderAWS(
+        AWSProviderModel(
+            bucket_name="name",
+            bucket_upload_path="test123",
+            key_id="id",
+            key_secret=SecretStr("secret"),
+            region="fake region",
+            multipart_chunksize_mb=64,
+            max_concurrency=1,
+            max_bandwidth=max_bandwidth,
+        )
+    )
+    assert aws.transfer_config.multipart_chunksize == 64 * 1024 * 1024
+    assert aws.transfer_config.multipart_threshold == 64 * 1024 * 1024
+    assert not aws.transfer_config.use_threads
+    assert aws.transfer_config.max_bandwidth == max_bandwidth
+    assert aws.bandwidth_limiters == []
+
+
+def test_aws_post_save_resumes_interrupted_multipart_upload(
+    tmp_path: Path,
+) -> None:
+    aws = get_test_aws()
+    aws.multipart_chunksize = 64
+    aws.max_concurrency = 1
+    bucket_mock = Mock()
+    bucket_mock.name = "name"
+    client_mock = bucket_mock.meta.client
+    client_mock.create_multipart_upload.return_value = {"UploadId": "upload-id"}
+    parts: dict[int, bytes] = {}
+    interrupted: list[int] = []
+
+    def upload_part(PartNumber: int, Body: bytes, **kwargs: Any) -> dict[str, str]:
+        # upload is interrupted on second part
+        if parts and not interrupted:
+            interrupted.append(PartNumber)
+            raise ValueError("killed")
+        parts[PartNumber] = Body
+        return {"ETag": f"etag{PartNumber}"}
+
+    client_mock.upload_part.side_effect = upload_part
+    aws.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+
+    with pytest.raises(ValueError):
+        aws.post_save(fake_backup_file_path)
+    assert aws.upload_sessions.pending("fake_env_name") is not None
+    assert interrupted == [2]
+    # no more parts are uploaded after failed one
+    assert sorted(parts) == [1]
+    uploaded_parts = [
+        {"PartNumber": part_number, "ETag": f"etag{part_number}"}
+        for part_number in parts
+    ]
+    client_mock.get_paginator.return_value.paginate.return_value = [
+        {"Parts": uploaded_parts}
+    ]
+
+    key = "test123/fake_env_name/fake_backup.zip"
+    assert aws.resume_upload("fake_env_name") == key
+    client_mock.create_multipart_upload.assert_called_once_with(Bucket="name", Key=key)
+    assert client_mock.upload_part.call_count == len(["1", "2", "2 again", "3"])
+    assert b"".join(parts[number] for number in sorted(parts)) == (
+        zip_file.read_bytes()
+    )
+    completed_parts = client_mock.complete_multipart_upload.call_args.kwargs[
+        "MultipartUpload"
+    ]["Parts"]
+    assert [part["PartNumber"] for part in completed_parts] == sorted(parts)
+    assert aws.upload_sessions.pending("fake_env_name") is None
+    assert aws.resume_upload("fake_env_name") is None
+
+
+@pytest.mark.parametrize(
+    "size,part_size",
+    [
+        (100, 8 * 1024 * 1024),
+        (80 * 1024**3, 9 * 1024 * 1024),
+        (400 * 1024**3, 41 * 1024 * 1024),
+    ],
+)
+def test_aws_multipart_upload_keeps_parts_within_s3_limit(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, size: int, part_size: int
+) -> None:
+    aws = get_test_aws()
+    aws.bucket = Mock()
+    aws.bucket.meta.client.create_multipart_upload.return_value = {
+        "UploadId": "upload-id"
+    }
+    upload_parts_mock = Mock(return_value={})
+    monkeypatch.setattr(upload_sessions, "upload_parts", upload_parts_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    # sparse file, nothing is written to disk
+    with open(zip_file, "wb") as file:
+        file.truncate(size)
+
+    aws._upload_multipart(zip_file, "key")
+    session: upload_sessions.UploadSession = upload_parts_mock.call_args.args[0]
+    assert session.part_size == part_size
+    assert session.parts_count() <= aws_s3.MAX_PARTS
+
+
+def test_aws_resume_upload_starts_again_when_multipart_upload_is_gone(
+    tmp_path: Path,
+) -> None:
+    aws = get_test_aws()
+    aws.multipart_chunksize = 64
+    bucket_mock = Mock()
+    client_mock = bucket_mock.meta.client
+    client_mock.create_multipart_upload.return_value = {"UploadId": "upload-id"}
+    client_mock.upload_part.return_value = {"ETag": "etag"}
+    client_mock.get_paginator.return_value.paginate.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchUpload"}}, "ListParts"
+    )
+    aws.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    zip_file.write_bytes(os.urandom(100))
+    aws.upload_sessions.start(
+        zip_file, "test123/fake_env_name/fake_backup.zip", 64, "old-upload-id"
+    )
+
+    aws.resume_upload("fake_env_name")
+    client_mock.abort_multipart_upload.assert_called_once_with(
+        Bucket=bucket_mock.name,
+        Key="test123/fake_env_name/fake_backup.zip",
+        UploadId="old-upload-id",
+    )
+    client_mock.create_multipart_upload.assert_called_once()
+    assert client_mock.upload_part.call_count == len(["first", "second"])
+
+
+def test_aws_resume_upload_drops_session_when_it_fails(tmp_path: Path) -> None:
+    aws = get_test_aws()
+    aws.multipart_chunksize = 64
+    bucket_mock = Mock()
+    bucket_mock.meta.client.create_multipart_upload.side_effect = ValueError()
+    aws.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    zip_file.write_bytes(os.urandom(100))
+    aws.upload_sessions.start(zip_file, "other_key", 64, "upload-id")
+
+    with pytest.raises(ValueError):
+        aws.resume_upload("fake_env_name")
+    assert aws.upload_sessions.pending("fake_env_name") is None
+
+
+@pytest.mark.parametrize("drop_path", ["changed_archive", "failed_resume"])
+def test_aws_resume_upload_aborts_dropped_multipart_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, drop_path: str
+) -> None:
+    monkeypatch.setattr(boto3, "resource", real_boto3_resource)
+    with mock_aws():
+        aws = UploadProviderAWS(
+            AWSProviderModel(
+                bucket_name="name",
+                bucket_upload_path="test123",
+                key_id="id",
+                key_secret=SecretStr("secret"),
+                region="us-east-1",
+            )
+        )
+        aws.multipart_chunksize = 64
+        aws.bucket.create()
+        client = aws.bucket.meta.client
+
+        fake_backup_dir_path = tmp_path / "fake_env_name"
+        fake_backup_dir_path.mkdir()
+        zip_file = fake_backup_dir_path / "fake_backup.zip"
+        zip_file.write_bytes(os.urandom(100))
+        key = "test123/fake_env_name/fake_backup.zip"
+        upload_id = client.create_multipart_upload(Bucket="name", Key=key)["UploadId"]
+        aws.upload_sessions.start(zip_file, key, 64, upload_id)
+
+        if drop_path == "changed_archive":
+            zip_file.write_bytes(os.urandom(100))
+            assert aws.resume_upload("fake_env_name") is None
+        else:
+            monkeypatch.setattr(client, "upload_part", Mock(side_effect=ValueError))
+            with pytest.raises(ValueError):
+                aws.resume_upload("fake_env_name")
+
+        assert "Uploads" not in client.list_multipart_uploads(Bucket="name")
+        assert aws.upload_sessions.pending("fake_env_name") is None
+
+
+def test_aws_post_save_streaming_uploads_zip_archive_stream(tmp_path: Path) -> None:
+    aws = get_test_aws()
+    aws.streaming = True
+    bucket_mock = Mock()
+    uploaded: list[bytes] = []
+    bucket_mock.upload_fileobj.side_effect = lambda **kwargs: uploaded.append(
+        kwargs["Fileobj"].read()
+    )
+    aws.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    assert aws.post_save(fake_backup_file_path) == (
+        "test123/fake_env_name/fake_backup.zip"
+    )
+    assert not (fake_backup_dir_path / "fake_backup.zip").exists()
+    assert uploaded[0].startswith(b"PK")
+    bucket_mock.upload_fileobj.assert_called_once()
+    bucket_mock.Object.assert_not_called()
+
+
+def test_aws_post_save_streaming_removes_incomplete_upload(tmp_path: Path) -> None:
+    aws = get_test_aws()
+    aws.streaming = True
+    bucket_mock = Mock()
+    aws.bucket = bucket_mock
+
+    with pytest.raises(core.CoreSubprocessError):
+        aws.post_save(tmp_path / "missing_backup")
+    bucket_mock.Object.assert_called_once_with(
+        f"test123/{tmp_path.name}/missing_backup.zip"
+    )
+    bucket_mock.Object.return_value.delete.assert_called_once_with()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+@pytest.mark.parametrize("e_tag", ["md5", "corrupted", "corrupted_multipart"])
+def test_aws_post_save_checksum_integrity_check_compares_e_tag(
+    tmp_path: Path, streaming: bool, e_tag: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    aws = get_test_aws()
+    aws.streaming = streaming
+    bucket_mock = Mock()
+    e_tags = {"corrupted": '"0"', "corrupted_multipart": '"0-2"'}
+
+    def upload(**kwargs: Any) -> None:
+        data = (
+            kwargs["Fileobj"].read() if streaming else kwargs["Filename"].read_bytes()
+        )
+        md5 = hashlib.md5(data, usedforsecurity=False).hexdigest()
+        bucket_mock.Object.return_value.e_tag = e_tags.get(e_tag, f'"{md5}"')
+
+    bucket_mock.upload_fileobj.side_effect = upload
+    bucket_mock.upload_file.side_effect = upload
+    aws.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    if e_tag.startswith("corrupted"):
+        with pytest.raises(core.ZipArchiveIntegrityError):
+            aws.post_save(fake_backup_file_path)
+        bucket_mock.Object.return_value.delete.assert_called_once_with()
+    else:
+        assert aws.post_save(fake_backup_file_path) == (
+            "test123/fake_env_name/fake_backup.zip"
+        )
+        bucket_mock.Object.return_value.delete.assert_not_called()
+    assert core.pop_zip_archive_md5(fake_backup_dir_path / "fake_backup.zip") is None
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_aws_post_save_checksum_integrity_check_compares_multipart_e_tag(
+    tmp_path: Path, streaming: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    monkeypatch.setattr(boto3, "resource", real_boto3_resource)
+    with mock_aws():
+        aws = UploadProviderAWS(
+            AWSProviderModel(
+                bucket_name="name",
+                bucket_upload_path="test123",
+                key_id="id",
+                key_secret=SecretStr("secret"),
+                region="us-east-1",
+                multipart_chunksize_mb=5,
+            )
+        )
+        aws.streaming = streaming
+        aws.bucket.create()
+
+        fake_backup_dir_path = tmp_path / "fake_env_name"
+        fake_backup_dir_path.mkdir()
+        fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+        fake_backup_file_path.write_bytes(os.urandom(12 * 1024 * 1024))
+
+        key = aws.post_save(fake_backup_file_path)
+        e_tag = aws.bucket.Object(key).e_tag
+        assert e_tag.endswith('-3"')
+
+
+def test_aws_read_zip_archive_fails_when_archive_changed(tmp_path: Path) -> None:
+    aws = get_test_aws()
+    zip_file = tmp_path / "fake_backup.zip"
+    zip_file.write_bytes(b"changed")
+
+    with pytest.raises(core.ZipArchiveIntegrityError, match="computed while"):
+        aws._read_zip_archive(zip_file, "0" * 32)
+
+
 class ItemInS3:
     def __init__(self, name: str) -> None:
         self.key = name
@@ -1,15 +1,21 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import hashlib
+from datetime import datetime, timedelta
+from http import HTTPStatus
 from pathlib import Path
+from typing import Any
 from unittest.mock import Mock
 
 import pytest
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobBlock, BlobServiceClient
 from freezegun import freeze_time
 from pydantic import SecretStr
 
+from ogion import config, core
 from ogion.models.upload_provider_models import AzureProviderModel
+from ogion.upload_providers import azure as azure_provider
 from ogion.upload_providers.azure import UploadProviderAzure
 
 
@@ -66,6 +72,118 @@ def test_azure_post_save_with_bucket_upload_path(
     blob_client_mock.upload_blob.assert_called_once()
 
 
+def test_azure_post_save_resumes_interrupted_staged_blocks_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(azure_provider, "MAX_SINGLE_PUT_SIZE", 64)
+    azure = get_test_azure()
+    azure.block_size = 64
+    key = "fake_env_name/fake_backup.zip"
+    blob_client_mock = Mock(blob_name=key)
+    staged: dict[str, bytes] = {}
+
+    def stage_block(block_id: str, data: bytes, **kwargs: Any) -> None:
+        # upload is interrupted on second block
+        if len(staged) == 1 and "interrupted" not in staged:
+            staged["interrupted"] = b""
+            raise ValueError("killed")
+        staged[block_id] = data
+
+    blob_client_mock.stage_block.side_effect = stage_block
+    blob_client_mock.get_block_list.side_effect = lambda block_list_type: (
+        [],
+        [BlobBlock(block_id=block_id) for block_id in staged],
+    )
+    container_client_mock = Mock()
+    container_client_mock.get_blob_client.return_value = blob_client_mock
+    monkeypatch.setattr(azure, "container_client", container_client_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+
+    with pytest.raises(ValueError):
+        azure.post_save(fake_backup_file_path)
+    assert azure.upload_sessions.pending("fake_env_name") is not None
+    # block ids not created by ogion are ignored on resume
+    # no more blocks are staged after failed one
+    assert sorted(staged) == ["00000001", "interrupted"]
+
+    assert azure.resume_upload("fake_env_name") == key
+    blob_client_mock.upload_blob.assert_not_called()
+    assert blob_client_mock.stage_block.call_count == len(["1", "2", "2 again", "3"])
+    block_ids = ["00000001", "00000002", "00000003"]
+    assert b"".join(staged[block_id] for block_id in block_ids) == (
+        zip_file.read_bytes()
+    )
+    assert [
+        block.id for block in blob_client_mock.commit_block_list.call_args.args[0]
+    ] == block_ids
+    assert azure.upload_sessions.pending("fake_env_name") is None
+    assert azure.resume_upload("fake_env_name") is None
+
+
+def test_azure_resume_upload_drops_session_when_it_fails(tmp_path: Path) -> None:
+    azure = get_test_azure()
+    azure.container_client.get_blob_client.side_effect = ValueError()  # type: ignore[attr-defined]
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    zip_file.write_bytes(b"zip")
+    azure.upload_sessions.start(zip_file, "fake_env_name/fake_backup.zip", 64, "")
+
+    with pytest.raises(ValueError):
+        azure.resume_upload("fake_env_name")
+    assert azure.upload_sessions.pending("fake_env_name") is None
+
+
+def test_azure_post_save_streaming_uploads_zip_archive_stream(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    azure = get_test_azure()
+    azure.streaming = True
+    blob_client_mock = Mock()
+    uploaded: list[bytes] = []
+    blob_client_mock.upload_blob.side_effect = lambda data, **kwargs: uploaded.append(
+        data.read()
+    )
+    container_client_mock = Mock()
+    container_client_mock.get_blob_client.return_value = blob_client_mock
+    monkeypatch.setattr(azure, "container_client", container_client_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    assert azure.post_save(fake_backup_file_path) == "fake_env_name/fake_backup.zip"
+    assert not (fake_backup_dir_path / "fake_backup.zip").exists()
+    assert uploaded[0].startswith(b"PK")
+    blob_client_mock.delete_blob.assert_not_called()
+
+
+def test_azure_post_save_streaming_removes_incomplete_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    azure = get_test_azure()
+    azure.streaming = True
+    blob_client_mock = Mock()
+    container_client_mock = Mock()
+    container_client_mock.get_blob_client.return_value = blob_client_mock
+    monkeypatch.setattr(azure, "container_client", container_client_mock)
+
+    with pytest.raises(core.CoreSubprocessError):
+        azure.post_save(tmp_path / "missing_backup")
+    blob_client_mock.delete_blob.assert_called_once_with()
+
+
+def delete_blobs(*blob_names: str, raise_on_any_failure: bool) -> list[Mock]:
+    return [Mock(status_code=HTTPStatus.ACCEPTED) for _ in blob_names]
+
+
 class AzureBlob:
     def __init__(self, blob_name: str) -> None:
         self.name = blob_name
@@ -86,12 +204,82 @@ list_blobs_long: list[AzureBlob] = [
 ]
 
 
+@pytest.mark.parametrize("content_md5", ["md5", "corrupted", None])
+def test_azure_post_save_checksum_integrity_check_compares_content_md5(
+    tmp_path: Path,
+    content_md5: str | None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    azure = get_test_azure()
+    blob_client_mock = Mock()
+
+    def upload_blob(data: Any, **kwargs: Any) -> dict[str, Any]:
+        uploaded = data.read()
+        if content_md5 == "corrupted":
+            uploaded += b"0"
+        if content_md5 is None:
+            return {}
+        return {"content_md5": hashlib.md5(uploaded, usedforsecurity=False).digest()}
+
+    blob_client_mock.upload_blob.side_effect = upload_blob
+    container_client_mock = Mock()
+    container_client_mock.get_blob_client.return_value = blob_client_mock
+    monkeypatch.setattr(azure, "container_client", container_client_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    if content_md5 == "md5":
+        assert azure.post_save(fake_backup_file_path) == (
+            "fake_env_name/fake_backup.zip"
+        )
+        blob_client_mock.delete_blob.assert_not_called()
+    else:
+        with pytest.raises(core.ZipArchiveIntegrityError):
+            azure.post_save(fake_backup_file_path)
+        blob_client_mock.delete_blob.assert_called_once_with()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_azure_post_save_checksum_integrity_check_sends_md5_of_blocks(
+    tmp_path: Path, streaming: bool, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    monkeypatch.setattr(azure_provider, "MAX_SINGLE_PUT_SIZE", 64)
+    azure = get_test_azure()
+    azure.streaming = streaming
+    azure.block_size = 64
+    blob_client_mock = Mock(blob_name="fake_env_name/fake_backup.zip")
+    blob_client_mock.upload_blob.side_effect = lambda data, **kwargs: data.read()
+    container_client_mock = Mock()
+    container_client_mock.get_blob_client.return_value = blob_client_mock
+    monkeypatch.setattr(azure, "container_client", container_client_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    assert azure.post_save(fake_backup_file_path) == "fake_env_name/fake_backup.zip"
+    if streaming:
+        upload_calls = blob_client_mock.upload_blob.call_args_list
+    else:
+        upload_calls = blob_client_mock.stage_block.call_args_list
+    assert upload_calls
+    assert all(call.kwargs["validate_content"] for call in upload_calls)
+    blob_client_mock.delete_blob.assert_not_called()
+
+
 @pytest.mark.parametrize("azure_method_name", ["_clean", "clean"])
 def test_azure_clean_file_and_short_blob_list(
     tmp_path: Path, monkeypatch: pytest.MonkeyPatch, azure_method_name: str
 ) -> None:
     azure = get_test_azure()
     container_client_mock = Mock()
+    container_client_mock.delete_blobs.side_effect = delete_blobs
     container_client_mock.list_blobs.return_value = list_blobs_short
     monkeypatch.setattr(azure, "container_client", container_client_mock)
 
@@ -107,8 +295,8 @@ def test_azure_clean_file_and_short_blob_list(
     assert not fake_backup_file_zip_path.exists()
     assert not fake_backup_file_zip_path2.exists()
 
-    container_client_mock.delete_blob.assert_called_once_with(
-        blob="fake_env_name/file_19990427_0108_dummy_xfcs.zip"
+    container_client_mock.delete_blobs.assert_called_once_with(
+        "fake_env_name/file_19990427_0108_dummy_xfcs.zip", raise_on_any_failure=False
     )
 
 
@@ -118,11 +306,13 @@ def test_azure_clean_directory_and_long_blob_list(
 ) -> None:
     azure = get_test_azure()
     container_client_mock = Mock()
+    container_client_mock.delete_blobs.side_effect = delete_blobs
     container_client_mock.list_blobs.return_value = list_blobs_long
     monkeypatch.setattr(azure, "container_client", container_client_mock)
 
-    fake_backup_dir_path = tmp_path / "fake_env_name"
-    fake_backup_dir_path.mkdir()
+    # cleanup removes everything next to backup, so it is not in tmp_path
+    fake_backup_dir_path = tmp_path / "backups" / "fake_env_name"
+    fake_backup_dir_path.mkdir(parents=True)
     fake_backup_file_zip_path = fake_backup_dir_path / "fake_backup.zip"
     fake_backup_file_zip_path.touch()
 
@@ -131,17 +321,12 @@ def test_azure_clean_directory_and_long_blob_list(
     assert not fake_backup_dir_path.exists()
     assert not fake_backup_file_zip_path.exists()
 
-    container_client_mock.delete_blob.assert_any_call(
-        blob="fake_env_name/file_20230127_0105_dummy_xfcs.zip"
-    )
-    container_client_mock.delete_blob.assert_any_call(
-        blob="fake_env_name/file_20230227_0105_dummy_xfcs.zip.zip"
-    )
-    container_client_mock.delete_blob.assert_any_call(
-        blob="fake_env_name/file_20230425_0105_dummy_xfcs.zip.zip"
-    )
-    container_client_mock.delete_blob.assert_any_call(
-        blob="fake_env_name/file_20230327_0105_dummy_xfcs.zip.zip"
+    container_client_mock.delete_blobs.assert_called_once_with(
+        "fake_env_name/file_20230127_0105_dummy_xfcs.zip",
+        "fake_env_name/file_20230227_0105_dummy_xfcs.zip.zip",
+        "fake_env_name/file_20230327_0105_dummy_xfcs.zip.zip",
+        "fake_env_name/file_20230425_0105_dummy_xfcs.zip.zip",
+        raise_on_any_failure=False,
     )
 
 
@@ -152,14 +337,58 @@ def test_azure_clean_respects_min_retention_days_param_and_not_delete_any_file(
 ) -> None:
     azure = get_test_azure()
     container_client_mock = Mock()
+    container_client_mock.delete_blobs.side_effect = delete_blobs
     container_client_mock.list_blobs.return_value = list_blobs_long
     monkeypatch.setattr(azure, "container_client", container_client_mock)
 
-    fake_backup_dir_path = tmp_path / "fake_env_name"
-    fake_backup_dir_path.mkdir()
+    # cleanup removes everything next to backup, so it is not in tmp_path
+    fake_backup_dir_path = tmp_path / "backups" / "fake_env_name"
+    fake_backup_dir_path.mkdir(parents=True)
     fake_backup_file_zip_path = fake_backup_dir_path / "fake_backup.zip"
     fake_backup_file_zip_path.touch()
 
     getattr(azure, azure_method_name)(fake_backup_dir_path, 2, 30 * 365)
 
-    container_client_mock.delete_blob.assert_not_called()
+    container_client_mock.delete_blobs.assert_not_called()
+
+
+def test_azure_clean_deletes_blobs_in_batches_and_raises_on_failed_delete(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    azure = get_test_azure()
+    container_client_mock = Mock()
+    first_day = datetime(2020, 1, 1)
+    container_client_mock.list_blobs.return_value = [
+        AzureBlob(
+            f"fake_env_name/file_{first_day + timedelta(days=days):%Y%m%d}"
+            "_0105_xfcs.zip"
+        )
+        for days in range(602)
+    ]
+
+    def delete_blobs_with_failure(
+        *blob_names: str, raise_on_any_failure: bool
+    ) -> list[Mock]:
+        status_codes = {
+            "fake_env_name/file_20200101_0105_xfcs.zip": HTTPStatus.FORBIDDEN,
+            "fake_env_name/file_20200102_0105_xfcs.zip": HTTPStatus.NOT_FOUND,
+        }
+        return [
+            Mock(status_code=status_codes.get(blob_name, HTTPStatus.ACCEPTED))
+            for blob_name in blob_names
+        ]
+
+    container_client_mock.delete_blobs.side_effect = delete_blobs_with_failure
+    monkeypatch.setattr(azure, "container_client", container_client_mock)
+
+    # cleanup removes everything next to backup, so it is not in tmp_path
+    fake_backup_dir_path = tmp_path / "backups" / "fake_env_name"
+    fake_backup_dir_path.mkdir(parents=True)
+
+    with pytest.raises(RuntimeError, match="file_20200101_0105_xfcs.zip"):
+        azure.clean(fake_backup_dir_path, 2, 0)
+    assert [
+        len(batch_call.args)
+        for batch_call in container_client_mock.delete_blobs.call_args_list
+    ] == [256, 256, 88]
+    assert "599 of 600 backups were deleted" in caplog.text
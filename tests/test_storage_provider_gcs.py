@@ -1,15 +1,29 @@
 # Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
 # GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import base64
+import hashlib
+import os
+from datetime import datetime, timedelta
+from http import HTTPStatus
 from pathlib import Path
-from unittest.mock import Mock
+from typing import Any
+from unittest.mock import MagicMock, Mock, call
 
 import google.cloud.storage as cloud_storage
+import google_crc32c
 import pytest
+import requests
 from freezegun import freeze_time
+from google.api_core.exceptions import Forbidden, GoogleAPIError
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.client import Client
 from pydantic import SecretStr
 
+from ogion import config, core
 from ogion.models.upload_provider_models import GCSProviderModel
+from ogion.upload_providers import google_cloud_storage
 from ogion.upload_providers.google_cloud_storage import UploadProviderGCS
 
 
@@ -80,6 +94,387 @@ def test_gcs_post_save_with_google_bucket_upload_path(
     )
 
 
+def test_gcs_post_save_with_max_concurrency_uploads_chunks_concurrently(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    gcs = get_test_gcs()
+    gcs.max_concurrency = 8
+    bucket_mock = Mock()
+    single_blob_mock = Mock(md5_hash=None)
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+    upload_chunks_concurrently_mock = Mock()
+    monkeypatch.setattr(
+        transfer_manager,
+        "upload_chunks_concurrently",
+        upload_chunks_concurrently_mock,
+    )
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    gcs.post_save(fake_backup_file_path)
+    upload_chunks_concurrently_mock.assert_called_once_with(
+        str(fake_backup_dir_path / "fake_backup.zip"),
+        single_blob_mock,
+        chunk_size=gcs.chunk_size_bytes,
+        worker_type=transfer_manager.THREAD,
+        max_workers=gcs.max_concurrency,
+        timeout=gcs.chunk_timeout_secs,
+    )
+    single_blob_mock.upload_from_filename.assert_not_called()
+    single_blob_mock.reload.assert_called_once_with()
+
+
+def crc32c(data: bytes) -> str:
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode()
+
+
+@pytest.mark.parametrize("uploaded_crc32c", ["crc32c", "corrupted", None])
+def test_gcs_post_save_with_max_concurrency_compares_crc32c_without_md5(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, uploaded_crc32c: str | None
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    gcs = get_test_gcs()
+    gcs.max_concurrency = 8
+    bucket_mock = Mock()
+    # xml multipart uploads are composite objects without md5
+    single_blob_mock = Mock(md5_hash=None, crc32c=None)
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+
+    def upload_chunks_concurrently(filename: str, blob: Mock, **kwargs: Any) -> None:
+        data = Path(filename).read_bytes()
+        if uploaded_crc32c == "corrupted":
+            data += b"0"
+        if uploaded_crc32c is not None:
+            single_blob_mock.reload.side_effect = lambda: setattr(
+                single_blob_mock, "crc32c", crc32c(data)
+            )
+
+    monkeypatch.setattr(
+        transfer_manager, "upload_chunks_concurrently", upload_chunks_concurrently
+    )
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    if uploaded_crc32c == "crc32c":
+        gcs.post_save(fake_backup_file_path)
+        single_blob_mock.delete.assert_not_called()
+    else:
+        with pytest.raises(core.ZipArchiveIntegrityError):
+            gcs.post_save(fake_backup_file_path)
+        single_blob_mock.delete.assert_called_once_with()
+
+
+def test_gcs_post_save_with_max_bandwidth_uploads_throttled_file(
+    tmp_path: Path,
+) -> None:
+    gcs = get_test_gcs()
+    gcs.bandwidth_limiters = [core.BandwidthLimiter(10**9)]
+    bucket_mock = Mock()
+    single_blob_mock = Mock()
+    uploaded: list[bytes] = []
+    single_blob_mock.upload_from_file.side_effect = (
+        lambda stream, **kwargs: uploaded.append(stream.read())
+    )
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    gcs.post_save(fake_backup_file_path)
+    single_blob_mock.upload_from_filename.assert_not_called()
+    assert uploaded == [(fake_backup_dir_path / "fake_backup.zip").read_bytes()]
+
+
+class FakeResumableSession:
+    """Gcs resumable upload session, interrupted on second chunk once."""
+
+    def __init__(self, status_code: int = HTTPStatus.PERMANENT_REDIRECT) -> None:
+        self.status_code = status_code
+        self.persisted = b""
+        self.interrupted = False
+        self.hashes: list[str] = []
+
+    def put(
+        self, url: str, headers: dict[str, str], timeout: int, data: bytes = b""
+    ) -> Mock:
+        content_range = headers["Content-Range"].removeprefix("bytes ")
+        size = int(content_range.split("/")[1])
+        if data:
+            if self.persisted and not self.interrupted:
+                self.interrupted = True
+                raise ValueError("killed")
+            self.persisted += data
+            if "X-Goog-Hash" in headers:
+                self.hashes.append(headers["X-Goog-Hash"])
+        if len(self.persisted) == size:
+            return Mock(status_code=HTTPStatus.OK)
+        response = Mock(status_code=self.status_code, headers={})
+        if self.persisted:
+            response.headers["Range"] = f"bytes=0-{len(self.persisted) - 1}"
+        return response
+
+
+def test_gcs_post_save_resumes_interrupted_resumable_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    gcs = get_test_gcs()
+    gcs.chunk_size_bytes = 64
+    key = "test/fake_env_name/fake_backup.zip"
+    bucket_mock = Mock()
+    single_blob_mock = Mock(md5_hash=None)
+    single_blob_mock.name = key
+    single_blob_mock.create_resumable_upload_session.return_value = "https://session"
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+    session = FakeResumableSession()
+    monkeypatch.setattr(requests, "put", session.put)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+
+    with pytest.raises(ValueError):
+        gcs.post_save(fake_backup_file_path)
+    assert gcs.upload_sessions.pending("fake_env_name") is not None
+    assert session.persisted == zip_file.read_bytes()[:64]
+
+    assert gcs.resume_upload("fake_env_name") == key
+    single_blob_mock.create_resumable_upload_session.assert_called_once_with(
+        size=zip_file.stat().st_size,
+        timeout=gcs.chunk_timeout_secs,
+        if_generation_match=0,
+    )
+    assert session.persisted == zip_file.read_bytes()
+    # crc32c of whole object includes part persisted before interruption
+    assert session.hashes == [f"crc32c={crc32c(zip_file.read_bytes())}"]
+    single_blob_mock.reload.assert_called_once_with()
+    assert gcs.upload_sessions.pending("fake_env_name") is None
+    assert gcs.resume_upload("fake_env_name") is None
+
+
+@pytest.mark.parametrize("status_code", [HTTPStatus.NOT_FOUND, HTTPStatus.GONE])
+def test_gcs_resume_upload_starts_again_when_session_expired(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, status_code: int
+) -> None:
+    gcs = get_test_gcs()
+    gcs.chunk_size_bytes = 64
+    bucket_mock = Mock()
+    single_blob_mock = Mock(md5_hash=None)
+    single_blob_mock.name = "test/fake_env_name/fake_backup.zip"
+    single_blob_mock.create_resumable_upload_session.return_value = "https://new"
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+    put_mock = Mock(
+        side_effect=[
+            Mock(status_code=status_code),
+            Mock(status_code=HTTPStatus.PERMANENT_REDIRECT, headers={}),
+            Mock(status_code=HTTPStatus.CREATED),
+        ]
+    )
+    monkeypatch.setattr(requests, "put", put_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    zip_file.write_bytes(os.urandom(100))
+    gcs.upload_sessions.start(zip_file, single_blob_mock.name, 64, "https://old")
+
+    gcs.resume_upload("fake_env_name")
+    # nothing was persisted after first chunk, so it is sent again
+    assert [put_call.args[0] for put_call in put_mock.call_args_list] == [
+        "https://old",
+        "https://new",
+        "https://new",
+    ]
+    assert [
+        len(put_call.kwargs["data"]) for put_call in put_mock.call_args_list[1:]
+    ] == [64, 64]
+
+
+def gcs_response(status_code: int, persisted: int | None = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.request = requests.Request("PUT", "https://session").prepare()
+    if persisted is not None:
+        response.headers["Range"] = f"bytes=0-{persisted - 1}"
+    return response
+
+
+def test_gcs_post_save_retries_chunk_from_offset_persisted_by_gcs(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    gcs = get_test_gcs()
+    gcs.chunk_size_bytes = 64
+    single_blob_mock = Mock(md5_hash=None)
+    single_blob_mock.name = "test/fake_env_name/fake_backup.zip"
+    single_blob_mock.create_resumable_upload_session.return_value = "https://session"
+    gcs.bucket.blob.return_value = single_blob_mock
+    monkeypatch.setattr(
+        google_cloud_storage,
+        "UPLOAD_CHUNK_RETRY",
+        google_cloud_storage.UPLOAD_CHUNK_RETRY.with_delay(initial=0, maximum=0),
+    )
+    put_mock = Mock(
+        side_effect=[
+            requests.ConnectionError("reset"),
+            # only half of first chunk was persisted
+            gcs_response(HTTPStatus.PERMANENT_REDIRECT, persisted=32),
+            gcs_response(HTTPStatus.SERVICE_UNAVAILABLE),
+            gcs_response(HTTPStatus.PERMANENT_REDIRECT, persisted=64),
+            gcs_response(HTTPStatus.OK),
+        ]
+    )
+    monkeypatch.setattr(requests, "put", put_mock)
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    zip_file.write_bytes(os.urandom(100))
+    gcs._upload_resumable(zip_file, single_blob_mock)
+
+    assert [
+        put_call.kwargs["headers"]["Content-Range"]
+        for put_call in put_mock.call_args_list
+    ] == [
+        "bytes 0-63/100",
+        "bytes */100",
+        "bytes 32-95/100",
+        "bytes */100",
+        "bytes 64-99/100",
+    ]
+    assert put_mock.call_args_list[-1].kwargs["headers"]["X-Goog-Hash"] == (
+        f"crc32c={crc32c(zip_file.read_bytes())}"
+    )
+    assert gcs.upload_sessions.pending("fake_env_name") is None
+
+
+def test_gcs_resume_upload_raises_on_session_error(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    gcs = get_test_gcs()
+    gcs.chunk_size_bytes = 64
+    key = "test/fake_env_name/fake_backup.zip"
+    gcs.bucket.blob.return_value.name = key
+    monkeypatch.setattr(
+        requests,
+        "put",
+        Mock(
+            side_effect=[
+                gcs_response(HTTPStatus.FORBIDDEN),
+                gcs_response(HTTPStatus.NOT_MODIFIED),
+            ]
+        ),
+    )
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    zip_file = fake_backup_dir_path / "fake_backup.zip"
+    zip_file.write_bytes(os.urandom(100))
+
+    for error in (Forbidden, RuntimeError):
+        gcs.upload_sessions.start(zip_file, key, 64, "https://session")
+        with pytest.raises(error):
+            gcs.resume_upload("fake_env_name")
+        assert gcs.upload_sessions.pending("fake_env_name") is None
+
+
+def test_gcs_post_save_streaming_uploads_zip_archive_stream(tmp_path: Path) -> None:
+    gcs = get_test_gcs()
+    gcs.streaming = True
+    bucket_mock = Mock()
+    single_blob_mock = Mock()
+    uploaded: list[bytes] = []
+    single_blob_mock.upload_from_file.side_effect = (
+        lambda archive_stream, **kwargs: uploaded.append(archive_stream.read())
+    )
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    assert gcs.post_save(fake_backup_file_path) == "test/fake_env_name/fake_backup.zip"
+    assert not (fake_backup_dir_path / "fake_backup.zip").exists()
+    assert uploaded[0].startswith(b"PK")
+    bucket_mock.blob.assert_called_once_with(
+        "test/fake_env_name/fake_backup.zip",
+        chunk_size=gcs.chunk_size_bytes,
+    )
+    single_blob_mock.delete.assert_not_called()
+
+
+def test_gcs_post_save_streaming_removes_incomplete_upload(tmp_path: Path) -> None:
+    gcs = get_test_gcs()
+    gcs.streaming = True
+    bucket_mock = Mock()
+    single_blob_mock = Mock()
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+
+    with pytest.raises(core.CoreSubprocessError):
+        gcs.post_save(tmp_path / "missing_backup")
+    single_blob_mock.delete.assert_called_once_with()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+@pytest.mark.parametrize("md5_hash", ["md5", "corrupted", None])
+def test_gcs_post_save_checksum_integrity_check_compares_md5_hash(
+    tmp_path: Path,
+    streaming: bool,
+    md5_hash: str | None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config.options, "ZIP_INTEGRITY_CHECK", "checksum")
+    gcs = get_test_gcs()
+    gcs.streaming = streaming
+    bucket_mock = Mock()
+    single_blob_mock = Mock()
+
+    def upload(data: Any, **kwargs: Any) -> None:
+        data = data.read() if streaming else Path(data).read_bytes()
+        if md5_hash == "corrupted":
+            data += b"0"
+        md5 = hashlib.md5(data, usedforsecurity=False).digest()
+        single_blob_mock.md5_hash = base64.b64encode(md5).decode() if md5_hash else None
+        single_blob_mock.crc32c = crc32c(data)
+
+    single_blob_mock.upload_from_file.side_effect = upload
+    single_blob_mock.upload_from_filename.side_effect = upload
+    bucket_mock.blob.return_value = single_blob_mock
+    gcs.bucket = bucket_mock
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_path = fake_backup_dir_path / "fake_backup"
+    fake_backup_file_path.write_text("abcdefghijk\n12345")
+
+    # crc32c of streamed archive cannot be computed again
+    if md5_hash == "corrupted" or (md5_hash is None and streaming):
+        with pytest.raises(core.ZipArchiveIntegrityError):
+            gcs.post_save(fake_backup_file_path)
+        single_blob_mock.delete.assert_called_once_with()
+    else:
+        assert gcs.post_save(fake_backup_file_path) == (
+            "test/fake_env_name/fake_backup.zip"
+        )
+        single_blob_mock.delete.assert_not_called()
+
+
 class BlobInCloudStorage:
     def __init__(self, blob_name: str) -> None:
         self.name = blob_name
@@ -100,6 +495,45 @@ list_blobs_long_no_upload_path: list[BlobInCloudStorage] = [
 ]
 
 
+def batch_mock(status_codes: list[int]) -> MagicMock:
+    batch = MagicMock()
+    batch._responses = [Mock(status_code=status_code) for status_code in status_codes]
+    return batch
+
+
+def test_gcs_delete_blob_batch_reads_responses_of_real_batch() -> None:
+    gcs = get_test_gcs()
+    credentials = AnonymousCredentials()  # type: ignore[no-untyped-call]
+    gcs.storage_client = Client(project="test", credentials=credentials)
+    gcs.bucket = gcs.storage_client.bucket("name")
+
+    status_codes = [HTTPStatus.NO_CONTENT, HTTPStatus.NOT_FOUND, HTTPStatus.FORBIDDEN]
+    batch_response = requests.Response()
+    batch_response.status_code = HTTPStatus.OK
+    batch_response.headers["content-type"] = 'multipart/mixed; boundary="batch"'
+    batch_response._content = (
+        "".join(
+            f"--batch\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-{i}>\r\n\r\n"
+            f"HTTP/1.1 {status_code.value} {status_code.phrase}\r\n\r\n\r\n"
+            for i, status_code in enumerate(status_codes)
+        )
+        + "--batch--\r\n"
+    ).encode()
+    make_request_mock = Mock(return_value=batch_response)
+    gcs.storage_client._base_connection._make_request = make_request_mock
+
+    assert gcs._delete_blob_batch(["blob_1", "blob_2", "blob_3"]) == ["blob_3"]
+    # newer clients may also fetch bucket metadata in background thread
+    batch_calls = [
+        request_call
+        for request_call in make_request_mock.call_args_list
+        if request_call.args[:1] == ("POST",)
+    ]
+    assert len(batch_calls) == 1
+    assert batch_calls[0].kwargs["data"].count("DELETE ") == len(status_codes)
+
+
 @pytest.mark.parametrize("gcs_method_name", ["_clean", "clean"])
 def test_gcs_clean_file_and_short_blob_list(
     tmp_path: Path, monkeypatch: pytest.MonkeyPatch, gcs_method_name: str
@@ -107,11 +541,10 @@ def test_gcs_clean_file_and_short_blob_list(
     gcs = get_test_gcs()
 
     bucket_mock = Mock()
-    storage_client_mock = Mock()
-    single_blob_mock = Mock()
+    storage_client_mock = MagicMock()
 
     storage_client_mock.list_blobs.return_value = list_blobs_short_with_upload_path
-    bucket_mock.blob.return_value = single_blob_mock
+    storage_client_mock.batch.return_value = batch_mock([HTTPStatus.NO_CONTENT])
 
     gcs.storage_client = storage_client_mock
     gcs.bucket = bucket_mock
@@ -130,10 +563,10 @@ def test_gcs_clean_file_and_short_blob_list(
     assert not fake_backup_file_zip_path.exists()
     assert not fake_backup_file_zip_path2.exists()
 
-    bucket_mock.blob.assert_called_once_with(
+    storage_client_mock.batch.assert_called_once_with(raise_exception=False)
+    bucket_mock.delete_blob.assert_called_once_with(
         "test123/fake_env_name/file_19990427_0108_dummy_xfcs.zip"
     )
-    single_blob_mock.delete.assert_called_once_with()
 
 
 @pytest.mark.parametrize("gcs_method_name", ["_clean", "clean"])
@@ -143,22 +576,22 @@ def test_gcs_clean_directory_and_long_blob_list(
     gcs = get_test_gcs()
 
     bucket_mock = Mock()
-    storage_client_mock = Mock()
-    single_blob_mock = Mock()
+    storage_client_mock = MagicMock()
 
     storage_client_mock.list_blobs.return_value = list_blobs_long_no_upload_path
-    bucket_mock.blob.return_value = single_blob_mock
+    storage_client_mock.batch.return_value = batch_mock([HTTPStatus.NO_CONTENT] * 4)
 
     gcs.storage_client = storage_client_mock
     gcs.bucket = bucket_mock
 
-    fake_backup_dir_path = tmp_path / "fake_env_name"
-    fake_backup_dir_path.mkdir()
+    # cleanup removes everything next to backup, so it is not in tmp_path
+    fake_backup_dir_path = tmp_path / "backups" / "fake_env_name"
+    fake_backup_dir_path.mkdir(parents=True)
     fake_backup_file_zip_path = fake_backup_dir_path / "fake_backup.zip"
     fake_backup_file_zip_path.touch()
     fake_backup_file_zip_path2 = fake_backup_dir_path / "fake_backup2.zip"
     fake_backup_file_zip_path2.touch()
-    fake_backup_dir_path2 = tmp_path / "fake_env_name2"
+    fake_backup_dir_path2 = tmp_path / "backups" / "fake_env_name2"
     fake_backup_dir_path2.mkdir()
     fake_backup_file_zip_path3 = fake_backup_dir_path2 / "fake_backup.zip"
     fake_backup_file_zip_path3.touch()
@@ -175,19 +608,13 @@ def test_gcs_clean_directory_and_long_blob_list(
     assert not fake_backup_file_zip_path3.exists()
     assert not fake_backup_file_zip_path4.exists()
 
-    bucket_mock.blob.assert_any_call(
-        "test123/fake_env_name/file_20230127_0105_dummy_xfcs.zip"
-    )
-    bucket_mock.blob.assert_any_call(
-        "test123/fake_env_name/file_20230227_0105_dummy_xfcs.zip.zip"
-    )
-    bucket_mock.blob.assert_any_call(
-        "test123/fake_env_name/file_20230425_0105_dummy_xfcs.zip.zip"
-    )
-    bucket_mock.blob.assert_any_call(
-        "test123/fake_env_name/file_20230327_0105_dummy_xfcs.zip.zip"
-    )
-    single_blob_mock.delete.assert_called()
+    storage_client_mock.batch.assert_called_once_with(raise_exception=False)
+    assert bucket_mock.delete_blob.call_args_list == [
+        call("test123/fake_env_name/file_20230127_0105_dummy_xfcs.zip"),
+        call("test123/fake_env_name/file_20230227_0105_dummy_xfcs.zip.zip"),
+        call("test123/fake_env_name/file_20230327_0105_dummy_xfcs.zip.zip"),
+        call("test123/fake_env_name/file_20230425_0105_dummy_xfcs.zip.zip"),
+    ]
 
 
 @freeze_time("2023-08-27")
@@ -198,11 +625,9 @@ def test_gcs_clean_respects_min_retention_days_param_and_not_delete_any_file(
     gcs = get_test_gcs()
 
     bucket_mock = Mock()
-    storage_client_mock = Mock()
-    single_blob_mock = Mock()
+    storage_client_mock = MagicMock()
 
     storage_client_mock.list_blobs.return_value = list_blobs_short_with_upload_path
-    bucket_mock.blob.return_value = single_blob_mock
 
     gcs.storage_client = storage_client_mock
     gcs.bucket = bucket_mock
@@ -216,5 +641,73 @@ def test_gcs_clean_respects_min_retention_days_param_and_not_delete_any_file(
 
     getattr(gcs, gcs_method_name)(fake_backup_file_zip_path, 2, 30 * 365)
 
-    bucket_mock.blob.assert_not_called()
-    single_blob_mock.delete.assert_not_called()
+    storage_client_mock.batch.assert_not_called()
+    bucket_mock.delete_blob.assert_not_called()
+
+
+def test_gcs_clean_deletes_blobs_in_batches_and_raises_on_failed_batch(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    gcs = get_test_gcs()
+    bucket_mock = Mock()
+    storage_client_mock = MagicMock()
+    first_day = datetime(2020, 1, 1)
+    storage_client_mock.list_blobs.return_value = [
+        BlobInCloudStorage(
+            f"test/fake_env_name/file_{first_day + timedelta(days=days):%Y%m%d}"
+            "_0105_xfcs.zip"
+        )
+        for days in range(250)
+    ]
+    # second batch fails
+    failed_batch = batch_mock([])
+    failed_batch.__exit__.side_effect = GoogleAPIError("forbidden")
+    storage_client_mock.batch.side_effect = [
+        batch_mock([HTTPStatus.NO_CONTENT] * 100),
+        failed_batch,
+        batch_mock([HTTPStatus.NO_CONTENT] * 48),
+    ]
+    gcs.storage_client = storage_client_mock
+    gcs.bucket = bucket_mock
+
+    # cleanup removes everything next to backup, so it is not in tmp_path
+    fake_backup_dir_path = tmp_path / "backups" / "fake_env_name"
+    fake_backup_dir_path.mkdir(parents=True)
+
+    with pytest.raises(RuntimeError, match="Fail to delete backups"):
+        gcs.clean(fake_backup_dir_path, 2, 0)
+    assert [
+        storage_client_mock.batch.call_count,
+        bucket_mock.delete_blob.call_count,
+    ] == [3, 248]
+    assert "148 of 248 backups were deleted" in caplog.text
+
+
+def test_gcs_clean_treats_not_found_blob_as_deleted_and_raises_on_failed_delete(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    gcs = get_test_gcs()
+    bucket_mock = Mock()
+    storage_client_mock = MagicMock()
+    storage_client_mock.list_blobs.return_value = list_blobs_long_no_upload_path
+    storage_client_mock.batch.return_value = batch_mock(
+        [
+            HTTPStatus.NO_CONTENT,
+            HTTPStatus.NOT_FOUND,
+            HTTPStatus.FORBIDDEN,
+            HTTPStatus.NO_CONTENT,
+        ]
+    )
+    gcs.storage_client = storage_client_mock
+    gcs.bucket = bucket_mock
+
+    # cleanup removes everything next to backup, so it is not in tmp_path
+    fake_backup_dir_path = tmp_path / "backups" / "fake_env_name"
+    fake_backup_dir_path.mkdir(parents=True)
+
+    with pytest.raises(
+        RuntimeError, match="test123/fake_env_name/file_20230327_0105_dummy_xfcs"
+    ):
+        gcs.clean(fake_backup_dir_path, 2, 0)
+    storage_client_mock.batch.assert_called_once_with(raise_exception=False)
+    assert "3 of 4 backups were deleted" in caplog.text
@@ -102,3 +102,20 @@ def test_local_debug_respects_min_retention_days_param_and_not_delete_any_file(
     assert fake_backup_file_zip_path.exists()
     assert fake_backup_file_zip2_path.exists()
     assert fake_backup_file_zip3_path.exists()
+
+
+@pytest.mark.parametrize("method_name", ["_clean", "clean"])
+def test_local_debug_clean_does_not_remove_streamed_zip_archive(
+    tmp_path: Path, method_name: str
+) -> None:
+    local = get_test_debug()
+
+    fake_backup_dir_path = tmp_path / "fake_env_name"
+    fake_backup_dir_path.mkdir()
+    fake_backup_file_zip_path = (
+        fake_backup_dir_path / "fake_backup_20230801_0000_file.sql.zip"
+    )
+    fake_backup_file_zip_path.touch()
+
+    getattr(local, method_name)(fake_backup_file_zip_path, 2, 1)
+    assert fake_backup_file_zip_path.exists()
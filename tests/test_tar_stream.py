@@ -0,0 +1,136 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import io
+import os
+import socket
+import tarfile
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from pytest import LogCaptureFixture
+
+from ogion import fingerprint, tar_stream
+
+
+@pytest.fixture
+def source_folder(tmp_path: Path) -> Path:
+    folder = tmp_path / "source"
+    (folder / "nested").mkdir(parents=True)
+    (folder / "empty").mkdir()
+    (folder / "file.txt").write_text("abc")
+    (folder / "nested" / "other.txt").write_bytes(os.urandom(1024 * 1024 + 1))
+    (folder / "nested" / "hardlink.txt").hardlink_to(folder / "file.txt")
+    (folder / "link").symlink_to(folder / "file.txt")
+    return folder
+
+
+@pytest.mark.parametrize("to_file", [True, False])
+def test_write_tar_stream_of_directory(
+    source_folder: Path, tmp_path: Path, to_file: bool
+) -> None:
+    tar_file = tmp_path / "out.tar"
+    if to_file:
+        # stream with file descriptor is written using sendfile
+        with open(tar_file, "wb") as stream:
+            tar_stream.write_tar_stream(source_folder, stream)
+    else:
+        bytes_stream = io.BytesIO()
+        tar_stream.write_tar_stream(source_folder, bytes_stream)
+        tar_file.write_bytes(bytes_stream.getvalue())
+
+    with tarfile.open(tar_file) as tar:
+        members = {member.name: member for member in tar.getmembers()}
+        assert sorted(members) == [
+            "source",
+            "source/empty",
+            "source/file.txt",
+            "source/link",
+            "source/nested",
+            "source/nested/hardlink.txt",
+            "source/nested/other.txt",
+        ]
+        assert members["source/empty"].isdir()
+        assert members["source/link"].issym()
+        assert members["source/link"].linkname == str(source_folder / "file.txt")
+        assert members["source/nested/hardlink.txt"].islnk()
+        assert members["source/nested/hardlink.txt"].linkname == "source/file.txt"
+
+        file = tar.extractfile("source/file.txt")
+        assert file is not None and file.read() == b"abc"
+        other = tar.extractfile("source/nested/other.txt")
+        assert other is not None
+        assert other.read() == (source_folder / "nested" / "other.txt").read_bytes()
+
+
+def test_write_tar_stream_of_single_file(source_folder: Path) -> None:
+    stream = io.BytesIO()
+    tar_stream.write_tar_stream(source_folder / "file.txt", stream)
+    stream.seek(0)
+
+    with tarfile.open(fileobj=stream) as tar:
+        assert tar.getnames() == ["file.txt"]
+
+
+def test_write_tar_stream_follows_symlink_of_target_path(
+    source_folder: Path, tmp_path: Path
+) -> None:
+    (tmp_path / "target_link").symlink_to(source_folder)
+    stream = io.BytesIO()
+    tar_stream.write_tar_stream(tmp_path / "target_link", stream)
+    stream.seek(0)
+
+    with tarfile.open(fileobj=stream) as tar:
+        assert tar.getmember("target_link").isdir()
+        assert "target_link/nested/other.txt" in tar.getnames()
+
+
+def test_write_tar_stream_pads_file_that_shrank(
+    source_folder: Path, monkeypatch: pytest.MonkeyPatch, caplog: LogCaptureFixture
+) -> None:
+    send_file_mock = Mock(side_effect=lambda path, size, stream: stream.write(b"a"))
+    monkeypatch.setattr(tar_stream, "_send_file", send_file_mock)
+    stream = io.BytesIO()
+    tar_stream.write_tar_stream(source_folder / "file.txt", stream)
+    stream.seek(0)
+
+    with tarfile.open(fileobj=stream) as tar:
+        file = tar.extractfile("file.txt")
+        assert file is not None and file.read() == b"a\0\0"
+    assert "file.txt shrank while creating tar stream" in caplog.text
+
+
+def test_write_tar_stream_skips_sockets_and_removed_files(
+    source_folder: Path, monkeypatch: pytest.MonkeyPatch, caplog: LogCaptureFixture
+) -> None:
+    with socket.socket(socket.AF_UNIX) as unix_socket:
+        unix_socket.bind(str(source_folder / "socket"))
+        walk_paths = fingerprint.walk_paths(source_folder)
+        walk_paths.append(("removed.txt", source_folder / "removed.txt"))
+        monkeypatch.setattr(tar_stream, "walk_paths", Mock(return_value=walk_paths))
+
+        stream = io.BytesIO()
+        tar_stream.write_tar_stream(source_folder, stream)
+    stream.seek(0)
+
+    with tarfile.open(fileobj=stream) as tar:
+        assert "source/socket" not in tar.getnames()
+        assert "source/removed.txt" not in tar.getnames()
+    assert "sockets cannot be archived" in caplog.text
+    assert "removed.txt removed while creating tar stream" in caplog.text
+
+
+@pytest.mark.parametrize("to_file", [True, False])
+def test_send_file_stops_at_end_of_shrunken_file(tmp_path: Path, to_file: bool) -> None:
+    file = tmp_path / "file.txt"
+    file.write_text("abc")
+    out_file = tmp_path / "out"
+    if to_file:
+        with open(out_file, "wb") as stream:
+            assert tar_stream._send_file(file, 10, stream) == len("abc")
+    else:
+        bytes_stream = io.BytesIO()
+        assert tar_stream._send_file(file, 10, bytes_stream) == len("abc")
+        out_file.write_bytes(bytes_stream.getvalue())
+    assert out_file.read_text() == "abc"
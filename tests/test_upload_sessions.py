@@ -0,0 +1,137 @@
+# Copyright: (c) 2024, Rafał Safin <rafal.safin@rafsaf.pl>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import os
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from ogion import config, core, upload_sessions
+
+
+@pytest.fixture
+def zip_file(tmp_path: Path) -> Path:
+    env_folder = tmp_path / "env"
+    env_folder.mkdir()
+    zip_file = env_folder / "backup.zip"
+    zip_file.write_bytes(b"0123456789")
+    return zip_file
+
+
+@pytest.fixture
+def sessions() -> upload_sessions.UploadSessions:
+    return upload_sessions.UploadSessions("aws")
+
+
+def test_upload_sessions_path(sessions: upload_sessions.UploadSessions) -> None:
+    assert sessions.path("env") == (
+        config.CONST_CONFIG_FOLDER_PATH / "env.aws.upload.json"
+    )
+
+
+def test_upload_sessions_start_find_and_remove(
+    sessions: upload_sessions.UploadSessions, zip_file: Path
+) -> None:
+    assert sessions.pending("env") is None
+    session = sessions.start(zip_file, "key", 4, "upload-id")
+    assert session.parts_count() == len(["0123", "4567", "89"])
+
+    assert sessions.pending("env") == session
+    assert sessions.find(zip_file, "key", 4) == session
+
+    sessions.remove("env")
+    assert sessions.pending("env") is None
+
+
+@pytest.mark.parametrize("key,part_size", [("other_key", 4), ("key", 8)])
+def test_upload_sessions_find_drops_session_of_other_upload(
+    zip_file: Path, key: str, part_size: int
+) -> None:
+    abort = Mock()
+    sessions = upload_sessions.UploadSessions("aws", abort=abort)
+    session = sessions.start(zip_file, "key", 4, "upload-id")
+
+    assert sessions.find(zip_file, key, part_size) is None
+    abort.assert_called_once_with(session)
+    assert not sessions.path("env").exists()
+
+
+@pytest.mark.parametrize("change", ["remove", "modify"])
+def test_upload_sessions_drops_session_of_missing_or_changed_archive(
+    sessions: upload_sessions.UploadSessions, zip_file: Path, change: str
+) -> None:
+    sessions.start(zip_file, "key", 4, "upload-id")
+    if change == "remove":
+        zip_file.unlink()
+    else:
+        zip_file.write_bytes(b"changed")
+    assert sessions.pending("env") is None
+    assert not sessions.path("env").exists()
+
+
+def test_upload_sessions_aborts_session_of_changed_archive(zip_file: Path) -> None:
+    abort = Mock()
+    sessions = upload_sessions.UploadSessions("aws", abort=abort)
+    session = sessions.start(zip_file, "key", 4, "upload-id")
+    zip_file.write_bytes(b"changed")
+
+    assert sessions.pending("env") is None
+    abort.assert_called_once_with(session)
+
+
+def test_upload_sessions_drop_removes_session_when_abort_fails(
+    zip_file: Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    sessions = upload_sessions.UploadSessions(
+        "aws", abort=Mock(side_effect=ValueError("gone"))
+    )
+    sessions.start(zip_file, "key", 4, "upload-id")
+
+    sessions.drop("env")
+    assert not sessions.path("env").exists()
+    assert "cannot abort upload" in caplog.text
+
+
+def test_upload_sessions_drops_invalid_session(zip_file: Path) -> None:
+    abort = Mock()
+    sessions = upload_sessions.UploadSessions("aws", abort=abort)
+    sessions.path("env").write_text('{"unknown": 1}')
+    assert sessions.pending("env") is None
+    assert not sessions.path("env").exists()
+
+    sessions.drop("env")
+    abort.assert_not_called()
+
+
+def test_read_part_consumes_bandwidth(zip_file: Path) -> None:
+    limiter = Mock()
+    assert upload_sessions.read_part(zip_file, 8, 4, [limiter]) == b"89"
+    limiter.consume.assert_called_once_with(len(b"89"))
+
+
+def test_upload_parts_uploads_only_missing_parts(
+    sessions: upload_sessions.UploadSessions, zip_file: Path
+) -> None:
+    session = sessions.start(zip_file, "key", 4, "upload-id")
+    upload_part = Mock(side_effect=lambda part_number, data: data.decode())
+
+    uploaded = upload_sessions.upload_parts(
+        session, {2}, upload_part, 4, [core.BandwidthLimiter(None)]
+    )
+    assert uploaded == {1: "0123", 3: "89"}
+    assert upload_part.call_count == len(uploaded)
+
+
+def test_upload_parts_of_empty_archive_uploads_one_part(
+    sessions: upload_sessions.UploadSessions, zip_file: Path
+) -> None:
+    with open(zip_file, "wb") as file:
+        os.ftruncate(file.fileno(), 0)
+    session = sessions.start(zip_file, "key", 4, "upload-id")
+    upload_part = Mock(return_value="etag")
+
+    assert upload_sessions.upload_parts(session, set(), upload_part, 1, []) == {
+        1: "etag"
+    }
+    upload_part.assert_called_once_with(1, b"")